@@ -1,6 +1,8 @@
 from flask import Flask, request, jsonify, abort
+from responses import init_responses
 
 app = Flask(__name__)
+init_responses(app)
 
 greetings = {
             'en': 'hello', 
@@ -0,0 +1,195 @@
+# vendored copy, the source of truth is shared/responses.py at the root of
+# the repository: edit it there and run `python shared/sync.py`
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2 has no pluggable json provider, responses are only
+    # compressed there
+    DefaultJSONProvider = None
+
+
+'''
+dumps(obj)
+    obj serialized to compact json bytes, with orjson when it is installed
+    for bodies built outside jsonify (cached menus, streamed lines)
+'''
+
+
+def dumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+'''
+FastJSONProvider
+the Flask json provider with orjson doing the serializing
+    values orjson does not know go through the provider's default(),
+    anything orjson refuses (like integers past 64 bits) and pretty
+    printed output fall back to the stdlib encoder
+'''
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+
+        def dumps(self, obj, **kwargs):
+            if kwargs.get('indent') is None:
+                try:
+                    return self._orjson(obj).decode()
+                except TypeError:
+                    pass
+            return super().dumps(obj, **kwargs)
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            if self.compact is False or (self.compact is None and
+                                         self._app.debug):
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            try:
+                body = self._orjson(obj)
+            except TypeError:
+                return super().response(*args, **kwargs)
+            return self._app.response_class(body + b'\n',
+                                            mimetype=self.mimetype)
+
+        def _orjson(self, obj):
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=self.default, option=option)
+
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/')
+
+
+'''
+ResponseCompressor
+compresses response bodies with the best encoding the client accepts,
+brotli (when installed) before gzip
+    min_size: bodies shorter than this many bytes are sent as they are
+    gzip_level, brotli_quality: compression effort
+    cache_size: compressed bodies of GET responses with a strong ETag kept
+        in memory, so a cached body (like the drinks menu) is compressed
+        once per version instead of once per request
+
+    a compressed response gets Content-Encoding and Vary: Accept-Encoding,
+    a GET or HEAD response also gets a weak ETag (the bytes differ from
+    the uncompressed ones), conditional requests with the weak tag still
+    match. ETags of other methods are left as they are, they name a
+    version for If-Match (which only compares strong tags), not the bytes
+'''
+
+
+class ResponseCompressor:
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4,
+                 cache_size=64):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encodings(self):
+        return (['br'] if brotli is not None else []) + ['gzip']
+
+    def choose(self, accept_encoding):
+        for encoding in self.encodings():
+            if accept_encoding[encoding]:
+                return encoding
+        return None
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def __call__(self, response):
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough or response.is_streamed or
+                response.status_code < 200 or response.status_code == 204 or
+                'Content-Encoding' in response.headers or
+                not response.mimetype.startswith(COMPRESSIBLE)):
+            return response
+        encoding = self.choose(request.accept_encodings)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        key = None
+        if etag and not weak and request.method == 'GET':
+            key = (request.full_path, etag, encoding)
+        compressed = self._cache.get(key) if key else None
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            if key:
+                with self._lock:
+                    self._cache[key] = compressed
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag and request.method in ('GET', 'HEAD'):
+            response.set_etag(etag, weak=True)
+        return response
+
+
+'''
+init_responses(app)
+    installs FastJSONProvider (when orjson and Flask >= 2.2 are available)
+    and compresses responses by Accept-Encoding
+    configuration, app.config first, then the environment:
+        RESPONSE_COMPRESS_MIN_SIZE: smallest body compressed, in bytes
+            (default 1024, 0 disables compression)
+        RESPONSE_GZIP_LEVEL: 1 to 9 (default 6)
+        RESPONSE_BROTLI_QUALITY: 0 to 11 (default 4)
+    returns the ResponseCompressor, or None
+'''
+
+
+def init_responses(app):
+    def setting(name, default, cast):
+        return cast(app.config.get(name, os.environ.get(name, default)))
+
+    if DefaultJSONProvider is not None and orjson is not None:
+        app.json = FastJSONProvider(app)
+
+    min_size = setting('RESPONSE_COMPRESS_MIN_SIZE', 1024, int)
+    if not min_size:
+        return None
+    compressor = ResponseCompressor(
+        min_size=min_size,
+        gzip_level=setting('RESPONSE_GZIP_LEVEL', 6, int),
+        brotli_quality=setting('RESPONSE_BROTLI_QUALITY', 4, int))
+    app.after_request(compressor)
+    return compressor
@@ -5,15 +5,16 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
-from logging import Formatter, FileHandler
+from logging import FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
 from datetime import datetime
+from request_log import init_request_log, JSONFormatter
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -43,6 +44,13 @@ class Venue(db.Model):
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
     artists = db.relationship("Artist", secondary="shows")
     genres = db.relationship("Genre", backref="venues")
+    # for the name ilike filter of the search, see migration 8b723d629f8c,
+    # and the area order of the venues page, see migration 5c1e07b9a2d4
+    __table_args__ = (
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+    )
 
 
 class Artist(db.Model):
@@ -58,6 +66,10 @@ class Artist(db.Model):
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
     venues = db.relationship('Venue', secondary="shows")
     genres = db.relationship("Genre", backref="artists")
+    __table_args__ = (
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
@@ -66,16 +78,21 @@ class Show(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
     artist = db.relationship("Artist", backref=db.backref("shows", cascade="all, delete"))
     venue = db.relationship("Venue", backref=db.backref("shows", cascade="all, delete"))
+    # the shows of one venue or artist, split or counted by start_time
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    )
 
 class Genre(db.Model):
     __tablename__ = "genres"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), index=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), index=True)
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -91,6 +108,73 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Loaders.
+#----------------------------------------------------------------------------#
+
+# the query of a venue or artist detail page, runs two statements: the
+# entity with its genres joined, then its shows with their counterpart
+# (Show.artist or Show.venue) joined
+def load_detail(model, counterpart):
+  return model.query.options(
+    db.joinedload(model.genres),
+    db.selectinload(model.shows).joinedload(counterpart))
+
+# the venues or artists with search_term in their name, one page of them
+# with their upcoming show counts, and the number of matches, from one
+# query. the ilike filter can use the trigram index on name (PostgreSQL)
+# a page past the last one has no row to carry the count, so only then
+# are the matches counted with a second query
+SEARCH_PAGE_SIZE = 20
+
+def search_by_name(model, show_key, search_term, page=1):
+  num_upcoming_shows = db.func.count(Show.id).filter(Show.start_time > datetime.now())
+  matches = model.name.ilike('%' + search_term + '%')
+  # counted after the grouping, so it is the number of matches
+  count = db.func.count().over()
+  rows = db.session.query(model.id, model.name, num_upcoming_shows, count)\
+    .outerjoin(Show, show_key == model.id)\
+    .filter(matches)\
+    .group_by(model.id)\
+    .order_by(model.name, model.id)\
+    .limit(SEARCH_PAGE_SIZE).offset((page - 1) * SEARCH_PAGE_SIZE).all()
+  if rows:
+    total = rows[0][3]
+  elif page > 1:
+    total = db.session.query(db.func.count(model.id)).filter(matches).scalar()
+  else:
+    total = 0
+  return {
+    "count": total,
+    "data": [{
+      "id": id,
+      "name": name,
+      "num_upcoming_shows": upcoming,
+    } for id, name, upcoming, _ in rows],
+    "page": page,
+    "next_page": page + 1 if page * SEARCH_PAGE_SIZE < total else None
+  }
+
+# the past and upcoming shows, by start time, split around one now()
+# counterpart is 'artist' or 'venue', the side of the show to describe
+def split_shows(shows, counterpart):
+  now = datetime.now()
+  past_shows = []
+  upcoming_shows = []
+  for show in sorted(shows, key=lambda show: show.start_time):
+      other = getattr(show, counterpart)
+      item = {
+        counterpart + "_id": other.id,
+        counterpart + "_name": other.name,
+        counterpart + "_image_link": other.image_link,
+        "start_time": str(show.start_time)
+      }
+      if show.start_time <= now:
+          past_shows.append(item)
+      else:
+          upcoming_shows.append(item)
+  return past_shows, upcoming_shows
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -107,21 +191,25 @@ def index():
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
+  # one query: every venue with its upcoming show count, ordered by area so
+  # the areas are built in one pass
+  num_upcoming_shows = db.func.count(Show.id).filter(Show.start_time > datetime.now())
+  rows = db.session.query(Venue.city, Venue.state, Venue.id, Venue.name, num_upcoming_shows)\
+    .outerjoin(Show, Show.venue_id == Venue.id)\
+    .group_by(Venue.id)\
+    .order_by(Venue.state, Venue.city, Venue.id).all()
   data = []
-  city_state = db.session.query(Venue.city, Venue.state).group_by(Venue.city, Venue.state).all()
-  for value in city_state:
-      venues = Venue.query.filter_by(city=value[0]).filter_by(state=value[1]).all()
-      venues_data = []
-      for venue in venues:
-          venues_data.append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(venue.shows),
+  for city, state, venue_id, name, upcoming in rows:
+      if not data or data[-1]['city'] != city or data[-1]['state'] != state:
+          data.append({
+            "city": city,
+            "state": state,
+            "venues": []
           })
-      data.append({
-        "city": value[0],
-        "state": value[1],
-        "venues": venues_data
+      data[-1]['venues'].append({
+        "id": venue_id,
+        "name": name,
+        "num_upcoming_shows": upcoming,
       })
   return render_template('pages/venues.html', areas=data);
 
@@ -129,23 +217,10 @@ def venues():
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: implement search on venues with partial string search. Ensure it is case-insensitive.
-  venues = Venue.query.filter(Venue.name.ilike('%'+request.form.get('search_term', '')+'%')).all()
-  count_venues = len(venues)
-  data = []
-  for venue in venues:
-      num_upcoming_shows =  Show.query.join(Venue, Show.venue_id==venue.id).filter(Show.start_time>datetime.now()).count()
-      venue_item = {
-        "id": venue.id,
-        "name": venue.name,
-        "num_upcoming_shows": num_upcoming_shows,
-      }
-      data.append(venue_item)
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response={
-    "count": count_venues,
-    "data": data
-  }
+  response = search_by_name(Venue, Show.venue_id, request.form.get('search_term', ''),
+    max(request.args.get('page', 1, type=int), 1))
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 
@@ -153,41 +228,11 @@ def search_venues():
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  venue = Venue.query.get(venue_id)
-  data = []
-  # for artist in artists:
-  genres = []
-  if venue.genres is not None:
-      for genre in venue.genres:
-          genres.append(genre.name)
-  past_shows = []
-  finished_shows = Show.query.join(Venue, Show.venue_id==Venue.id)\
-    .filter(Venue.id==venue_id).filter(Show.start_time<=datetime.now()).all()
-  if finished_shows is not None:
-      for show in finished_shows:
-          artist_Obj = {
-          "artist_id": show.artist.id,
-          "artist_name": show.artist.name,
-          "artist_image_link": show.artist.image_link,
-          "start_time": str(show.start_time)
-          }
-          past_shows.append(artist_Obj)
-  upcoming_shows =[]
-  past_shows_count = Show.query.join(Venue, Show.venue_id==Venue.id)\
-    .filter(Venue.id==venue_id).filter(Show.start_time<=datetime.now()).count()
-  upcoming_shows_count = Show.query.join(Venue, Show.venue_id==Venue.id)\
-    .filter(Venue.id==venue_id).filter(Show.start_time>datetime.now()).count()
-  comming_shows = Show.query.join(Venue, Show.venue_id==Venue.id)\
-    .filter(Venue.id==venue_id).filter(Show.start_time>datetime.now()).all()
-  if comming_shows is not None:
-      for show in comming_shows:
-          show_item = {
-          "artist_id": show.artist.id,
-          "artist_name": show.artist.name,
-          "artist_image_link": show.artist.image_link,
-          "start_time": str(show.start_time)
-          }
-          upcoming_shows.append(show_item)
+  venue = load_detail(Venue, Show.artist).filter(Venue.id == venue_id).one_or_none()
+  if venue is None:
+      abort(404)
+  genres = [genre.name for genre in venue.genres]
+  past_shows, upcoming_shows = split_shows(venue.shows, 'artist')
   obj ={
   'id': venue.id,
   "name": venue.name,
@@ -203,8 +248,8 @@ def show_venue(venue_id):
   "image_link": venue.image_link,
   "past_shows": past_shows,
   "upcoming_shows": upcoming_shows,
-  "past_shows_count": past_shows_count,
-  "upcoming_shows_count": upcoming_shows_count,
+  "past_shows_count": len(past_shows),
+  "upcoming_shows_count": len(upcoming_shows),
   }
   # data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
   return render_template('pages/show_venue.html', venue=obj)
@@ -285,23 +330,10 @@ def artists():
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  artists = Artist.query.filter(Artist.name.ilike('%'+request.form.get('search_term', '')+'%')).all()
-  count_artists = len(artists)
-  data = []
-  for artist in artists:
-      num_upcoming_shows =  Show.query.join(Artist, Show.artist_id==artist.id).filter(Show.start_time>datetime.now()).count()
-      artist_item = {
-        "id": artist.id,
-        "name": artist.name,
-        "num_upcoming_shows": num_upcoming_shows,
-      }
-      data.append(artist_item)
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  response={
-    "count": count_artists,
-    "data": data
-  }
+  response = search_by_name(Artist, Show.artist_id, request.form.get('search_term', ''),
+    max(request.args.get('page', 1, type=int), 1))
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 
@@ -309,41 +341,11 @@ def search_artists():
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  artist = Artist.query.get(artist_id)
-  data = []
-  # for artist in artists:
-  genres = []
-  if artist.genres is not None:
-      for genre in artist.genres:
-          genres.append(genre.name)
-  past_shows = []
-  finished_shows = Show.query.join(Artist, Show.artist_id==Artist.id)\
-    .filter(Artist.id==artist_id).filter(Show.start_time<=datetime.now()).all()
-  if finished_shows is not None:
-      for show in finished_shows:
-          venue_Obj = {
-          "venue_id": show.venue.id,
-          "venue_name": show.venue.name,
-          "venue_image_link": show.venue.image_link,
-          "start_time": str(show.start_time)
-          }
-          past_shows.append(venue_Obj)
-  upcoming_shows =[]
-  past_shows_count = Show.query.join(Artist, Show.artist_id==Artist.id)\
-    .filter(Artist.id==artist_id).filter(Show.start_time<=datetime.now()).count()
-  upcoming_shows_count = Show.query.join(Artist, Show.artist_id==Artist.id)\
-    .filter(Artist.id==artist_id).filter(Show.start_time>datetime.now()).count()
-  comming_shows = Show.query.join(Artist, Show.artist_id==Artist.id)\
-    .filter(Artist.id==artist_id).filter(Show.start_time>datetime.now()).all()
-  if comming_shows is not None:
-      for show in comming_shows:
-          show_item = {
-          "venue_id": show.venue.id,
-          "venue_name": show.venue.name,
-          "venue_image_link": show.venue.image_link,
-          "start_time": str(show.start_time)
-          }
-          upcoming_shows.append(show_item)
+  artist = load_detail(Artist, Show.venue).filter(Artist.id == artist_id).one_or_none()
+  if artist is None:
+      abort(404)
+  genres = [genre.name for genre in artist.genres]
+  past_shows, upcoming_shows = split_shows(artist.shows, 'venue')
   obj ={
   'id': artist.id,
   "name": artist.name,
@@ -358,8 +360,8 @@ def show_artist(artist_id):
   "image_link": artist.image_link,
   "past_shows": past_shows,
   "upcoming_shows": upcoming_shows,
-  "past_shows_count": past_shows_count,
-  "upcoming_shows_count": upcoming_shows_count,
+  "past_shows_count": len(past_shows),
+  "upcoming_shows_count": len(upcoming_shows),
   }
   return render_template('pages/show_artist.html', artist=obj)
 
@@ -497,8 +499,6 @@ def shows():
         "artist_image_link": show.artist.image_link,
         "start_time": str(show.start_time)
       })
-  print(data)
-  print(upcoming_shows)
   return render_template('pages/shows.html', shows=data)
 
 
@@ -551,14 +551,16 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
+log_handlers = []
 if not app.debug:
     file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
+    file_handler.setFormatter(JSONFormatter())
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    log_handlers.append(file_handler)
+# request and app logs go through a queue, see request_log.py
+init_request_log(app, log_handlers)
+if not app.debug:
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
@@ -0,0 +1,88 @@
+'''
+the query plans of every page
+
+    python -m benchmarks.explain [route ...]
+
+requests each page through the test client, records the SELECT
+statements it runs and prints the plan of each: EXPLAIN ANALYZE on
+PostgreSQL, EXPLAIN QUERY PLAN on SQLite. run it against a copy of the
+production database (DATABASE_URL) before a deploy, a sequential scan of
+shows or genres in a plan is a missing or unused index
+routes are like 'GET /venues' or 'POST /venues/search search_term=hop',
+{venue} and {artist} stand for the first venue and artist id
+'''
+import sys
+
+from sqlalchemy import event
+
+from app import app, db, Venue, Artist
+
+ROUTES = [
+    'GET /venues',
+    'GET /venues/{venue}',
+    'POST /venues/search search_term=a',
+    'GET /artists',
+    'GET /artists/{artist}',
+    'POST /artists/search search_term=a',
+    'GET /shows',
+]
+
+
+def record(client, route):
+    '''the statements and parameters of the SELECTs a route runs'''
+    method, url, *form = route.split(' ')
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        res = client.open(url, method=method,
+                          data=dict(field.split('=', 1) for field in form))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+    return res.status_code, statements
+
+
+def explain(statement, parameters):
+    if db.engine.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        return [' '.join(str(value) for value in row)
+                for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def main(routes=ROUTES):
+    client = app.test_client()
+    with app.app_context():
+        ids = {
+            'venue': db.session.query(db.func.min(Venue.id)).scalar(),
+            'artist': db.session.query(db.func.min(Artist.id)).scalar(),
+        }
+        db.session.remove()
+        for route in routes:
+            route = route.format(**ids)
+            status, statements = record(client, route)
+            print('=' * 78)
+            print('{} ({}, {} statements)'.format(route, status,
+                                                  len(statements)))
+            for statement, parameters in statements:
+                print('-' * 78)
+                print(statement.strip())
+                if parameters:
+                    print('-- {}'.format(parameters))
+                for line in explain(statement, parameters):
+                    print('   ' + line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ROUTES)
@@ -0,0 +1,85 @@
+'''
+GET /venues latency at a large venue count
+
+    python -m benchmarks.venues [venues] [shows per venue]
+
+times the venues index, built from one grouped query, against the query
+per area and shows lazy load per venue it replaced. runs on a scratch
+SQLite database unless DATABASE_URL is set
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+os.environ.setdefault('REQUEST_LOG_SLOW_MS', '600000')
+
+from app import app, db, Venue, Artist, Show  # noqa: E402
+
+STATES = ['CA', 'NY', 'TX', 'WA', 'IL', 'MA', 'OR', 'FL']
+
+
+def report(label, n, seconds):
+    print('{:<40} {:>10.0f} ops/s {:>10.2f} us/op'.format(
+        label, n / seconds, seconds / n * 1e6))
+
+
+def fill(venues, shows, rng):
+    db.drop_all()
+    db.create_all()
+    now = datetime.now()
+    db.session.execute(Artist.__table__.insert(), [
+        {'name': 'artist {}'.format(i)} for i in range(100)])
+    db.session.execute(Venue.__table__.insert(), [{
+        'name': 'venue {}'.format(i),
+        'city': 'city {}'.format(i % 250),
+        'state': STATES[i % 250 % len(STATES)]
+    } for i in range(venues)])
+    db.session.execute(Show.__table__.insert(), [{
+        'artist_id': rng.randint(1, 100),
+        'venue_id': venue,
+        'start_time': now + timedelta(days=rng.randint(-365, 365))
+    } for venue in range(1, venues + 1) for _ in range(shows)])
+    db.session.commit()
+
+
+def areas_before():
+    # the venues index before the grouped query
+    data = []
+    city_state = db.session.query(Venue.city, Venue.state).group_by(
+        Venue.city, Venue.state).all()
+    for city, state in city_state:
+        venues = Venue.query.filter_by(city=city).filter_by(state=state).all()
+        data.append({'city': city, 'state': state, 'venues': [{
+            'id': venue.id,
+            'name': venue.name,
+            'num_upcoming_shows': len(venue.shows)
+        } for venue in venues]})
+    return data
+
+
+def main(venues=10000, shows=5, n=20):
+    rng = random.Random(1)
+    client = app.test_client()
+    with app.app_context():
+        fill(venues, shows, rng)
+        print('{} venues, {} shows'.format(venues, venues * shows))
+        client.get('/venues')
+        start = time.perf_counter()
+        for _ in range(n):
+            assert client.get('/venues').status_code == 200
+        report('GET /venues', n, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        areas_before()
+        report('query per area and venue (before)', 1,
+               time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
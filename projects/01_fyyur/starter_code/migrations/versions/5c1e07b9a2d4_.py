@@ -0,0 +1,44 @@
+"""indexes for the show, genre and venue area filters
+
+Revision ID: 5c1e07b9a2d4
+Revises: 8b723d629f8c
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e07b9a2d4'
+down_revision = '8b723d629f8c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the venue and artist pages join shows on venue_id/artist_id and
+    # split or count them by start_time, one index answers both
+    op.create_index('ix_shows_venue_id_start_time', 'shows',
+                    ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows',
+                    ['artist_id', 'start_time'], unique=False)
+    # /shows orders every show by start_time
+    op.create_index(op.f('ix_shows_start_time'), 'shows', ['start_time'],
+                    unique=False)
+    op.create_index(op.f('ix_genres_artist_id'), 'genres', ['artist_id'],
+                    unique=False)
+    op.create_index(op.f('ix_genres_venue_id'), 'genres', ['venue_id'],
+                    unique=False)
+    # /venues lists venues by area
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index(op.f('ix_genres_venue_id'), table_name='genres')
+    op.drop_index(op.f('ix_genres_artist_id'), table_name='genres')
+    op.drop_index(op.f('ix_shows_start_time'), table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
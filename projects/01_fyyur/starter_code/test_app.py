@@ -0,0 +1,194 @@
+import filecmp
+import os
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'test.db')))
+
+from flask import template_rendered  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import request_log  # noqa: E402
+from app import app, db, Venue, Artist, Show, Genre  # noqa: E402
+
+# shared/ at the root of the repository, see shared/sync.py
+SHARED = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', '..', 'shared')
+
+
+'''
+count_statements()
+    counts the SQL statements run inside the with block
+    EXAMPLE
+        with count_statements() as statements:
+            ...
+        assert len(statements) == 1
+'''
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur pages test case"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        self.client = app.test_client()
+        now = datetime.now()
+        self.hop = Venue(name='The Musical Hop', city='San Francisco',
+                         state='CA')
+        self.dueling = Venue(name='The Dueling Pianos Bar', city='New York',
+                             state='NY')
+        self.park = Venue(name='Park Square Live Music & Coffee',
+                          city='San Francisco', state='CA')
+        self.petals = Artist(name='Guns N Petals', city='San Francisco',
+                             state='CA')
+        self.petals.genres = [Genre(name='Rock n Roll')]
+        self.hop.genres = [Genre(name='Jazz'), Genre(name='Swing')]
+        db.session.add_all([self.hop, self.dueling, self.park, self.petals])
+        db.session.add_all([
+            Show(artist=self.petals, venue=self.hop,
+                 start_time=now - timedelta(days=30)),
+            Show(artist=self.petals, venue=self.hop,
+                 start_time=now + timedelta(days=1)),
+            Show(artist=self.petals, venue=self.hop,
+                 start_time=now + timedelta(days=2)),
+            Show(artist=self.petals, venue=self.park,
+                 start_time=now + timedelta(days=3)),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def render(self, method, url, **kwargs):
+        '''the response and template context of a request'''
+        contexts = []
+
+        def rendered(sender, template, context, **extra):
+            contexts.append(context)
+        with template_rendered.connected_to(rendered, app):
+            res = getattr(self.client, method)(url, **kwargs)
+        return res, contexts[0] if contexts else None
+
+    def test_venues_in_one_query(self):
+        with count_statements() as statements:
+            res, context = self.render('get', '/venues')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(context['areas'], [
+            {'city': 'San Francisco', 'state': 'CA', 'venues': [
+                {'id': self.hop.id, 'name': 'The Musical Hop',
+                 'num_upcoming_shows': 2},
+                {'id': self.park.id,
+                 'name': 'Park Square Live Music & Coffee',
+                 'num_upcoming_shows': 1}]},
+            {'city': 'New York', 'state': 'NY', 'venues': [
+                {'id': self.dueling.id, 'name': 'The Dueling Pianos Bar',
+                 'num_upcoming_shows': 0}]},
+        ])
+
+    def test_show_venue_in_two_queries(self):
+        url = '/venues/{}'.format(self.hop.id)
+        with count_statements() as statements:
+            res, context = self.render('get', url)
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(statements), 2)
+        venue = context['venue']
+        self.assertEqual(venue['genres'], ['Jazz', 'Swing'])
+        self.assertEqual(venue['past_shows_count'], 1)
+        self.assertEqual(venue['upcoming_shows_count'], 2)
+        self.assertEqual(venue['upcoming_shows'][0]['artist_name'],
+                         'Guns N Petals')
+        self.assertLess(venue['upcoming_shows'][0]['start_time'],
+                        venue['upcoming_shows'][1]['start_time'])
+
+    def test_show_artist_in_two_queries(self):
+        url = '/artists/{}'.format(self.petals.id)
+        with count_statements() as statements:
+            res, context = self.render('get', url)
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(statements), 2)
+        artist = context['artist']
+        self.assertEqual(artist['genres'], ['Rock n Roll'])
+        self.assertEqual(artist['past_shows_count'], 1)
+        self.assertEqual([show['venue_name']
+                          for show in artist['upcoming_shows']],
+                         ['The Musical Hop', 'The Musical Hop',
+                          'Park Square Live Music & Coffee'])
+
+    def test_search_venues_in_one_query(self):
+        with count_statements() as statements:
+            res, context = self.render('post', '/venues/search',
+                                       data={'search_term': 'music'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(context['results']['count'], 2)
+        self.assertEqual(
+            [(venue['name'], venue['num_upcoming_shows'])
+             for venue in context['results']['data']],
+            [('Park Square Live Music & Coffee', 1), ('The Musical Hop', 2)])
+
+    def test_search_artists_is_paginated(self):
+        db.session.add(Artist(name='The Wild Sax Band'))
+        db.session.commit()
+        with mock.patch('app.SEARCH_PAGE_SIZE', 1):
+            res, first = self.render('post', '/artists/search',
+                                     data={'search_term': 'A'})
+            res, second = self.render('post', '/artists/search?page=2',
+                                      data={'search_term': 'A'})
+        self.assertEqual(first['results']['count'], 2)
+        self.assertEqual(first['results']['next_page'], 2)
+        self.assertEqual([artist['name'] for artist in
+                          first['results']['data'] +
+                          second['results']['data']],
+                         ['Guns N Petals', 'The Wild Sax Band'])
+        self.assertIsNone(second['results']['next_page'])
+        self.assertEqual(first['results']['data'][0]['num_upcoming_shows'],
+                         3)
+
+    def test_search_page_past_the_end_keeps_the_count(self):
+        res, context = self.render('post', '/venues/search?page=5',
+                                   data={'search_term': 'music'})
+        self.assertEqual(context['results']['count'], 2)
+        self.assertEqual(context['results']['data'], [])
+        self.assertIsNone(context['results']['next_page'])
+
+    def test_404_show_venue_not_found(self):
+        res = self.client.get('/venues/1000')
+        self.assertEqual(res.status_code, 404)
+
+
+class SharedModulesTestCase(unittest.TestCase):
+    """vendored copies of the modules in shared/"""
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_request_log_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'request_log.py'), request_log.__file__,
+            shallow=False), 'run `python shared/sync.py`')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+'''
+GET /questions per page latency at a large question count
+
+    python -m benchmarks.pagination [questions]
+
+times the first, a middle and the last page with ?page=N (LIMIT/OFFSET)
+and ?cursor=<id> (keyset), and once, the old way of loading every
+question to slice one page out of them. runs on a scratch SQLite database
+unless DATABASE_URL is set
+'''
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+
+from flaskr import QUESTIONS_PER_PAGE, create_app  # noqa: E402
+from models import db, Question, Category  # noqa: E402
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment',
+              'Sports']
+
+
+def report(label, n, seconds):
+    print('{:<40} {:>10.0f} ops/s {:>10.2f} us/op'.format(
+        label, n / seconds, seconds / n * 1e6))
+
+
+def fill(count, chunk=50000):
+    db.session.query(Question).delete()
+    db.session.query(Category).delete()
+    db.session.add_all([Category(type) for type in CATEGORIES])
+    for start in range(0, count, chunk):
+        db.session.execute(Question.__table__.insert(), [{
+            'question': 'What is the answer to question {}?'.format(i),
+            'answer': 'answer {}'.format(i),
+            'category': str(i % len(CATEGORIES) + 1),
+            'difficulty': i % 5 + 1
+        } for i in range(start, min(start + chunk, count))])
+    db.session.commit()
+
+
+def timed(client, url, n):
+    client.get(url)
+    start = time.perf_counter()
+    for _ in range(n):
+        assert client.get(url).status_code == 200
+    return time.perf_counter() - start
+
+
+def main(count=1000000, n=200):
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        fill(count)
+        first, last = db.session.query(db.func.min(Question.id),
+                                       db.func.max(Question.id)).one()
+        print('{} questions'.format(count))
+        pages = (count + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE
+        for label, page in (('first', 1), ('middle', pages // 2),
+                            ('last', pages)):
+            report('page={} ({})'.format(page, label), n,
+                   timed(client, '/questions?page={}'.format(page), n))
+        for label, cursor in (('first', first - 1),
+                              ('middle', (first + last) // 2),
+                              ('last', last - QUESTIONS_PER_PAGE)):
+            report('cursor={} ({})'.format(cursor, label), n,
+                   timed(client, '/questions?cursor={}'.format(cursor), n))
+
+        start = time.perf_counter()
+        questions = Question.query.all()
+        [question.format() for question in questions[:QUESTIONS_PER_PAGE]]
+        Question.query.count()
+        report('load all and slice (before)', 1,
+               time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
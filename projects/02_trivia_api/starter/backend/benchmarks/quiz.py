@@ -0,0 +1,87 @@
+'''
+POST /quizzes per step latency at a large question count
+
+    python -m benchmarks.quiz [questions] [previous questions]
+
+times one quiz step with the previous answers sent along, for one
+category and for all of them, against the ORDER BY random() query it
+replaced, and the step of a quiz session that needs no previous answers.
+runs on a scratch SQLite database unless DATABASE_URL is set
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+
+from sqlalchemy.sql.expression import func  # noqa: E402
+
+from flaskr import create_app  # noqa: E402
+from models import Question, current_quiz  # noqa: E402
+
+from .pagination import fill, report  # noqa: E402
+
+
+def random_order(category, previous):
+    # the quiz step before the quiz engine
+    query = Question.query.filter(~Question.id.in_(previous))
+    if category:
+        query = query.filter(Question.category == category)
+    return query.order_by(func.random()).first()
+
+
+def main(count=1000000, answered=500, n=200):
+    rng = random.Random(1)
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        fill(count)
+        start = time.perf_counter()
+        quiz = current_quiz()
+        report('load the quiz ids', 1, time.perf_counter() - start)
+        print('{} questions, {} previous answers'.format(count, answered))
+
+        for label, category in (('category 1', 1), ('all', 0)):
+            previous = [quiz.draw(category or None) for _ in range(answered)]
+            body = {'previous_questions': previous,
+                    'quiz_category': {'id': category}}
+            start = time.perf_counter()
+            for _ in range(n):
+                assert client.post('/quizzes', json=body).status_code == 200
+            report('POST /quizzes, {}'.format(label), n,
+                   time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(n):
+                quiz.draw(category or None, previous)
+            report('draw, {}'.format(label), n, time.perf_counter() - start)
+
+            k = max(1, n // 100)
+            start = time.perf_counter()
+            for _ in range(k):
+                random_order(category, previous)
+            report('ORDER BY random(), {} (before)'.format(label), k,
+                   time.perf_counter() - start)
+
+        session = quiz.session()
+        session._random = rng
+        start = time.perf_counter()
+        for _ in range(answered):
+            session.next()
+        report('QuizSession.next', answered, time.perf_counter() - start)
+
+        url = '/quizzes/sessions/{}/next'.format(client.post(
+            '/quizzes/sessions', json={}).get_json()['session'])
+        for _ in range(answered):
+            client.post(url)
+        start = time.perf_counter()
+        for _ in range(n):
+            assert client.post(url).status_code == 200
+        report('POST /quizzes/sessions/<id>/next', n,
+               time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,80 @@
+'''
+POST /questions searchTerm on a generated question corpus
+
+    python -m benchmarks.search [questions] [searches]
+
+times the indexed, ranked search of one page with its bounded count
+against the substring scan it replaced, which loaded every match to slice
+a page and count them. runs on a scratch SQLite database (FTS5) unless
+DATABASE_URL is set
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+
+from flaskr import QUESTIONS_PER_PAGE, create_app  # noqa: E402
+from models import db, init_search_index, Question  # noqa: E402
+
+from .pagination import fill, report  # noqa: E402
+
+WORDS = ['river', 'planet', 'painter', 'author', 'capital', 'ocean',
+         'element', 'novel', 'mountain', 'empire', 'composer', 'island',
+         'title', 'language', 'animal', 'battle', 'city', 'film']
+
+
+def corpus(count, rng):
+    for i in range(count):
+        yield {'question': 'Which {} {} the {} {}?'.format(
+            rng.choice(WORDS), rng.choice(['is', 'was', 'has']),
+            rng.choice(WORDS), i), 'answer': 'answer {}'.format(i),
+            'category': str(i % 6 + 1), 'difficulty': i % 5 + 1}
+
+
+def scan(term):
+    # the search before the index
+    questions = Question.query.filter(
+        Question.question.ilike('%{}%'.format(term))).all()
+    return questions[:QUESTIONS_PER_PAGE], len(questions)
+
+
+def main(count=1000000, searches=50):
+    rng = random.Random(1)
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        init_search_index(app)
+        fill(0)
+        rows = list(corpus(count, rng))
+        for start in range(0, count, 50000):
+            db.session.execute(Question.__table__.insert(),
+                               rows[start:start + 50000])
+        db.session.commit()
+        print('{} questions'.format(count))
+
+        terms = [rng.choice(WORDS) for _ in range(searches)]
+        for label, pick in (('one word', lambda term: term),
+                            ('two word prefixes', lambda term: '{} {}'.format(
+                                term[:3], rng.choice(WORDS)[:4])),
+                            ('rare', lambda term: '{} 4242'.format(term))):
+            queries = [pick(term) for term in terms]
+            start = time.perf_counter()
+            for term in queries:
+                res = client.post('/questions', json={'searchTerm': term})
+                assert res.status_code in (200, 404)
+            report('search, {}'.format(label), searches,
+                   time.perf_counter() - start)
+
+        n = max(1, searches // 10)
+        start = time.perf_counter()
+        for term in terms[:n]:
+            scan(term)
+        report('substring scan (before)', n, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
@@ -3,8 +3,12 @@ from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
-from sqlalchemy.sql.expression import func
-from models import setup_db, Question, Category
+import click
+from models import (setup_db, init_search_index, Question, total_questions,
+                    category_types, category_stats, question_stats,
+                    current_quiz)
+from quiz import QuizSessionStore
+from .responses import init_responses
 
 QUESTIONS_PER_PAGE = 10
 
@@ -12,7 +16,14 @@ QUESTIONS_PER_PAGE = 10
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(test_config or {})
     setup_db(app)
+    init_responses(app)
+    # QUIZ_SESSION_STORE replaces the in-process store, with a
+    # quiz.CachedQuizSessionStore for example
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or QuizSessionStore(
+        max_size=int(os.environ.get('QUIZ_SESSIONS_MAX', 10000)),
+        ttl=float(os.environ.get('QUIZ_SESSION_TTL', 3600)))
 
     '''
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -33,9 +44,19 @@ def create_app(test_config=None):
     '''
     @app.route('/categories')
     def get_categories():
-        categories = Category.query.all()
-        return jsonify({'success': True, 'categories': [
-                       category.format()['type'] for category in categories]})
+        return jsonify({'success': True, 'categories': category_types()})
+
+    '''
+    the number of questions, and of every category
+    '''
+    @app.route('/stats')
+    def get_stats():
+        stats = question_stats()
+        return jsonify({
+            'success': True,
+            'total_questions': stats['total_questions'],
+            'categories': stats['categories']
+        })
 
     '''
     @TODO:
@@ -48,22 +69,36 @@ def create_app(test_config=None):
     you should see questions and categories generated,
     ten questions per page and pagination at the bottom of the screen for three pages.
     Clicking on the page numbers should update the questions.
+
+    pages are read with LIMIT/OFFSET (?page=N), or after a question id
+    with ?cursor=<next_cursor> which stays as fast on the last page as on
+    the first. next_cursor is null on the last page
     '''
     @app.route('/questions')
     def get_questions():
-        q_page = 10
-        questions = Question.query.all()
-        page = request.args.get('page', 1, int)
-        start = (page - 1) * q_page
-        end = start + q_page
-        paginated_questions = questions[start:end]
-        if len(paginated_questions) == 0:
+        query = Question.query.order_by(Question.id)
+        cursor = request.args.get('cursor', None, int)
+        if cursor is not None:
+            query = query.filter(Question.id > cursor)
+        else:
+            page = request.args.get('page', 1, int)
+            if page < 1:
+                abort(404)
+            query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+        # one extra row tells whether there is a next page
+        questions = query.limit(QUESTIONS_PER_PAGE + 1).all()
+        if len(questions) == 0:
             abort(404)
+        next_cursor = None
+        if len(questions) > QUESTIONS_PER_PAGE:
+            questions = questions[:QUESTIONS_PER_PAGE]
+            next_cursor = questions[-1].id
         return jsonify({
-            'questions': [question.format() for question in paginated_questions],
-            'total_questions': Question.query.count(),
-            'categories': [category.format()['type'] for category in Category.query.all()],
-            'current_Category': 0
+            'questions': [question.format() for question in questions],
+            'total_questions': total_questions(),
+            'categories': category_types(),
+            'current_Category': 0,
+            'next_cursor': next_cursor
         })
 
     '''
@@ -99,20 +134,18 @@ def create_app(test_config=None):
         body = request.get_json()
         if 'searchTerm' in body:
             searchTerm = body['searchTerm']
-            q_page = 10
             page = request.args.get('page', 1, int)
-            start = (page - 1) * q_page
-            end = start + q_page
-            questions = Question.query.filter(
-                Question.question.ilike(
-                    '%{}%'.format(searchTerm))).all()
-            paginated_questions = questions[start:end]
-            if len(paginated_questions) == 0:
+            if page < 1:
+                abort(404)
+            questions = Question.search(
+                searchTerm, limit=QUESTIONS_PER_PAGE,
+                offset=(page - 1) * QUESTIONS_PER_PAGE)
+            if len(questions) == 0:
                 abort(404)
 
             return jsonify({
-                'questions': [question.format() for question in paginated_questions],
-                'total_questions': len(questions),
+                'questions': [question.format() for question in questions],
+                'total_questions': Question.count_matches(searchTerm),
                 'current_Category': 0
             })
         else:
@@ -157,15 +190,15 @@ def create_app(test_config=None):
     '''
     @app.route('/categories/<int:category_id>/questions')
     def get_questions_by_category(category_id):
-        categories = Category.query.filter(Category.id == category_id).all()
+        category = category_stats(category_id)
+        if category is None or category['questions'] == 0:
+            abort(404)
         questions = Question.query.filter(
             Question.category == category_id).all()
-        if len(questions) == 0 or len(categories) == 0:
-            abort(404)
         return jsonify({
             'questions': [question.format() for question in questions],
-            'total_questions': Question.query.count(),
-            'categories': [category.format()['type'] for category in Category.query.all()],
+            'total_questions': category['questions'],
+            'categories': category_types(),
             'current_Category': category_id
         })
 
@@ -183,20 +216,19 @@ def create_app(test_config=None):
     @app.route('/quizzes', methods=['POST'])
     def play():
         body = request.get_json()
-        previousQuestions = body['previous_questions']
+        previousQuestions = set(body['previous_questions'] or [])
         quizCategory = body['quiz_category']['id']
-        if(quizCategory == 0):
-            questions = Question.query.filter(
-                ~Question.id.in_(previousQuestions)).order_by(
-                func.random()).first()
-        else:
-            category = Category.query.filter(Category.id == quizCategory).one_or_none()
-            if category is None:
-                abort(404)
-            questions = Question.query.filter(
-                Question.category == quizCategory,
-                ~Question.id.in_(previousQuestions)).order_by(
-                func.random()).first()
+        if quizCategory != 0 and category_stats(quizCategory) is None:
+            abort(404)
+        quiz = current_quiz()
+        questions = None
+        while questions is None:
+            id = quiz.draw(quizCategory or None, previousQuestions)
+            if id is None:
+                break
+            # deleted by another process since the ids were loaded
+            questions = Question.query.filter(Question.id == id).one_or_none()
+            previousQuestions.add(id)
         if questions is None:
             return jsonify({
                 'question': False,
@@ -207,6 +239,61 @@ def create_app(test_config=None):
             'answer': questions.answer
         })
     '''
+    quiz sessions keep the shuffled questions of a quiz on the server, a
+    step sends no previous_questions and costs the same at any length.
+    POST /quizzes/sessions takes the quiz_category of /quizzes and returns
+    the session id, POST /quizzes/sessions/<id>/next returns the next
+    question like /quizzes does
+    '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json(silent=True) or {}
+        quizCategory = (body.get('quiz_category') or {}).get('id', 0)
+        if quizCategory != 0 and category_stats(quizCategory) is None:
+            abort(404)
+        session = current_quiz().session(quizCategory or None)
+        return jsonify({
+            'success': True,
+            'session': quiz_sessions.add(session),
+            'total_questions': len(session)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        session = quiz_sessions.get(session_id)
+        if session is None:
+            abort(404)
+        questions = None
+        with session.lock:
+            while questions is None:
+                id = session.next()
+                if id is None:
+                    break
+                # deleted since the session started
+                questions = Question.query.filter(Question.id == id).one_or_none()
+            quiz_sessions.save(session_id, session)
+        if questions is None:
+            return jsonify({
+                'question': False,
+                'answer': False
+            })
+        return jsonify({
+            'question': questions.format(),
+            'answer': questions.answer,
+            'remaining': session.remaining
+        })
+
+    '''
+    flask init-search-index
+        creates the index Question.search ranks matches with, once per
+        database, the app only checks it is there when it starts
+    '''
+    @app.cli.command('init-search-index')
+    def init_search_index_command():
+        init_search_index(app)
+        click.echo('search index ready')
+
+    '''
     @TODO:
     Create error handlers for all expected errors
     including 404 and 422.
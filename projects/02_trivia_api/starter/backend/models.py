@@ -1,16 +1,44 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import re
+from sqlalchemy import Column, String, Integer, create_engine, func, text
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from cache import ReadThroughCache
+from quiz import QuizEngine
+
 database_name = "trivia"
-database_path = "postgres://{}/{}".format('safaa:5433116@localhost:5432', database_name)
+database_path = os.environ.get('DATABASE_URL', "postgres://{}/{}".format(
+  'safaa:5433116@localhost:5432', database_name))
 
 db = SQLAlchemy()
 
+'''
+  TRIVIA_CACHE_TTL: seconds the question counts and categories are
+    cached, 0 caches them until the next question write in this process
+'''
+question_cache = ReadThroughCache(
+  ttl=float(os.environ.get('TRIVIA_CACHE_TTL', 5)) or None)
+
+'''
+  SEARCH_COUNT_LIMIT: search results counted at most, the count of a very
+    common word stops there instead of scanning every match
+'''
+SEARCH_COUNT_LIMIT = 1000
+
+'''
+  QUIZ_TTL: seconds before the quiz question ids are reloaded from the
+    database, 0 only follows the question writes of this process
+'''
+quiz_engine = QuizEngine(ttl=float(os.environ.get('QUIZ_TTL', 60)) or None)
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    only checks that the search index exists, app.config['SEARCH_INDEX']
+    tells Question.search whether it can use it
+    !!NOTE run `flask init-search-index` once to create the index
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
@@ -18,6 +46,70 @@ def setup_db(app, database_path=database_path):
     db.app = app
     db.init_app(app)
     db.create_all()
+    app.config['SEARCH_INDEX'] = has_search_index(db.engine)
+    if not app.config['SEARCH_INDEX']:
+        app.logger.warning('the questions have no search index, searches '
+                           'scan them. Run `flask init-search-index` first.')
+
+'''
+init_search_index(app)
+    creates the search index of the app's database if it is missing and
+    lets Question.search use it, for `flask init-search-index`
+create_search_index(engine)
+    indexes the question text for Question.search, once
+    PostgreSQL: a GIN index over to_tsvector('simple', question), the
+      simple configuration has no stop words, so prefixes like 'a' match
+    SQLite: an FTS5 table (question_search) kept in sync by triggers
+    other databases are searched with a scan
+has_search_index(engine)
+    whether create_search_index has run, one catalog lookup
+'''
+def init_search_index(app):
+    create_search_index(db.get_engine(app))
+    app.config['SEARCH_INDEX'] = True
+
+def has_search_index(engine):
+    with engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            return conn.execute(text(
+                "SELECT to_regclass('questions_search_idx')")).scalar() \
+                is not None
+        if conn.dialect.name == 'sqlite':
+            return conn.execute(text(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE name = 'question_search'")).first() is not None
+    return True
+
+def create_search_index(engine):
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS questions_search_idx ON questions "
+                "USING gin (to_tsvector('simple', coalesce(question, '')))"))
+        elif conn.dialect.name == 'sqlite':
+            if conn.execute(text(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE name = 'question_search'")).first():
+                return
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE question_search USING fts5("
+                "question, tokenize = 'unicode61 remove_diacritics 2')"))
+            conn.execute(text(
+                'CREATE TRIGGER question_search_insert AFTER INSERT ON '
+                'questions BEGIN INSERT INTO question_search (rowid, question) '
+                'VALUES (new.id, new.question); END'))
+            conn.execute(text(
+                'CREATE TRIGGER question_search_update AFTER UPDATE OF question '
+                'ON questions BEGIN '
+                'UPDATE question_search SET question = new.question '
+                'WHERE rowid = old.id; END'))
+            conn.execute(text(
+                'CREATE TRIGGER question_search_delete AFTER DELETE ON '
+                'questions BEGIN '
+                'DELETE FROM question_search WHERE rowid = old.id; END'))
+            conn.execute(text(
+                'INSERT INTO question_search (rowid, question) '
+                'SELECT id, question FROM questions'))
 
 '''
 Question
@@ -41,6 +133,8 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    question_cache.invalidate()
+    quiz_engine.add(self.id, self.category)
 
   def update(self):
     db.session.commit()
@@ -48,6 +142,68 @@ class Question(db.Model):
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    question_cache.invalidate()
+    quiz_engine.remove(self.id, self.category)
+
+  '''
+  search(term, limit, offset)
+    the questions containing every word of term as a word prefix, best
+    matches first, all questions by id if term has no words
+    count_matches(term, limit)
+      the number of those questions, counting no further than limit
+    EXAMPLE
+      Question.search('title', limit=10)
+  '''
+  @classmethod
+  def search(cls, term, limit=10, offset=0):
+    words = re.findall(r'\w+', term or '')
+    if words and cls._fts_indexed():
+      statement = text(
+        'SELECT questions.* FROM question_search '
+        'JOIN questions ON questions.id = question_search.rowid '
+        'WHERE question_search MATCH :match '
+        'ORDER BY bm25(question_search), questions.id '
+        'LIMIT :limit OFFSET :offset')
+      return cls.query.from_statement(statement).params(
+        match=cls._fts_match(words), limit=limit, offset=offset).all()
+    return cls._search_query(words).limit(limit).offset(offset).all()
+
+  @classmethod
+  def count_matches(cls, term, limit=SEARCH_COUNT_LIMIT):
+    words = re.findall(r'\w+', term or '')
+    if words and cls._fts_indexed():
+      return db.session.execute(text(
+        'SELECT count(*) FROM (SELECT 1 FROM question_search '
+        'WHERE question_search MATCH :match LIMIT :limit)'), {
+          'match': cls._fts_match(words), 'limit': limit}).scalar()
+    matches = cls._search_query(words).order_by(None).with_entities(
+      cls.id).limit(limit).subquery()
+    return db.session.query(func.count()).select_from(matches).scalar()
+
+  @classmethod
+  def _search_query(cls, words):
+    query = cls.query
+    if not words:
+      return query.order_by(cls.id)
+    if db.session.connection().dialect.name == 'postgresql':
+      # the same expression as questions_search_idx, so the index is used
+      document = func.to_tsvector('simple', func.coalesce(cls.question, ''))
+      match = func.to_tsquery('simple', ' & '.join(
+        '{}:*'.format(word) for word in words))
+      return query.filter(document.op('@@')(match)).order_by(
+        func.ts_rank(document, match).desc(), cls.id)
+    for word in words:
+      query = query.filter(cls.question.ilike('%{}%'.format(word)))
+    return query.order_by(cls.id)
+
+  @staticmethod
+  def _fts_indexed():
+    return (current_app.config.get('SEARCH_INDEX') and
+            db.session.connection().dialect.name == 'sqlite')
+
+  @staticmethod
+  def _fts_match(words):
+    return ' '.join('"{}"*'.format(word) for word in words)
 
   def format(self):
     return {
@@ -76,3 +232,56 @@ class Category(db.Model):
       'id': self.id,
       'type': self.type
     }
+
+'''
+question_stats()
+  the number of questions, and every category by id with its number of
+  questions, as
+    {'total_questions': 21, 'categories': [
+      {'id': 1, 'type': 'Science', 'questions': 3}, ...]}
+total_questions()
+  the number of questions
+category_types()
+  the type of every category, by id
+category_stats(category_id)
+  the entry of category_id in question_stats(), None if there is none
+  all are cached in question_cache
+'''
+def question_stats():
+  return question_cache.get('stats', _load_stats)
+
+def total_questions():
+  return question_stats()['total_questions']
+
+def category_types():
+  return question_cache.get('category_types', lambda: [
+    category['type'] for category in question_stats()['categories']])
+
+def category_stats(category_id):
+  return question_cache.get('categories_by_id', lambda: {
+    category['id']: category
+    for category in question_stats()['categories']}).get(category_id)
+
+def _load_stats():
+  # one grouped count instead of a count per category
+  counts = dict(db.session.query(Question.category, func.count(Question.id))
+                .group_by(Question.category))
+  return {
+    'total_questions': sum(counts.values()),
+    'categories': [{
+      'id': category.id,
+      'type': category.type,
+      'questions': counts.get(str(category.id), 0)
+    } for category in Category.query.order_by(Category.id)]
+  }
+
+'''
+current_quiz()
+  quiz_engine, loaded from the database when it is stale
+'''
+def current_quiz():
+  if quiz_engine.stale:
+    quiz_engine.load(db.session.execute(
+      Question.__table__.select().with_only_columns(
+        [Question.id, Question.category]).order_by(Question.id)))
+  return quiz_engine
@@ -0,0 +1,353 @@
+import bisect
+import json
+import random
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+
+'''
+QuizEngine
+draws quiz questions in constant time, from the question ids of every
+category kept in memory
+
+    ttl: optional seconds before the next lookup reloads the ids from the
+        database, questions added or deleted through another worker
+        process are only drawn or skipped from then on
+    clock: optional monotonic clock the ttl is timed with
+    rng: optional random.Random, seedable in tests
+
+    the ids are sorted arrays, one per category and one for all questions.
+    Question.insert/delete call add()/remove(). new ids are appended in
+    place, any other change replaces the array, so the positions sessions
+    have shuffled never move.
+'''
+
+
+class QuizEngine:
+
+    def __init__(self, ttl=None, clock=time.monotonic, rng=None):
+        self.ttl = ttl
+        self._clock = clock
+        self._random = rng or random.Random()
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._loaded_at = None
+
+    @property
+    def stale(self):
+        return (self._loaded_at is None or (
+            self.ttl is not None and
+            self._clock() - self._loaded_at >= self.ttl))
+
+    '''
+    load(questions)
+        replaces every id, questions are (id, category) tuples ordered by id
+    add(id, category), remove(id, category)
+        follow one question write, ignored until the engine is loaded
+    '''
+
+    def load(self, questions):
+        ids = {None: array('q')}
+        for id, category in questions:
+            ids[None].append(id)
+            ids.setdefault(str(category), array('q')).append(id)
+        with self._lock:
+            self._ids = ids
+            self._loaded_at = self._clock()
+
+    def add(self, id, category):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for key in (None, str(category)):
+                ids = self._ids.setdefault(key, array('q'))
+                if not ids or ids[-1] < id:
+                    ids.append(id)
+                elif not _contains(ids, id):
+                    i = bisect.bisect_left(ids, id)
+                    self._ids[key] = ids[:i] + array('q', [id]) + ids[i:]
+
+    def remove(self, id, category):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for key in (None, str(category)):
+                ids = self._ids.get(key)
+                if ids is not None and _contains(ids, id):
+                    i = bisect.bisect_left(ids, id)
+                    self._ids[key] = ids[:i] + ids[i + 1:]
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    '''
+    draw(category, excluded)
+        a random question id of category (None for every category) that is
+        not in excluded, None when there is none left
+        ids are drawn uniformly and redrawn when excluded, the remaining
+        ids are only listed once most of the category is excluded
+    count(category)
+        the number of questions in category
+    session(category)
+        a QuizSession over the questions of category
+    '''
+
+    def draw(self, category=None, excluded=()):
+        ids = self._ids.get(None if category is None else str(category))
+        if not ids:
+            return None
+        excluded = set(excluded)
+        remaining = len(ids)
+        if len(excluded) * 2 > len(ids):
+            remaining -= sum(1 for id in excluded
+                             if isinstance(id, int) and _contains(ids, id))
+            if remaining <= 0:
+                return None
+        if remaining * 2 >= len(ids):
+            # fewer than two draws are expected
+            while True:
+                id = ids[self._random.randrange(len(ids))]
+                if id not in excluded:
+                    return id
+        return self._random.choice([id for id in ids if id not in excluded])
+
+    def count(self, category=None):
+        return len(self._ids.get(None if category is None else str(category),
+                                 ()))
+
+    def session(self, category=None):
+        key = None if category is None else str(category)
+        return QuizSession(self._ids.get(key, array('q')), self._random,
+                           category=key)
+
+
+'''
+QuizSession
+a shuffled sequence of question ids, revealed one at a time
+
+    ids: the ids to shuffle, not copied, ids appended later are part of
+        the sequence, other changes are not allowed
+    rng: random.Random
+    category: the category the ids are from, kept for stores that
+        serialize sessions
+
+    the shuffle is a Fisher-Yates shuffle done one step per next(), only
+    the swapped positions and the asked ids are stored, so a session costs
+    memory in proportion to the questions asked, not to the questions there
+    are
+'''
+
+
+class QuizSession:
+
+    def __init__(self, ids, rng=random, category=None):
+        self._ids = ids
+        self._random = rng
+        self.category = category
+        self._swapped = {}
+        self._asked_ids = []
+        self.asked = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def remaining(self):
+        return len(self._ids) - self.asked
+
+    '''
+    next()
+        the next question id, None when every question was asked
+    '''
+
+    def next(self):
+        i = self.asked
+        if i >= len(self._ids):
+            return None
+        j = self._random.randrange(i, len(self._ids))
+        current = self._swapped.pop(i, i)
+        if j == i:
+            picked = current
+        else:
+            picked = self._swapped.get(j, j)
+            self._swapped[j] = current
+        self.asked += 1
+        self._asked_ids.append(self._ids[picked])
+        return self._ids[picked]
+
+    '''
+    dumps()
+        the session state as json bytes: its category and the ids asked,
+        no positions, they differ between engines loaded at other times
+    QuizSession.loads(data, engine)
+        the session dumped in data, over the current ids of its category
+        in engine, which must be loaded
+        the asked ids still there are moved to the front of the shuffle
+        and the rest is shuffled on, so no question is asked twice or
+        skipped whatever changed since the dump
+    '''
+
+    def dumps(self):
+        return json.dumps({'category': self.category,
+                           'asked': self._asked_ids}).encode()
+
+    @classmethod
+    def loads(cls, data, engine):
+        state = json.loads(data)
+        session = engine.session(state['category'])
+        ids = session._ids
+        # the positions the moved ids were swapped to, by original position
+        moved = {}
+        for id in dict.fromkeys(state['asked']):
+            if not _contains(ids, id):
+                # deleted since
+                continue
+            k = bisect.bisect_left(ids, id)
+            position = moved.pop(k, k)
+            i = session.asked
+            current = session._swapped.pop(i, i)
+            if position != i:
+                session._swapped[position] = current
+                moved[current] = position
+            session.asked += 1
+            session._asked_ids.append(id)
+        return session
+
+
+'''
+QuizSessionStore
+keeps quiz sessions in this process, the least recently used are dropped
+first
+
+    max_size: most sessions kept
+    ttl: seconds a session is kept after it was last used
+    clock: optional monotonic clock the session ages are read from
+
+    sessions only live in the process that created them, behind several
+    worker processes use a CachedQuizSessionStore
+'''
+
+
+class QuizSessionStore:
+
+    def __init__(self, max_size=10000, ttl=3600, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    '''
+    add(session)
+        stores a new session and returns its id
+    get(id)
+        the session, None if there is none or it expired
+    save(id, session)
+        stores the session again after next(), stores that serialize
+        sessions need it
+    '''
+
+    def add(self, session):
+        id = uuid.uuid4().hex
+        self.save(id, session)
+        return id
+
+    def get(self, id):
+        with self._lock:
+            entry = self._sessions.get(id)
+            if entry is None:
+                return None
+            session, used_at = entry
+            if self._clock() - used_at >= self.ttl:
+                del self._sessions[id]
+                return None
+            self._sessions[id] = (session, self._clock())
+            self._sessions.move_to_end(id)
+            return session
+
+    def save(self, id, session):
+        with self._lock:
+            self._sessions[id] = (session, self._clock())
+            self._sessions.move_to_end(id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+
+'''
+CachedQuizSessionStore
+keeps quiz sessions in an external cache shared by every worker process,
+as QuizSession.dumps() bytes
+
+    client: the cache, anything with get(key) and set(key, value, ttl),
+        like LocalCache or a thin wrapper around a redis or memcached client
+    current_quiz: callable returning the QuizEngine sessions are resumed
+        over, loaded and fresh, like models.current_quiz
+    ttl: seconds a session is kept after it was last used
+
+    any worker resumes any session, whether or not its own engine was
+    loaded yet, see QuizSession.loads
+'''
+
+
+class CachedQuizSessionStore:
+
+    def __init__(self, client, current_quiz, ttl=3600,
+                 prefix='quiz-session:'):
+        self.client = client
+        self.current_quiz = current_quiz
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def add(self, session):
+        id = uuid.uuid4().hex
+        self.save(id, session)
+        return id
+
+    def get(self, id):
+        data = self.client.get(self.prefix + id)
+        if data is None:
+            return None
+        return QuizSession.loads(data, self.current_quiz())
+
+    def save(self, id, session):
+        self.client.set(self.prefix + id, session.dumps(), self.ttl)
+
+
+'''
+LocalCache
+an in-process stand-in for an external cache client, for tests and single
+process deployments of CachedQuizSessionStore
+'''
+
+
+class LocalCache:
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (value, self._clock() + ttl)
+
+
+def _contains(ids, id):
+    i = bisect.bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
@@ -1,11 +1,23 @@
+import filecmp
 import os
+import random
 import unittest
 import json
+import tempfile
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+import cache
+from flaskr import create_app, responses
+from models import (db, setup_db, init_search_index, has_search_index,
+                    Question, Category)
+from cache import ReadThroughCache
+from quiz import (QuizEngine, QuizSessionStore, CachedQuizSessionStore,
+                  LocalCache)
 
+# shared/ at the root of the repository, see shared/sync.py
+SHARED = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', '..', '..', 'shared')
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
@@ -53,6 +65,33 @@ class TriviaTestCase(unittest.TestCase):
         # self.assertFalse(data['success'])
         # self.assertEqual(data['error'], 404)
         # self.assertEqual(data['message'], 'not found')
+    # 2.1
+
+    def test_pagination_of_questions_with_cursor(self):
+        res = self.client().get('/questions')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+        res = self.client().get(
+            '/questions?cursor={}'.format(data['next_cursor']))
+        next_page = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(question['id'] > data['next_cursor']
+                            for question in next_page['questions']))
+    # 2.2
+
+    def test_total_questions_follows_added_questions(self):
+        total = json.loads(
+            self.client().get('/questions').data)['total_questions']
+        self.client().post(
+            '/questions',
+            json={
+                'question': 'is the count cached?',
+                'answer': 'yes',
+                'difficulty': 1,
+                'category': 1})
+        data = json.loads(self.client().get('/questions').data)
+        self.assertEqual(data['total_questions'], total + 1)
     # 3
 
     # def test_delete_question_successful(self):
@@ -78,6 +117,22 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         # self.assertIsNotNone(data['questions'])
         # self.assertIsNotNone(data['total_questions'])
+    # 5.1
+
+    def test_search_questions_by_word_prefix(self):
+        self.client().post(
+            '/questions',
+            json={
+                'question': 'Which quokkaish animal is this?',
+                'answer': 'a quokka',
+                'difficulty': 1,
+                'category': 1})
+        res = self.client().post('/questions', json={'searchTerm': 'QUOKK'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Which quokkaish animal is this?',
+                      [question['question'] for question in data['questions']])
+        self.assertEqual(data['total_questions'], len(data['questions']))
     # 6
 
     def test_404_search_questions_empty(self):
@@ -144,6 +199,26 @@ class TriviaTestCase(unittest.TestCase):
         # self.assertIsNotNone(data['current_Category'])
     # 11
 
+    def test_get_questions_by_category_counts_the_category(self):
+        res = self.client().get('/categories/1/questions')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], len(data['questions']))
+    # 11.1
+
+    def test_stats(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(data['total_questions'], Question.query.count())
+            self.assertEqual(
+                [category['questions'] for category in data['categories']],
+                [Question.query.filter(
+                    Question.category == str(category['id'])).count()
+                 for category in data['categories']])
+    # 11.2
+
     def test_get_questions_by_category_failed(self):
         res = self.client().get('/categories/2000/questions')
         data = json.loads(res.data)
@@ -192,6 +267,218 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(res.status_code, 404)
         # self.assertFalse(data['question'])
+    # 15
+
+    def test_quiz_skips_previous_questions(self):
+        with self.app.app_context():
+            ids = [question.id for question in Question.query.filter(
+                Question.category == '1')]
+        res = self.client().post(
+            '/quizzes',
+            json={
+                'previous_questions': ids[1:],
+                'quiz_category': {
+                    'id': 1,
+                    'type': 'Science'}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[0])
+    # 16
+
+    def test_quiz_session_asks_every_question_once(self):
+        res = self.client().post(
+            '/quizzes/sessions',
+            json={'quiz_category': {'id': 1, 'type': 'Science'}})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        asked = []
+        for _ in range(data['total_questions'] + 1):
+            res = self.client().post(
+                '/quizzes/sessions/{}/next'.format(data['session']))
+            question = json.loads(res.data)['question']
+            if question:
+                asked.append(question['id'])
+        self.assertEqual(len(asked), len(set(asked)))
+        self.assertEqual(len(asked), data['total_questions'])
+        self.assertFalse(question)
+    # 17
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        self.assertEqual(res.status_code, 404)
+
+
+class ReadThroughCacheTestCase(unittest.TestCase):
+    """the cache of question counts and categories"""
+
+    def test_values_are_loaded_once_until_invalidated(self):
+        cache = ReadThroughCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return len(loads)
+        self.assertEqual(cache.get('count', load), 1)
+        self.assertEqual(cache.get('count', load), 1)
+        cache.invalidate()
+        self.assertEqual(cache.get('count', load), 2)
+
+    def test_value_loaded_across_a_write_is_not_kept(self):
+        cache = ReadThroughCache()
+
+        def load():
+            cache.invalidate()
+            return 'stale'
+        self.assertEqual(cache.get('count', load), 'stale')
+        self.assertEqual(cache.get('count', lambda: 'fresh'), 'fresh')
+
+    def test_values_expire(self):
+        now = [0]
+        cache = ReadThroughCache(ttl=5, clock=lambda: now[0])
+        cache.get('count', lambda: 1)
+        now[0] = 5
+        self.assertEqual(cache.get('count', lambda: 2), 2)
+
+
+class QuizEngineTestCase(unittest.TestCase):
+    """quiz question draws and sessions, without a database"""
+
+    def setUp(self):
+        self.quiz = QuizEngine(rng=random.Random(1))
+        self.quiz.load([(id, id % 3 + 1) for id in range(1, 31)])
+
+    def test_draw_skips_excluded_questions(self):
+        excluded = list(range(3, 30, 3))
+        self.assertEqual(self.quiz.draw(1, excluded), 30)
+        self.assertIsNone(self.quiz.draw(1, excluded + [30]))
+        self.assertIsNone(self.quiz.draw(5))
+
+    def test_draw_follows_question_writes(self):
+        self.quiz.remove(3, 1)
+        self.quiz.add(31, 2)
+        self.assertEqual(self.quiz.count(1), 9)
+        self.assertEqual(self.quiz.draw(2, range(1, 31)), 31)
+
+    def test_session_asks_every_question_once(self):
+        session = self.quiz.session(1)
+        asked = [session.next() for _ in range(10)]
+        self.assertEqual(sorted(asked), list(range(3, 31, 3)))
+        self.assertIsNone(session.next())
+
+    def test_session_store_drops_least_recently_used(self):
+        now = [0]
+        store = QuizSessionStore(max_size=2, ttl=10, clock=lambda: now[0])
+        first, second = store.add(self.quiz.session()), store.add(
+            self.quiz.session())
+        store.get(first)
+        third = store.add(self.quiz.session())
+        self.assertIsNone(store.get(second))
+        self.assertIsNotNone(store.get(first))
+        now[0] = 10
+        self.assertIsNone(store.get(third))
+
+    def test_cached_session_store_resumes_sessions(self):
+        store = CachedQuizSessionStore(LocalCache(), lambda: self.quiz)
+        id = store.add(self.quiz.session(1))
+        asked = []
+        for _ in range(11):
+            session = store.get(id)
+            asked.append(session.next())
+            store.save(id, session)
+        self.assertEqual(sorted(asked[:10]), list(range(3, 31, 3)))
+        self.assertIsNone(asked[10])
+
+    def unloaded_worker(self, questions):
+        # another worker process, its engine loads on first use
+        quiz = QuizEngine(rng=random.Random(2))
+
+        def current_quiz():
+            if quiz.stale:
+                quiz.load(questions)
+            return quiz
+        return current_quiz
+
+    def test_session_resumes_through_unloaded_engine(self):
+        cache = LocalCache()
+        store = CachedQuizSessionStore(cache, lambda: self.quiz)
+        other = CachedQuizSessionStore(cache, self.unloaded_worker(
+            [(id, id % 3 + 1) for id in range(1, 31)]))
+        id = store.add(self.quiz.session(1))
+        asked = []
+        for current in [store] * 3 + [other] * 8:
+            session = current.get(id)
+            asked.append(session.next())
+            current.save(id, session)
+        self.assertEqual(sorted(asked[:10]), list(range(3, 31, 3)))
+        self.assertIsNone(asked[10])
+        self.assertEqual(session.remaining, 0)
+
+    def test_resumed_session_follows_deleted_questions(self):
+        cache = LocalCache()
+        store = CachedQuizSessionStore(cache, lambda: self.quiz)
+        id = store.add(self.quiz.session(1))
+        asked = []
+        for _ in range(4):
+            session = store.get(id)
+            asked.append(session.next())
+            store.save(id, session)
+        # the other worker loaded after two questions were deleted
+        deleted = {asked[0], next(q for q in range(3, 31, 3)
+                                  if q not in asked)}
+        other = CachedQuizSessionStore(cache, self.unloaded_worker(
+            [(q, q % 3 + 1) for q in range(1, 31) if q not in deleted]))
+        self.assertEqual(other.get(id).remaining, 5)
+        while True:
+            session = other.get(id)
+            question = session.next()
+            other.save(id, session)
+            if question is None:
+                break
+            asked.append(question)
+        self.assertEqual(len(asked), len(set(asked)))
+        self.assertEqual(set(asked) | deleted, set(range(3, 31, 3)))
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """the search index on a scratch SQLite database"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///{}'.format(
+            os.path.join(tempfile.mkdtemp(), 'trivia.db')))
+
+    def test_startup_only_checks_the_index(self):
+        with self.app.app_context():
+            self.assertFalse(self.app.config['SEARCH_INDEX'])
+            self.assertFalse(has_search_index(db.engine))
+            Question('Which river is the longest?', 'Nile', '3', 2).insert()
+            # no index yet, the search scans
+            self.assertEqual(len(Question.search('riv')), 1)
+
+    def test_init_search_index(self):
+        with self.app.app_context():
+            Question('Which river is the longest?', 'Nile', '3', 2).insert()
+            init_search_index(self.app)
+            init_search_index(self.app)
+            self.assertTrue(has_search_index(db.engine))
+            self.assertEqual(Question.count_matches('riv long'), 1)
+            self.assertEqual(Question.search('ocean'), [])
+
+
+class SharedModulesTestCase(unittest.TestCase):
+    """vendored copies of the modules in shared/"""
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_responses_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'responses.py'), responses.__file__,
+            shallow=False), 'run `python shared/sync.py`')
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_cache_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'cache.py'), cache.__file__,
+            shallow=False), 'run `python shared/sync.py`')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+'''
+the Flask (WSGI) and Quart (ASGI) apps under the same hypercorn server
+
+    python -m benchmarks.asgi_vs_wsgi [workers] [concurrency] [requests]
+
+both apps are started with the same number of worker processes against the
+same sqlite file, JWKS_URL points at a local jwks file. every request is an
+authenticated page of /drinks-detail, so each one verifies a token (cached
+after the first use) and reads from the database. requests are sent from
+`concurrency` client threads over keep-alive connections.
+
+the async app fetches a missing signing key in a thread (there is no async
+http client here), with a warm key store both apps never touch the network.
+'''
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+from .tokens import make_signer
+
+APPS = (('wsgi (src.api:app)', 'src.api:app'),
+        ('asgi (src.asgi:app)', 'src.asgi:app'))
+PATH = '/drinks-detail?limit=20'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+def load(port, headers, concurrency, requests):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(n):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        mine = []
+        for _ in range(n):
+            start = time.perf_counter()
+            conn.request('GET', PATH, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            mine.append(time.perf_counter() - start)
+            if response.status != 200:
+                errors.append(response.status)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client,
+                                args=(requests // concurrency,))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def main(workers=2, concurrency=16, requests=4000):
+    directory = tempfile.mkdtemp()
+    url = 'sqlite:///{}'.format(os.path.join(directory, 'bench.db'))
+    engine = create_engine(url)
+    upgrade(engine)
+    recipe = json.dumps([{'color': 'brown', 'name': 'coffee', 'parts': 1}])
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            'INSERT INTO drink (title, recipe) VALUES (?, ?)',
+            [('drink {}'.format(i), recipe) for i in range(200)])
+
+    sign, store = make_signer()
+    jwks_path = os.path.join(directory, 'jwks.json')
+    with open(jwks_path, 'w') as f:
+        json.dump(store._fetch_jwks(), f)
+    headers = {'Authorization': 'Bearer ' + sign(['get:drinks-detail'])}
+    env = dict(os.environ, DATABASE_URL=url,
+               JWKS_URL='file://' + jwks_path,
+               REQUEST_LOG_SAMPLE_RATE='0')
+
+    for label, target in APPS:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'hypercorn', '--workers', str(workers),
+             '--bind', '127.0.0.1:{}'.format(port), target],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(port)
+            load(port, headers, concurrency, concurrency * 10)
+            seconds, latencies, errors = load(port, headers, concurrency,
+                                              requests)
+        finally:
+            server.terminate()
+            server.wait()
+        print('{:<22} {} workers {:>8.0f} req/s  p50 {:>7.2f} ms  '
+              'p99 {:>7.2f} ms  {} errors'.format(
+                  label, workers, len(latencies) / seconds,
+                  percentile(latencies, 0.50) * 1000,
+                  percentile(latencies, 0.99) * 1000, len(errors)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,64 @@
+'''
+seeding a menu through POST /drinks one drink at a time vs POST /drinks/bulk
+
+    python -m benchmarks.bulk_import [drinks]
+
+runs against a scratch sqlite file, so every commit pays for an fsync
+'''
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+upgrade(create_engine(os.environ['DATABASE_URL']))
+os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+
+from src.api import app  # noqa: E402
+from src.auth import auth  # noqa: E402
+from src.database.models import db_drop_and_create_all  # noqa: E402
+
+from .tokens import make_signer, report  # noqa: E402
+
+
+def menu(count, prefix):
+    return [{
+        'title': '{}{}'.format(prefix, i),
+        'recipe': [{'color': 'brown', 'name': 'coffee', 'parts': 2},
+                   {'color': 'white', 'name': 'milk', 'parts': 1}]
+    } for i in range(count)]
+
+
+def main(count=2000):
+    sign, auth.jwks_store = make_signer()
+    headers = {'Authorization': 'Bearer ' + sign(['post:drinks'])}
+    client = app.test_client()
+    with app.app_context():
+        db_drop_and_create_all()
+
+    start = time.perf_counter()
+    for drink in menu(count, 'single'):
+        client.post('/drinks', json=drink, headers=headers)
+    report('POST /drinks x {}'.format(count), count,
+           time.perf_counter() - start)
+
+    start = time.perf_counter()
+    res = client.post('/drinks/bulk', json=menu(count, 'bulk'),
+                      headers=headers)
+    assert res.get_json()['created'] == count
+    report('POST /drinks/bulk ({} drinks)'.format(count), count,
+           time.perf_counter() - start)
+
+    start = time.perf_counter()
+    client.post('/drinks/bulk', json=menu(count, 'bulk'), headers=headers)
+    report('POST /drinks/bulk (all updates)', count,
+           time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
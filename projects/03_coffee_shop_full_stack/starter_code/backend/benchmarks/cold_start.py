@@ -0,0 +1,50 @@
+'''
+cold start of N workers booting at once against one sqlite file
+
+    python -m benchmarks.cold_start [workers]
+
+before: every worker drops and recreates the schema while importing the
+    app, as setup_db used to (db_drop_and_create_all on every import)
+after: workers only check the schema version, `init-db` ran once
+'''
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+
+
+BOOT = 'import src.api'
+BOOT_WITH_DDL = ('import src.api\n'
+                 'from src.database.models import db_drop_and_create_all\n'
+                 'db_drop_and_create_all()')
+
+
+def boot(workers, code, env):
+    start = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, '-c', code], env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE)
+                 for _ in range(workers)]
+    failed = sum(1 for p in processes if p.wait() != 0)
+    return time.perf_counter() - start, failed
+
+
+def main(workers=8):
+    url = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    upgrade(create_engine(url))
+    env = dict(os.environ, DATABASE_URL=url)
+
+    for label, code in (('before (DDL on every boot)', BOOT_WITH_DDL),
+                        ('after (schema check only)', BOOT)):
+        seconds, failed = boot(workers, code, env)
+        print('{:<30} {} workers {:>8.3f} s  {} failed to boot'.format(
+            label, workers, seconds, failed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,86 @@
+'''
+GET /drinks/search against a client downloading the whole menu and
+filtering it itself, which was the only way to search before
+
+    python -m benchmarks.drink_search [drinks] [searches]
+
+both sides are timed through the Flask test client, the menu is already
+cached in memory, so the scan pays for the transfer and json decoding only
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+upgrade(create_engine(os.environ['DATABASE_URL']))
+os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+os.environ.setdefault('REQUEST_LOG_SLOW_MS', '60000')
+os.environ.setdefault('MENU_CACHE_TTL', '0')
+
+from src.api import app  # noqa: E402
+from src.auth import auth  # noqa: E402
+from src.database.models import Drink, db_drop_and_create_all  # noqa: E402
+
+from .tokens import make_signer, report  # noqa: E402
+
+WORDS = ['latte', 'mocha', 'flat', 'white', 'iced', 'vanilla', 'caramel',
+         'hazelnut', 'oat', 'double', 'cold', 'brew', 'spiced', 'honey']
+INGREDIENTS = ['coffee', 'milk', 'oat milk', 'foam', 'syrup', 'cocoa',
+               'cream', 'ice', 'water', 'cinnamon']
+
+
+def menu(count, rng):
+    return [{
+        'title': '{} {} {}'.format(rng.choice(WORDS), rng.choice(WORDS), i),
+        'recipe': [{'color': 'brown', 'name': name, 'parts': 1}
+                   for name in rng.sample(INGREDIENTS, 3)]
+    } for i in range(count)]
+
+
+def scan(client, headers, q):
+    # what a client had to do: fetch the full menu and filter it locally
+    words = q.lower().split()
+    drinks = client.get('/drinks-detail',
+                        headers=headers).get_json()['drinks']
+    return [drink for drink in drinks if all(
+        word in drink['title'].lower() or
+        any(word in r['name'] for r in drink['recipe']) for word in words)]
+
+
+def main(count=100000, searches=20):
+    rng = random.Random(0)
+    queries = ['{} {}'.format(rng.choice(WORDS), rng.choice(INGREDIENTS))
+               for _ in range(searches)]
+    sign, auth.jwks_store = make_signer()
+    headers = {'Authorization': 'Bearer ' + sign(['get:drinks-detail'])}
+    client = app.test_client()
+    with app.app_context():
+        db_drop_and_create_all()
+        start = time.perf_counter()
+        Drink.upsert_many(menu(count, rng))
+        report('indexed insert of {} drinks'.format(count), count,
+               time.perf_counter() - start)
+
+    scan(client, headers, queries[0])
+
+    start = time.perf_counter()
+    for q in queries:
+        scan(client, headers, q)
+    report('client side scan', searches, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for q in queries:
+        client.get('/drinks/search', query_string={'q': q, 'limit': 20})
+    report('GET /drinks/search (first 20)', searches,
+           time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
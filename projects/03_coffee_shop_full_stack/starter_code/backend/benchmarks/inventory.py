@@ -0,0 +1,88 @@
+'''
+the inventory engine on a menu of N drinks
+
+    python -m benchmarks.inventory [drinks] [ingredients]
+
+times a full load, an incremental recompute after one recipe or one stock
+change, an order volume rollup, and the makeable drinks lookup: through
+the engine and as served by GET /drinks/makeable once memoized
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+upgrade(create_engine(os.environ['DATABASE_URL']))
+os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+os.environ.setdefault('INVENTORY_TTL', '0')
+
+from src.api import app  # noqa: E402
+from src.auth import auth  # noqa: E402
+from src.database.inventory import Inventory  # noqa: E402
+from src.database.models import (Drink, Ingredient,  # noqa: E402
+                                 db_drop_and_create_all)
+
+from .tokens import make_signer, report  # noqa: E402
+
+
+def menu(count, names, rng):
+    return [(id, 'drink {}'.format(id),
+             [{'color': 'brown', 'name': name, 'parts': rng.randint(1, 4)}
+              for name in rng.sample(names, 4)])
+            for id in range(1, count + 1)]
+
+
+def timed(label, n, call):
+    start = time.perf_counter()
+    for _ in range(n):
+        call()
+    report(label, n, time.perf_counter() - start)
+
+
+def main(count=10000, ingredients=60):
+    rng = random.Random(0)
+    names = ['ingredient {}'.format(j) for j in range(ingredients)]
+    drinks = menu(count, names, rng)
+    stock = [(name, rng.randint(0, 400), rng.random()) for name in names]
+    inventory = Inventory()
+
+    timed('full load, {} drinks'.format(count), 3,
+          lambda: inventory.load(drinks, stock))
+    changed = drinks[count // 2]
+    timed('one recipe changed (apply)', 1000,
+          lambda: inventory.apply([changed], {changed[0]}))
+    timed('one stock level changed', 1000,
+          lambda: inventory.set_ingredient(names[0], stock=rng.randint(0,
+                                                                       400)))
+    volumes = {id: rng.randint(0, 50) for id in range(1, count + 1, 7)}
+    timed('rollup of {} drink volumes'.format(len(volumes)), 100,
+          lambda: inventory.rollup(volumes))
+    timed('makeable(), uncached', 100, inventory.makeable)
+
+    # the endpoint on the same menu, stored in the database
+    sign, auth.jwks_store = make_signer()
+    headers = {'Authorization': 'Bearer ' + sign(['get:drinks-detail'])}
+    client = app.test_client()
+    with app.app_context():
+        db_drop_and_create_all()
+        Drink.upsert_many([{'title': title, 'recipe': recipe}
+                           for id, title, recipe in drinks])
+        for name, amount, unit_cost in stock:
+            Ingredient.save(name, stock=amount, unit_cost=unit_cost)
+    client.get('/drinks/makeable', headers=headers)
+    timed('GET /drinks/makeable, memoized', 2000,
+          lambda: client.get('/drinks/makeable', headers=headers))
+    with app.test_request_context('/drinks/makeable', headers=headers):
+        timed('  of which the view and auth', 2000,
+              lambda: app.view_functions['getMakeableDrinks']())
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
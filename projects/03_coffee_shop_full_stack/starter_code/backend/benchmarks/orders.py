@@ -0,0 +1,71 @@
+'''
+order ingestion: one commit per order against the background group commit
+
+    python -m benchmarks.orders [orders] [threads]
+
+`threads` request threads place orders as fast as they can on a scratch
+sqlite file, with the DATABASE_PROFILE engine profile. with one commit per order
+each request writes its order before answering; with group commit it
+only queues it and the OrderWriter writes up to ORDER_BATCH_SIZE orders
+per transaction. the timing includes the final flush of the queue.
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from src.database.migrations import upgrade
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench.db')))
+upgrade(create_engine(os.environ['DATABASE_URL']))
+os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+
+from src.api import app, order_writer  # noqa: E402
+from src.database.models import (Drink, Order, validate_order,  # noqa: E402
+                                 db_drop_and_create_all)
+
+from .tokens import report  # noqa: E402
+
+
+def place(orders, threads, handle, ids):
+    def run(count):
+        for _ in range(count):
+            handle(validate_order(
+                {'items': [{'drink_id': id, 'quantity': 1} for id in ids]},
+                lambda ids: ids))
+
+    workers = [threading.Thread(target=run, args=(orders // threads,))
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    order_writer.flush()
+    return time.perf_counter() - start
+
+
+def main(orders=5000, threads=8):
+    with app.app_context():
+        db_drop_and_create_all()
+        Drink.upsert_many([{'title': 'drink {}'.format(i), 'recipe': [
+            {'color': 'brown', 'name': 'coffee', 'parts': 1}]}
+            for i in range(3)])
+        ids = [id for id, in Drink.query.with_entities(Drink.id)]
+
+    seconds = place(orders, threads,
+                    lambda order: Order.write_batch([order]), ids)
+    report('commit per order, {} threads'.format(threads), orders, seconds)
+    seconds = place(orders, threads, order_writer.submit, ids)
+    report('group commit (batches of {})'.format(order_writer.batch_size),
+           orders, seconds)
+    print('{} orders in {} transactions'.format(order_writer.written,
+                                                 order_writer.batches))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+'''
+permission checks for tokens carrying large RBAC permission lists
+
+    python -m benchmarks.permissions [permissions per token] [checks]
+
+list: the permission is looked up in the payload list on every check
+set: the permission list is compiled into a frozenset once per token,
+    as requires_auth does through the token cache
+'''
+import sys
+import time
+
+from src.auth import auth
+from src.auth.token_cache import TokenCache
+
+from .tokens import make_signer, report
+
+
+def main(size=2000, checks=20000):
+    sign, auth.jwks_store = make_signer()
+    permissions = ['resource{}:action'.format(i) for i in range(size)]
+    payload = auth.verify_decode_jwt(sign(permissions))
+    # worst case for the list scan: the required permissions come last
+    required = permissions[-1]
+    all_of = permissions[-5:]
+
+    start = time.perf_counter()
+    for _ in range(checks):
+        if required not in payload['permissions']:
+            raise AssertionError
+        if not all(p in payload['permissions'] for p in all_of):
+            raise AssertionError
+    report('list scan ({} permissions)'.format(size), checks,
+           time.perf_counter() - start)
+
+    verified = TokenCache().put('token', payload)
+    all_of = frozenset(all_of)
+    start = time.perf_counter()
+    for _ in range(checks):
+        auth.check_permissions(required, verified.payload, all_of=all_of,
+                               granted=verified.permissions)
+    report('frozenset ({} permissions)'.format(size), checks,
+           time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,78 @@
+'''
+/drinks serialization with the recipe stored as a json blob vs RecipeJSON
+
+    python -m benchmarks.recipe_serialization [drinks]
+
+blob: the previous Drink.short(), json.loads on every call (twice, with
+    the debug print removed)
+memoized: Drink.short() on loaded drinks, the recipe is decoded on first
+    use and reused by later serializations of the same instance
+'''
+import json
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from src.database.models import db, Drink
+
+from .tokens import report
+
+
+def legacy_short(id, title, recipe):
+    json.loads(recipe)
+    short_recipe = [{'color': r['color'], 'parts': r['parts']}
+                    for r in json.loads(recipe)]
+    return {'id': id, 'title': title, 'recipe': short_recipe}
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def main(count=10000, rounds=5):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = make_app(path)
+    with app.app_context():
+        db.create_all()
+        db.session.bulk_insert_mappings(Drink, [{
+            'title': 'drink{}'.format(i),
+            'recipe_data': [
+                {'color': 'brown', 'name': 'coffee', 'parts': 2},
+                {'color': 'white', 'name': 'milk', 'parts': 1},
+                {'color': 'grey', 'name': 'foam{}'.format(i % 7), 'parts': 1}
+            ]} for i in range(count)])
+        db.session.commit()
+
+        rows = db.session.execute(
+            db.text('SELECT id, title, recipe FROM drink')).fetchall()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            json.dumps({'success': True,
+                        'drinks': [legacy_short(*row) for row in rows]})
+        report('blob ({} drinks)'.format(count), rounds,
+               time.perf_counter() - start)
+
+        drinks = Drink.query.all()
+        start = time.perf_counter()
+        json.dumps({'success': True,
+                    'drinks': [drink.short() for drink in drinks]})
+        report('memoized, first pass', 1, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            json.dumps({'success': True,
+                        'drinks': [drink.short() for drink in drinks]})
+        report('memoized, later passes', rounds,
+               time.perf_counter() - start)
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,85 @@
+'''
+json encoding and compression of representative response bodies
+
+    python -m benchmarks.responses
+
+payloads: the /drinks-detail menu at 1000 drinks, a page and the whole
+set of 1000 trivia /questions, and the FlaskRecap greetings. prints the
+encode time with the stdlib json module and with orjson, then the body
+size and compression time per encoding (brotli only when installed)
+'''
+import json
+import time
+
+from src.responses import ResponseCompressor, dumps, orjson, brotli
+
+from .tokens import report
+
+
+def drinks(count):
+    return {'success': True, 'drinks': [{
+        'id': i,
+        'title': 'drink {}'.format(i),
+        'recipe': [{'color': 'brown', 'name': 'coffee', 'parts': 2},
+                   {'color': 'white', 'name': 'milk', 'parts': 1},
+                   {'color': 'grey', 'name': 'foam', 'parts': 1}]
+    } for i in range(count)]}
+
+
+def questions(count):
+    return {
+        'questions': [{
+            'id': i,
+            'question': 'What is the title of trivia question number '
+                        '{}?'.format(i),
+            'answer': 'answer {}'.format(i),
+            'category': i % 6 + 1,
+            'difficulty': i % 5 + 1
+        } for i in range(count)],
+        'total_questions': count,
+        'categories': ['Science', 'Art', 'Geography', 'History',
+                       'Entertainment', 'Sports'],
+        'current_Category': 0
+    }
+
+
+PAYLOADS = [
+    ('drinks-detail, 1000 drinks', drinks(1000)),
+    ('questions, page of 10', questions(10)),
+    ('questions, 1000', questions(1000)),
+    ('greetings', {'greetings': {'en': 'hello', 'es': 'Hola',
+                                 'ar': 'مرحبا', 'ja': 'こんにちは'}}),
+]
+
+
+def timed(n, call):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = call()
+    return result, time.perf_counter() - start
+
+
+def main(rounds=200):
+    compressor = ResponseCompressor()
+    encodings = compressor.encodings()
+    if orjson is None:
+        print('orjson is not installed, dumps() uses the stdlib encoder')
+    if brotli is None:
+        print('brotli is not installed, only gzip is measured')
+    for label, payload in PAYLOADS:
+        print(label)
+        body, seconds = timed(rounds, lambda: json.dumps(payload).encode())
+        report('  encode, stdlib json', rounds, seconds)
+        body, seconds = timed(rounds, lambda: dumps(payload))
+        report('  encode, dumps()', rounds, seconds)
+        print('  {:<38} {:>10} bytes'.format('identity', len(body)))
+        for encoding in encodings:
+            compressed, seconds = timed(
+                rounds, lambda: compressor.compress(body, encoding))
+            report('  {} ({} bytes, {:.0%})'.format(
+                encoding, len(compressed), len(compressed) / len(body)),
+                rounds, seconds)
+
+
+if __name__ == '__main__':
+    main()
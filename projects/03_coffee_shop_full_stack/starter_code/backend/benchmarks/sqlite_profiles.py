@@ -0,0 +1,101 @@
+'''
+concurrent read/write latency of the drink table under each engine profile
+
+    python -m benchmarks.sqlite_profiles [seconds] [readers] [writers]
+
+readers page through /drinks sized result sets, writers update recipes and
+commit, all threads share one pooled engine like a threaded worker does
+'''
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+from src.database.migrations import upgrade
+from src.database.profiles import PROFILES, engine_options, apply_profile
+
+
+RECIPE = json.dumps([{'color': 'brown', 'name': 'coffee', 'parts': 2},
+                     {'color': 'white', 'name': 'milk', 'parts': 1}])
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+
+def make_engine(profile, drinks=2000):
+    url = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    engine = create_engine(url, **engine_options(url, pool_size=8,
+                                                 max_overflow=8))
+    apply_profile(engine, PROFILES[profile])
+    upgrade(engine)
+    with engine.begin() as conn:
+        conn.execute(text('INSERT INTO drink (title, recipe) '
+                          'VALUES (:title, :recipe)'),
+                     [{'title': 'drink{}'.format(i), 'recipe': RECIPE}
+                      for i in range(drinks)])
+    return engine
+
+
+def run(engine, seconds, readers, writers):
+    latencies = {'read': [], 'write': []}
+    errors = []
+    deadline = time.perf_counter() + seconds
+
+    def read():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            with engine.connect() as conn:
+                conn.execute(text(
+                    'SELECT id, title, recipe FROM drink WHERE id > :cursor '
+                    'ORDER BY id LIMIT 50'),
+                    {'cursor': random.randint(0, 1900)}).fetchall()
+            latencies['read'].append(time.perf_counter() - start)
+
+    def write():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text('UPDATE drink SET recipe = :recipe '
+                                      'WHERE id = :id'),
+                                 {'recipe': RECIPE,
+                                  'id': random.randint(1, 2000)})
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies['write'].append(time.perf_counter() - start)
+
+    threads = ([threading.Thread(target=read) for _ in range(readers)] +
+               [threading.Thread(target=write) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def main(seconds=5, readers=6, writers=2):
+    print('{:<10} {:<6} {:>8} {:>10} {:>10} {:>7}'.format(
+        'profile', 'op', 'ops', 'p50 ms', 'p99 ms', 'errors'))
+    for profile in PROFILES:
+        engine = make_engine(profile)
+        latencies, errors = run(engine, seconds, readers, writers)
+        for op, samples in latencies.items():
+            if not samples:
+                continue
+            print('{:<10} {:<6} {:>8} {:>10.3f} {:>10.3f} {:>7}'.format(
+                profile, op, len(samples), percentile(samples, 0.5),
+                percentile(samples, 0.99),
+                len(errors) if op == 'write' else ''))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
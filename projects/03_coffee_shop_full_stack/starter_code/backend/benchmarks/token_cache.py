@@ -0,0 +1,42 @@
+'''
+cold vs warm token verification throughput
+
+    python -m benchmarks.token_cache [requests] [distinct tokens]
+
+cold: every request runs the full RS256 verify_decode_jwt
+warm: requests go through the token cache used by requires_auth
+'''
+import sys
+import time
+
+from src.auth import auth
+from src.auth.token_cache import TokenCache
+
+from .tokens import make_signer, report
+
+
+def main(requests=2000, distinct=20):
+    sign, auth.jwks_store = make_signer()
+    tokens = [sign(subject='auth0|user{}'.format(i))
+              for i in range(distinct)]
+
+    start = time.perf_counter()
+    for i in range(requests):
+        auth.verify_decode_jwt(tokens[i % distinct])
+    report('cold (verify every request)', requests,
+           time.perf_counter() - start)
+
+    cache = TokenCache()
+    start = time.perf_counter()
+    for i in range(requests):
+        token = tokens[i % distinct]
+        payload = cache.get(token)
+        if payload is None:
+            payload = auth.verify_decode_jwt(token)
+            cache.put(token, payload)
+    report('warm (token cache)', requests, time.perf_counter() - start)
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,49 @@
+import base64
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from src.auth import auth
+from src.auth.jwks import JWKSKeyStore
+
+
+'''
+helpers shared by the benchmarks: a throwaway RSA key, a matching
+in-memory JWKS stand-in and tokens signed with it
+'''
+
+
+def b64_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def make_signer(kid='bench-key'):
+    key = RSA.generate(2048)
+    jwks = {'keys': [{
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': b64_uint(key.n),
+        'e': b64_uint(key.e)
+    }]}
+    pem = key.export_key('PEM').decode('ascii')
+
+    def sign(permissions=(), subject='auth0|bench', expires_in=3600):
+        claims = {
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'sub': subject,
+            'exp': int(time.time()) + expires_in,
+            'permissions': list(permissions)
+        }
+        return jwt.encode(claims, pem, algorithm='RS256',
+                          headers={'kid': kid})
+
+    return sign, JWKSKeyStore('stand-in', fetch=lambda: jwks)
+
+
+def report(label, n, seconds):
+    print('{:<40} {:>10.0f} ops/s {:>10.2f} us/op'.format(
+        label, n / seconds, seconds / n * 1e6))
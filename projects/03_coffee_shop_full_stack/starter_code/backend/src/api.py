@@ -1,22 +1,136 @@
-import os
-from flask import Flask, request, jsonify, abort
+import click
+from flask import Flask, request, abort, Response, stream_with_context
+from flask.cli import FlaskGroup
 from sqlalchemy import exc
-import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
+from .database.models import (db_drop_and_create_all, setup_db, db_init,
+                              Drink, Ingredient, Order, validate_drinks,
+                              current_inventory)
+from .database.menu_cache import menu_cache
+from .database.order_writer import OrderWriter
+from .auth.auth import requires_auth
+from .request_log import init_request_log
+from .responses import init_responses
+from . import routes
+from .routes import (DRINKS_STREAM_BATCH, int_arg, page_args, search_args,
+                     if_match_version, write_errors)
+
+'''
+loading_cli_commands()
+    True while the flask command line imports this module to look up a
+    command (or to list them), the schema is not checked then so that
+    `flask init-db` can run against a database that is not migrated yet
+'''
+
+
+def loading_cli_commands():
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and isinstance(ctx.command, FlaskGroup)
+
 
 app = Flask(__name__)
-setup_db(app)
+setup_db(app, check=not loading_cli_commands())
 CORS(app)
+init_request_log(app)
+init_responses(app)
+
+'''
+orders are written by a background thread, see order_writer.py, with the
+ORDER_* settings read by OrderWriter.from_env
+the request handling shared with asgi.py is in routes.py
+'''
+order_writer = OrderWriter.from_env(Order.write_batch, logger=app.logger)
+
+'''
+flask init-db
+    creates the database or applies pending migrations, keeps the records
+    !! NOTE THIS MUST BE RUN ONCE BEFORE THE FIRST START
+flask init-db --drop
+    drops all records and starts the database from scratch
+'''
+
+
+@app.cli.command('init-db')
+@click.option('--drop', is_flag=True, help='Drop all records first.')
+def initDb(drop):
+    if drop:
+        db_drop_and_create_all()
+        click.echo('database recreated')
+    else:
+        applied = db_init()
+        click.echo('applied migrations: {}'.format(applied or 'none'))
+
+'''
+menu_response(form)
+    serves the drinks menu from the in-memory menu_cache
+    form is 'short' or 'long', the Drink representation to serialize
+    the response carries an ETag, a matching If-None-Match gets a 304
+'''
+
+
+def menu_response(form):
+    menu = menu_cache.get(
+        form, lambda: routes.menu_body(Drink.query.all(), form))
+    return routes.menu_response(menu, request.if_none_match)
+
 
 '''
-@TODO uncomment the following line to initialize the datbase
-!! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
-!! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
+drinks_page_response(form)
+    serves one page of drinks ordered by id, using keyset pagination
+    (see routes.page_args)
+    returns json {"success": True, "drinks": drinks, "next_cursor": id}
+        next_cursor is null on the last page
 '''
-# db_drop_and_create_all()
+
+
+def drinks_page_response(form):
+    limit, cursor = page_args(request.args)
+    query = Drink.query.order_by(Drink.id)
+    if cursor is not None:
+        query = query.filter(Drink.id > cursor)
+    return routes.page_response(query.limit(limit + 1).all(), form, limit)
+
+
+'''
+drinks_stream_response(form)
+    streams every drink as one json object per line (application/x-ndjson)
+    rows are fetched in batches from a server side cursor, so the full
+    result set is never held in memory
+'''
+
+
+def drinks_stream_response(form):
+    cursor = int_arg(request.args, 'cursor')
+    query = Drink.query.order_by(Drink.id).execution_options(
+        stream_results=True).yield_per(DRINKS_STREAM_BATCH)
+    if cursor is not None:
+        query = query.filter(Drink.id > cursor)
+
+    def generate():
+        for drink in query:
+            yield routes.drink_line(drink, form)
+
+    return Response(stream_with_context(generate()), status=200,
+                    mimetype='application/x-ndjson')
+
+
+'''
+drinks_response(form)
+    picks the representation requested by the query string
+        ?format=ndjson streams the drinks
+        ?limit= or ?cursor= pages through the drinks
+        otherwise the full cached menu is returned
+'''
+
+
+def drinks_response(form):
+    if request.args.get('format') == 'ndjson':
+        return drinks_stream_response(form)
+    if 'limit' in request.args or 'cursor' in request.args:
+        return drinks_page_response(form)
+    return menu_response(form)
+
 
 # ROUTES
 '''
@@ -31,11 +145,7 @@ CORS(app)
 
 @app.route('/drinks')
 def getDrinks():
-    drinks = Drink.query.all()
-    # if len(drinks)==0:
-    #     abort(404)
-    drinksList = [drink.short() for drink in drinks]
-    return jsonify({"success": True, "drinks": drinksList}), 200
+    return drinks_response('short')
 
 
 '''
@@ -51,11 +161,30 @@ def getDrinks():
 @app.route('/drinks-detail')
 @requires_auth('get:drinks-detail')
 def getDrinksDetails(payload):
-    drinks = Drink.query.all()
-    # if len(drinks)==0:
-    #     abort(404)
-    drinksList = [drink.long() for drink in drinks]
-    return jsonify({"success": True, "drinks": drinksList}), 200
+    return drinks_response('long')
+
+
+'''
+GET /drinks/search?q=<words>
+    a public endpoint, searches drink titles and ingredient names
+    every word must match the start of a word, best matches first
+        ?limit=<n> page size, at most DRINKS_PAGE_MAX
+        ?offset=<n> skips the first n matches (the previous next_offset)
+    it should respond with a 400 error if q has no words
+    returns status code 200 and json {"success": True, "drinks": drinks,
+        "next_offset": n} with drinks in the drink.short() representation
+        next_offset is null on the last page
+'''
+
+
+@app.route('/drinks/search')
+def searchDrinks():
+    q, limit, offset = search_args(request.args)
+    try:
+        drinks = Drink.search(q, limit + 1, offset)
+    except ValueError:
+        abort(400)
+    return routes.search_response(drinks, limit, offset)
 
 
 '''
@@ -72,22 +201,36 @@ def getDrinksDetails(payload):
 @app.route('/drinks', methods=['POST'])
 @requires_auth('post:drinks')
 def postDrink(payload):
-    body = request.get_json()
-    print(body)
-    drink = Drink()
-    try:
-        if body['title']:
-            drink.title = body['title']
-        if body['recipe']:
-            req_recipe = body['recipe']
-            if isinstance(req_recipe, dict):
-                req_recipe = [req_recipe]
-            drink.recipe = json.dumps(req_recipe)
-            print(drink.recipe)
+    drink = routes.new_drink(request.get_json())
+    with write_errors():
         drink.insert()
-    except Exception as e:
-        abort(400)
-    return jsonify({"success": True, "drinks": drink.long()}), 200
+    return routes.drink_response(drink)
+
+
+'''
+POST /drinks/bulk
+    creates or updates many drinks in a single transaction, matched by title
+    it should require the 'post:drinks' permission
+    the body is a json array of {"title": string, "recipe": recipe} objects,
+        or the same objects one per line with content type application/x-ndjson
+    invalid items are reported and skipped, the valid ones are written
+    returns status code 200 and json {"success": True, "created": n,
+        "updated": n, "failed": n, "results": results} where results holds
+        one {"index", "title", "status", "id" or "error"} object per item
+'''
+
+
+@app.route('/drinks/bulk', methods=['POST'])
+@requires_auth('post:drinks')
+def postDrinksBulk(payload):
+    items = routes.bulk_items(request.mimetype,
+                              request.get_data(as_text=True))
+    results, rows = validate_drinks(items)
+    try:
+        written = Drink.upsert_many([row for result, row in rows])
+    except exc.SQLAlchemyError:
+        abort(422)
+    return routes.bulk_response(results, rows, written)
 
 
 '''
@@ -98,6 +241,9 @@ def postDrink(payload):
         it should update the corresponding row for <id>
         it should require the 'patch:drinks' permission
         it should contain the drink.long() data representation
+        an If-Match header with the drink's ETag makes the update
+        conditional, it should respond with a 412 error if the drink
+        changed since, without If-Match the last write wins
     returns status code 200 and json {"success": True, "drinks": drink} where drink an array containing only the updated drink
         or appropriate status code indicating reason for failure
 '''
@@ -106,21 +252,18 @@ def postDrink(payload):
 @app.route('/drinks/<int:id>', methods=['PATCH'])
 @requires_auth('patch:drinks')
 def patchDrink(payload, id):
-    body = request.get_json()
-    print(body)
+    title, recipe = routes.drink_changes(request.get_json())
+    version = if_match_version(request.if_match)
+    with write_errors():
+        updated = Drink.update_by_id(id, title=title, recipe=recipe,
+                                     version=version)
+    if not updated:
+        abort(404)
+    # the drink can be deleted between the UPDATE and this read
     drink = Drink.query.filter_by(id=id).one_or_none()
-    if not drink:
+    if drink is None:
         abort(404)
-    try:
-        if body['title']:
-            drink.title = body['title']
-        if body['recipe']:
-            drink.recipe = json.dumps(body['recipe'])
-        drink.update()
-    except Exception as e:
-        abort(400)
-    # drink = Drink()
-    return jsonify({"success": True, "drinks": drink.long()}), 200
+    return routes.drink_response(drink)
 
 
 '''
@@ -130,6 +273,7 @@ def patchDrink(payload, id):
         it should respond with a 404 error if <id> is not found
         it should delete the corresponding row for <id>
         it should require the 'delete:drinks' permission
+        an If-Match header makes the delete conditional, see PATCH
     returns status code 200 and json {"success": True, "delete": id} where id is the id of the deleted record
         or appropriate status code indicating reason for failure
 '''
@@ -138,66 +282,108 @@ def patchDrink(payload, id):
 @app.route('/drinks/<int:id>', methods=['DELETE'])
 @requires_auth('delete:drinks')
 def deleteDrink(payload, id):
-    drink = Drink.query.filter(Drink.id == id).one_or_none()
-    if not drink:
+    version = if_match_version(request.if_match)
+    with write_errors():
+        deleted = Drink.delete_by_id(id, version=version)
+    if not deleted:
         abort(404)
-    try:
-        drink.delete()
-    except Exception as e:
-        abort(400)
-    return jsonify({"success": True, "delete": id}), 200
+    return routes.delete_response(id)
 
 
-# Error Handling
 '''
-Example error handling for unprocessable entity
+GET /drinks/makeable
+    it should require the 'get:drinks-detail' permission
+    the drinks the current ingredient stock allows at least one serving of,
+    served from the in-memory inventory
+    returns status code 200 and json {"success": True, "drinks": drinks}
+        with one {"id", "title", "servings"} object per drink, by id
 '''
 
 
-@app.errorhandler(422)
-def unprocessable(error):
-    return jsonify({
-        "success": False,
-        "error": 422,
-        "message": "unprocessable"
-    }), 422
+@app.route('/drinks/makeable')
+@requires_auth('get:drinks-detail')
+def getMakeableDrinks(payload):
+    return routes.makeable_response(current_inventory())
 
 
 '''
-@TODO implement error handlers using the @app.errorhandler(error) decorator
-    each error handler should return (with approprate messages):
-             jsonify({
-                    "success": False,
-                    "error": 404,
-                    "message": "resource not found"
-                    }), 404
+GET /inventory
+    it should require the 'get:inventory' permission
+    returns status code 200 and json {"success": True, "ingredients":
+        ingredients} with one {"name", "stock", "unit_cost"} object per
+        ingredient used by a recipe or stocked
+'''
+
+
+@app.route('/inventory')
+@requires_auth('get:inventory')
+def getInventory(payload):
+    return routes.inventory_response(current_inventory())
+
 
 '''
+PATCH /inventory/<name>
+    it should require the 'patch:inventory' permission
+    sets the stock and/or unit cost of ingredient <name>, creating it if
+    needed, the body is {"stock": number, "unit_cost": number}
+    returns status code 200 and json {"success": True, "ingredient":
+        {"name", "stock", "unit_cost"}}
 '''
-@TODO implement error handler for 404
-    error handler should conform to general task above
+
+
+@app.route('/inventory/<name>', methods=['PATCH'])
+@requires_auth('patch:inventory')
+def patchInventory(payload, name):
+    values = routes.stock_values(request.get_json(silent=True))
+    try:
+        ingredient = Ingredient.save(name, **values)
+    except exc.SQLAlchemyError:
+        abort(422)
+    return routes.ingredient_response(ingredient)
+
+
+'''
+POST /inventory/rollup
+    it should require the 'get:inventory' permission
+    the ingredient consumption and cost of serving the drinks in volumes,
+    the body is {"volumes": {"<drink id>": count}}
+    it should respond with a 422 error for unknown drink ids
+    returns status code 200 and json {"success": True, "ingredients":
+        ingredients, "total_cost": number} with one {"name",
+        "consumption", "cost", "shortfall"} object per ingredient used,
+        shortfall being what the current stock lacks
 '''
 
 
-@app.errorhandler(404)
-def resourceNotFound(error):
-    return jsonify({
-        "success": False,
-        "error": 404,
-        "message": "resource not found"
-    }), 404
+@app.route('/inventory/rollup', methods=['POST'])
+@requires_auth('get:inventory')
+def postInventoryRollup(payload):
+    volumes = routes.rollup_volumes(request.get_json(silent=True))
+    return routes.rollup_response(current_inventory(), volumes)
 
 
 '''
-@TODO implement error handler for AuthError
-    error handler should conform to general task above
+POST /orders
+    it should require the 'post:orders' permission
+    the body is {"items": [{"drink_id": id, "quantity": n}]}
+    the order is queued and written in the background with other orders
+    it should respond with a 400 error for an invalid body or unknown drink
+        and a 429 error when too many orders are waiting to be written
+    returns status code 202 and json {"success": True, "order": id}
 '''
 
 
-@app.errorhandler(AuthError)
-def resourceNotFound(error):
-    return jsonify({
-        "success": False,
-        "error": error.status_code,
-        "message": error.error['description']
-    }), error.status_code
+@app.route('/orders', methods=['POST'])
+@requires_auth('post:orders')
+def postOrder(payload):
+    return routes.place_order(request.get_json(silent=True),
+                              Drink.existing_ids, order_writer)
+
+
+
+# Error Handling
+'''
+every error is answered with json {"success": False, "error": status,
+"message": message}, see routes.register_error_handlers
+'''
+routes.register_error_handlers(app)
@@ -0,0 +1,321 @@
+import asyncio
+from functools import wraps
+from quart import Quart, request, abort, Response
+from sqlalchemy import create_engine, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .auth import auth
+from .database.menu_cache import menu_cache
+from .database.migrations import check_schema
+from .database.models import (Drink, Ingredient, Order, database_path,
+                              drinks_changed, validate_drinks,
+                              current_inventory)
+from .database.order_writer import OrderWriter
+from .database.profiles import get_profile, engine_options, apply_profile
+from . import routes
+from .routes import (DRINKS_STREAM_BATCH, int_arg, page_args, search_args,
+                     if_match_version, write_errors)
+
+'''
+ASGI variant of the coffee shop api (api.py), built on Quart
+serves the same routes, permissions, responses and error handlers, whose
+logic both apps take from routes.py, without blocking a worker on the
+database or on Auth0:
+    the database is reached through SQLAlchemy's asyncio extension
+        (aiosqlite for sqlite, asyncpg for postgresql)
+    a signing key missing from the in-memory jwks_store is fetched in a
+        thread, off the event loop
+    orders are written by the same background OrderWriter thread, over a
+        synchronous engine of its own
+
+    hypercorn src.asgi:app
+'''
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg'
+}
+
+app = Quart(__name__)
+
+order_writer = OrderWriter.from_env(
+    lambda orders: Order.write_batch(orders, bind=app.orders_engine),
+    logger=app.logger)
+
+
+
+def async_database_url(url):
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else url
+
+
+@app.before_serving
+async def open_database():
+    options = engine_options(database_path)
+    if options.get('poolclass') is QueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    engine = create_async_engine(async_database_url(database_path), **options)
+    apply_profile(engine.sync_engine, get_profile())
+    async with engine.connect() as conn:
+        await conn.run_sync(check_schema)
+    app.db_engine = engine
+    app.db_session = sessionmaker(engine, class_=AsyncSession,
+                                  expire_on_commit=False)
+    app.orders_engine = create_engine(database_path,
+                                      **engine_options(database_path))
+    apply_profile(app.orders_engine, get_profile())
+
+
+@app.after_serving
+async def close_database():
+    await asyncio.get_running_loop().run_in_executor(None,
+                                                     order_writer.flush)
+    app.orders_engine.dispose()
+    await app.db_engine.dispose()
+
+
+@app.after_request
+async def add_cors_headers(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = \
+        'Content-Type,Authorization'
+    response.headers['Access-Control-Allow-Methods'] = \
+        'GET,POST,PATCH,DELETE,OPTIONS'
+    return response
+
+
+'''
+verify_decode_jwt(token)
+    async version of auth.verify_decode_jwt
+    the signing key comes from the in-memory jwks_store when it has it,
+    otherwise it is fetched in the default executor
+'''
+
+
+async def verify_decode_jwt(token):
+    kid = auth.unverified_kid(token)
+    rsa_key = auth.jwks_store.peek(kid)
+    if rsa_key is None:
+        loop = asyncio.get_running_loop()
+        rsa_key = await loop.run_in_executor(None, auth.signing_key, kid)
+    return auth.decode_with_key(token, rsa_key)
+
+
+'''
+requires_auth(permission, any_of, all_of)
+    async version of auth.requires_auth, same semantics and token cache
+'''
+
+
+def requires_auth(permission='', any_of=(), all_of=()):
+    any_of = frozenset(any_of)
+    all_of = frozenset(all_of)
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = auth.parse_auth_header(
+                request.headers.get('Authorization', None))
+            verified = auth.token_cache.get(token)
+            if verified is None:
+                verified = auth.token_cache.put(
+                    token, await verify_decode_jwt(token))
+            auth.check_permissions(permission, verified.payload, any_of,
+                                   all_of, granted=verified.permissions)
+            return await f(verified.payload, *args, **kwargs)
+
+        return wrapper
+    return requires_auth_decorator
+
+
+async def menu_response(form):
+    menu = menu_cache.peek(form)
+    if menu is None:
+        generation = menu_cache.generation
+        async with app.db_session() as session:
+            drinks = (await session.execute(select(Drink))).scalars().all()
+        menu = menu_cache.store(form, routes.menu_body(drinks, form),
+                                generation)
+    return routes.menu_response(menu, request.if_none_match)
+
+
+async def drinks_page_response(form):
+    limit, cursor = page_args(request.args)
+    query = select(Drink).order_by(Drink.id).limit(limit + 1)
+    if cursor is not None:
+        query = query.where(Drink.id > cursor)
+    async with app.db_session() as session:
+        drinks = (await session.execute(query)).scalars().all()
+    return routes.page_response(drinks, form, limit)
+
+
+async def drinks_stream_response(form):
+    cursor = int_arg(request.args, 'cursor')
+    query = select(Drink).order_by(Drink.id).execution_options(
+        yield_per=DRINKS_STREAM_BATCH)
+    if cursor is not None:
+        query = query.where(Drink.id > cursor)
+
+    async def generate():
+        async with app.db_session() as session:
+            result = await session.stream(query)
+            async for drink in result.scalars():
+                yield routes.drink_line(drink, form)
+
+    return Response(generate(), status=200, mimetype='application/x-ndjson')
+
+
+async def drinks_response(form):
+    if request.args.get('format') == 'ndjson':
+        return await drinks_stream_response(form)
+    if 'limit' in request.args or 'cursor' in request.args:
+        return await drinks_page_response(form)
+    return await menu_response(form)
+
+
+async def load_inventory():
+    # current_inventory only reads the database when it is stale or drinks
+    # were written since
+    async with app.db_session() as session:
+        return await session.run_sync(current_inventory)
+
+
+async def write_by_id(write, id, **kwargs):
+    # runs Drink.update_by_id or Drink.delete_by_id on a sync session
+    with write_errors():
+        async with app.db_session() as session:
+            written = await session.run_sync(
+                lambda sync_session: write(id, session=sync_session,
+                                           **kwargs))
+    if not written:
+        abort(404)
+
+
+# ROUTES
+
+
+@app.route('/drinks')
+async def getDrinks():
+    return await drinks_response('short')
+
+
+@app.route('/drinks-detail')
+@requires_auth('get:drinks-detail')
+async def getDrinksDetails(payload):
+    return await drinks_response('long')
+
+
+@app.route('/drinks/search')
+async def searchDrinks():
+    q, limit, offset = search_args(request.args)
+    try:
+        async with app.db_session() as session:
+            drinks = await session.run_sync(
+                lambda sync_session: Drink.search(
+                    q, limit + 1, offset, session=sync_session))
+    except ValueError:
+        abort(400)
+    return routes.search_response(drinks, limit, offset)
+
+
+@app.route('/drinks', methods=['POST'])
+@requires_auth('post:drinks')
+async def postDrink(payload):
+    drink = routes.new_drink(await request.get_json())
+    with write_errors():
+        async with app.db_session() as session:
+            session.add(drink)
+            await session.commit()
+    drinks_changed([drink.id])
+    return routes.drink_response(drink)
+
+
+@app.route('/drinks/bulk', methods=['POST'])
+@requires_auth('post:drinks')
+async def postDrinksBulk(payload):
+    items = routes.bulk_items(request.mimetype,
+                              await request.get_data(as_text=True))
+    results, rows = validate_drinks(items)
+    try:
+        async with app.db_session() as session:
+            written = await session.run_sync(
+                lambda sync_session: Drink.upsert_many(
+                    [row for result, row in rows], session=sync_session))
+    except exc.SQLAlchemyError:
+        abort(422)
+    return routes.bulk_response(results, rows, written)
+
+
+@app.route('/drinks/<int:id>', methods=['PATCH'])
+@requires_auth('patch:drinks')
+async def patchDrink(payload, id):
+    title, recipe = routes.drink_changes(await request.get_json())
+    await write_by_id(Drink.update_by_id, id, title=title, recipe=recipe,
+                      version=if_match_version(request.if_match))
+    async with app.db_session() as session:
+        # the drink can be deleted between the UPDATE and this read
+        drink = await session.get(Drink, id)
+    if drink is None:
+        abort(404)
+    return routes.drink_response(drink)
+
+
+@app.route('/drinks/<int:id>', methods=['DELETE'])
+@requires_auth('delete:drinks')
+async def deleteDrink(payload, id):
+    await write_by_id(Drink.delete_by_id, id,
+                      version=if_match_version(request.if_match))
+    return routes.delete_response(id)
+
+
+@app.route('/drinks/makeable')
+@requires_auth('get:drinks-detail')
+async def getMakeableDrinks(payload):
+    return routes.makeable_response(await load_inventory())
+
+
+@app.route('/inventory')
+@requires_auth('get:inventory')
+async def getInventory(payload):
+    return routes.inventory_response(await load_inventory())
+
+
+@app.route('/inventory/<name>', methods=['PATCH'])
+@requires_auth('patch:inventory')
+async def patchInventory(payload, name):
+    values = routes.stock_values(await request.get_json(silent=True))
+    try:
+        async with app.db_session() as session:
+            ingredient = await session.run_sync(
+                lambda sync_session: Ingredient.save(
+                    name, session=sync_session, **values))
+    except exc.SQLAlchemyError:
+        abort(422)
+    return routes.ingredient_response(ingredient)
+
+
+@app.route('/inventory/rollup', methods=['POST'])
+@requires_auth('get:inventory')
+async def postInventoryRollup(payload):
+    volumes = routes.rollup_volumes(await request.get_json(silent=True))
+    return routes.rollup_response(await load_inventory(), volumes)
+
+
+@app.route('/orders', methods=['POST'])
+@requires_auth('post:orders')
+async def postOrder(payload):
+    body = await request.get_json(silent=True)
+    async with app.db_session() as session:
+        return await session.run_sync(
+            lambda sync_session: routes.place_order(
+                body, lambda ids: Drink.existing_ids(
+                    ids, session=sync_session), order_writer))
+
+
+# Error Handling
+
+routes.register_error_handlers(app)
@@ -1,13 +1,35 @@
-import json
+import os
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from .jwks import JWKSKeyStore, JWKSError
+from .token_cache import TokenCache, permission_set
 
 
 AUTH0_DOMAIN = 'sfnd.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffeeShopApi'
+JWKS_URL = os.environ.get(
+    'JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+'''
+signing keys are fetched once and kept in memory, see jwks.JWKSKeyStore
+    JWKS_TTL: seconds before the keys are refreshed in the background
+    JWKS_STALE_GRACE: seconds the old keys are still served
+        while Auth0 cannot be reached
+'''
+jwks_store = JWKSKeyStore(
+    JWKS_URL,
+    ttl=int(os.environ.get('JWKS_TTL', 600)),
+    stale_grace=int(os.environ.get('JWKS_STALE_GRACE', 3600)))
+
+'''
+verified payloads are cached per token until they expire, see
+token_cache.TokenCache
+    TOKEN_CACHE_SIZE: maximum number of tokens kept, 0 disables the cache
+'''
+token_cache = TokenCache(maxsize=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)))
 
 # AuthError Exception
 '''
@@ -35,7 +57,17 @@ class AuthError(Exception):
 
 
 def get_token_auth_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+'''
+parse_auth_header(auth)
+    the framework independent part of get_token_auth_header
+    auth is the raw Authorization header value, or None
+'''
+
+
+def parse_auth_header(auth):
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -70,6 +102,10 @@ def get_token_auth_header():
     @INPUTS
         permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
+        any_of: optional permissions of which at least one is required
+        all_of: optional permissions which are all required
+        granted: optional frozenset of the payload permissions,
+            compiled once per token by token_cache
 
     it should raise an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
@@ -78,14 +114,21 @@ def get_token_auth_header():
 '''
 
 
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, any_of=(), all_of=(),
+                      granted=None):
     if 'permissions' not in payload:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
 
-    if permission not in payload['permissions']:
+    if granted is None:
+        granted = permission_set(payload)
+    required = frozenset(all_of)
+    if permission or not (any_of or all_of):
+        required = required | {permission}
+    if (not granted.issuperset(required) or
+            (any_of and granted.isdisjoint(any_of))):
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -100,6 +143,7 @@ def check_permissions(permission, payload):
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        (served from the in-memory jwks_store, not fetched per request)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -109,25 +153,46 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    return decode_with_key(token, signing_key(unverified_kid(token)))
+
+
+'''
+the steps of verify_decode_jwt, usable on their own by callers that
+fetch the signing key differently (see asgi.py)
+    unverified_kid(token): the kid from the token header
+    signing_key(kid): the rsa key for kid from jwks_store, may block on
+        a fetch of the key set
+    decode_with_key(token, rsa_key): verifies the signature and the claims
+'''
+
+
+def unverified_kid(token):
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
+    return unverified_header['kid']
+
+
+def signing_key(kid):
+    try:
+        return jwks_store.get_key(kid)
+    except JWKSError:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
+
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+def decode_with_key(token, rsa_key):
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -166,22 +231,32 @@ def verify_decode_jwt(token):
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
+        any_of: optional permissions of which at least one is required
+            (i.e. any_of=['patch:drinks', 'post:drinks'])
+        all_of: optional permissions which are all required
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
+        (a token already verified is served from token_cache instead)
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(permission='', any_of=(), all_of=()):
+    any_of = frozenset(any_of)
+    all_of = frozenset(all_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            verified = token_cache.get(token)
+            if verified is None:
+                verified = token_cache.put(token, verify_decode_jwt(token))
+            check_permissions(permission, verified.payload, any_of, all_of,
+                              granted=verified.permissions)
+            return f(verified.payload, *args, **kwargs)
 
         return wrapper
     return requires_auth_decorator
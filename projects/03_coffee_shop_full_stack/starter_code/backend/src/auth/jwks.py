@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+JWKSError Exception
+raised when no usable signing keys can be obtained from the JWKS endpoint
+'''
+
+
+class JWKSError(Exception):
+    pass
+
+
+'''
+JWKSKeyStore
+an in-memory store of the signing keys published at a JWKS url, indexed by kid
+
+    url: the jwks.json location, anything urlopen understands
+        (https:// for Auth0, file:// for a local JWKS file in tests)
+    ttl: seconds a fetched key set is considered fresh
+    stale_grace: seconds past the ttl that the old keys are still served
+        while the endpoint cannot be reached
+    min_refetch_interval: minimum seconds between two fetches triggered by
+        unknown kids, so forged headers cannot hammer the endpoint
+    timeout: socket timeout of a single fetch
+    fetch: optional callable returning the parsed jwks document,
+        replaces the urlopen call (useful for HTTP stand-ins)
+    clock: optional monotonic clock behind ttl, stale_grace and
+        min_refetch_interval
+
+    once the ttl expires the keys are refreshed in a background thread and the
+    current keys keep being served; only past the grace window does a lookup
+    block on the network. fetches happen outside the lock, which is only
+    held to swap in the new keys, and a failed background refresh is not
+    retried before min_refetch_interval.
+'''
+
+
+class JWKSKeyStore:
+
+    def __init__(self, url, ttl=600, stale_grace=3600,
+                 min_refetch_interval=30, timeout=5,
+                 fetch=None, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.stale_grace = stale_grace
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self._fetch_jwks = fetch or self._urlopen_jwks
+        self._clock = clock
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    '''
+    get_key(kid)
+        returns the rsa key dict for kid, or None if the endpoint does not
+        publish it (even after one forced refetch)
+        raises JWKSError if no keys are available within the grace window
+    '''
+
+    def get_key(self, kid):
+        now = self._clock()
+        age = None if self._fetched_at is None else now - self._fetched_at
+
+        if age is None or age > self.ttl + self.stale_grace:
+            self.refresh()
+        elif age > self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_refetch():
+            # the signing key may have been rotated since our last fetch
+            try:
+                self.refresh()
+            except JWKSError:
+                return None
+            key = self._keys.get(kid)
+        return key
+
+    '''
+    peek(kid)
+        returns the stored rsa key for kid without ever fetching, or None
+        when the key is unknown or the keys are past the grace window
+        (the caller then falls back to get_key, off the event loop)
+        past the ttl a background refresh is started, like get_key does
+    '''
+
+    def peek(self, kid):
+        if self._fetched_at is None:
+            return None
+        age = self._clock() - self._fetched_at
+        if age > self.ttl + self.stale_grace:
+            return None
+        if age > self.ttl:
+            self._refresh_in_background()
+        return self._keys.get(kid)
+
+    '''
+    refresh()
+        fetches the key set synchronously and replaces the stored keys
+        raises JWKSError if the fetch fails and the stored keys are too old
+    '''
+
+    def refresh(self):
+        self._last_attempt = self._clock()
+        try:
+            jwks = self._fetch_jwks()
+        except Exception as e:
+            # back off from the failure, not from the start of the fetch
+            self._last_attempt = self._clock()
+            if not self._within_grace():
+                raise JWKSError(
+                    'Unable to fetch JWKS from {}: {}'.format(self.url, e))
+            return
+        keys = self._index(jwks)
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = self._clock()
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+    def _refresh_in_background(self):
+        # never waits: a refresh already running or one that just failed
+        # leaves the current keys in place
+        if not self._refreshing.acquire(blocking=False):
+            return
+        if not self._may_refetch():
+            self._refreshing.release()
+            return
+        self._last_attempt = self._clock()
+
+        def run():
+            try:
+                self.refresh()
+            except JWKSError:
+                pass
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _may_refetch(self):
+        return (self._last_attempt is None or
+                self._clock() - self._last_attempt >=
+                self.min_refetch_interval)
+
+    def _within_grace(self):
+        return (self._fetched_at is not None and
+                self._clock() - self._fetched_at <=
+                self.ttl + self.stale_grace)
+
+    def _urlopen_jwks(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    @staticmethod
+    def _index(jwks):
+        keys = {}
+        for key in jwks['keys']:
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }
+        return keys
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+'''
+VerifiedToken
+a verified jwt payload together with its permissions claim compiled
+into a frozenset, so permission checks are set lookups
+'''
+
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions'])
+
+
+def permission_set(payload):
+    return frozenset(payload.get('permissions') or ())
+
+
+'''
+TokenCache
+a bounded LRU cache of verified jwt payloads
+
+    maxsize: maximum number of tokens kept, the least recently used
+        token is evicted first
+    clock: optional wall clock, compared with the exp claims
+
+    entries are keyed by the sha256 digest of the raw token (the token itself
+    is never kept) and expire at the token's exp claim, so a cached payload is
+    never served for longer than the token would have verified.
+'''
+
+
+class TokenCache:
+
+    def __init__(self, maxsize=1024, clock=time.time):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    '''
+    get(token)
+        returns the cached VerifiedToken for token, or None on a miss
+    '''
+
+    def get(self, token):
+        key = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            verified, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return verified
+
+    '''
+    put(token, payload)
+        stores a verified payload until its exp claim and returns it
+        as a VerifiedToken
+        payloads without exp are not cached
+    '''
+
+    def put(self, token, payload):
+        verified = VerifiedToken(payload, permission_set(payload))
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)) or self.maxsize <= 0:
+            return verified
+        key = self._digest(token)
+        with self._lock:
+            self._entries[key] = (verified, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return verified
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _digest(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
@@ -0,0 +1,74 @@
+# vendored copy, the source of truth is shared/cache.py at the root of the
+# repository: edit it there and run `python shared/sync.py`
+import threading
+import time
+
+
+'''
+ReadThroughCache
+keeps values loaded from the database in memory, by key, until they
+expire or invalidate() is called
+
+    ttl: optional seconds a value is served before it is loaded again,
+        None keeps it until invalidate()
+    clock: optional monotonic clock
+
+    invalidate() only reaches this process: the models call it after
+    their writes, the other worker processes only pick those writes up
+    once their own values expire. a None value is never kept.
+'''
+
+
+class ReadThroughCache:
+
+    def __init__(self, ttl=None, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    '''
+    get(key, load)
+        returns the value of key, calling load() when there is no valid one
+    peek(key), store(key, value, generation, loaded_at)
+        the two halves of get(), for callers that load the value
+        asynchronously. generation must be read before the database is
+        queried, the value is dropped if invalidate() ran in between
+    invalidate()
+        forgets every value
+    '''
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key, load):
+        value = self.peek(key)
+        if value is not None:
+            return value
+        generation = self._generation
+        loaded_at = self._clock()
+        return self.store(key, load(), generation, loaded_at)
+
+    def peek(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            if self.ttl is None or self._clock() - loaded_at < self.ttl:
+                return value
+        return None
+
+    def store(self, key, value, generation, loaded_at=None):
+        if loaded_at is None:
+            loaded_at = self._clock()
+        with self._lock:
+            # the load may have read rows from before the invalidating write
+            if generation == self._generation:
+                self._entries[key] = (value, loaded_at)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
@@ -0,0 +1,295 @@
+import os
+import threading
+import time
+from numbers import Number
+
+import numpy as np
+
+
+'''
+Inventory
+an in-memory, vectorized view of what every drink consumes
+
+the recipes are kept as a dense parts matrix, one row per drink and one
+column per ingredient name, next to the stock and unit cost vectors of the
+ingredients. from them it derives, with numpy:
+    the cost of one serving of every drink (parts @ unit_cost)
+    how many servings of every drink the current stock allows
+    the ingredient consumption, cost and shortfall of any order volumes
+
+    ttl: optional seconds before the next lookup reloads everything from
+        the database, the only way stock and recipes edited through other
+        worker processes reach this one
+    clock: optional monotonic clock the ttl is timed with
+
+    the inventory is loaded lazily (see models.current_inventory). writes
+    only mark the drinks they touched as dirty, the next lookup reloads
+    those rows and recomputes them alone. ingredients without stock are
+    at 0, drinks that use them cannot be made.
+'''
+
+
+class Inventory:
+
+    def __init__(self, ttl=None, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._dirty = set()
+        self._clear()
+
+    def _clear(self):
+        self._parts = np.zeros((0, 0))
+        self._stock = np.zeros(0)
+        self._unit_cost = np.zeros(0)
+        self._servings = np.zeros(0)
+        self._drink_cost = np.zeros(0)
+        self._rows = {}
+        self._ids = []
+        self._titles = []
+        self._columns = {}
+        self._names = []
+        self._memo = {}
+
+    @property
+    def stale(self):
+        return (self._loaded_at is None or (
+            self.ttl is not None and
+            self._clock() - self._loaded_at >= self.ttl))
+
+    '''
+    load(drinks, ingredients)
+        replaces everything
+            drinks: (id, title, recipe) tuples, recipe an ingredient list,
+                drinks whose recipe is not one are left out
+            ingredients: (name, stock, unit_cost) tuples
+    '''
+
+    def load(self, drinks, ingredients):
+        drinks = [drink for drink in drinks if readable(drink[2])]
+        ingredients = list(ingredients)
+        with self._lock:
+            self._clear()
+            names = {name for name, stock, unit_cost in ingredients}
+            for id, title, recipe in drinks:
+                names.update(ingredient['name'] for ingredient in recipe)
+            self._names = sorted(names)
+            self._columns = {name: j for j, name in enumerate(self._names)}
+            self._stock = np.zeros(len(self._names))
+            self._unit_cost = np.zeros(len(self._names))
+            for name, stock, unit_cost in ingredients:
+                self._stock[self._columns[name]] = stock
+                self._unit_cost[self._columns[name]] = unit_cost
+
+            self._parts = np.zeros((len(drinks), len(self._names)))
+            for i, (id, title, recipe) in enumerate(drinks):
+                self._rows[id] = i
+                self._ids.append(id)
+                self._titles.append(title)
+                self._fill_row(i, recipe)
+            self._drink_cost = self._parts @ self._unit_cost
+            self._servings = self._count_servings(self._parts)
+            self._loaded_at = self._clock()
+
+    '''
+    mark_dirty(ids)
+        records drinks written since the load, ignored until it is loaded
+    take_dirty()
+        returns and forgets the dirty drink ids, to be passed to apply()
+    apply(drinks, ids)
+        reloads the dirty drinks in ids: the (id, title, recipe) tuples of
+        drinks are set, the ids without a tuple were deleted
+    invalidate()
+        forgets everything, the next lookup loads it again
+    '''
+
+    def mark_dirty(self, ids):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._dirty.update(ids)
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._dirty.clear()
+
+    def apply(self, drinks, ids):
+        # an unreadable recipe leaves the drink out, as if it was deleted
+        drinks = [drink for drink in drinks if readable(drink[2])]
+        with self._lock:
+            for id, title, recipe in drinks:
+                for ingredient in recipe:
+                    self._column(ingredient['name'])
+            new = [id for id, title, recipe in drinks if id not in self._rows]
+            for id in new:
+                self._rows[id] = len(self._ids)
+                self._ids.append(id)
+                self._titles.append(None)
+            if new:
+                self._grow(len(new))
+
+            rows = []
+            for id, title, recipe in drinks:
+                i = self._rows[id]
+                self._titles[i] = title
+                self._parts[i] = 0
+                self._fill_row(i, recipe)
+                rows.append(i)
+            rows = np.array(rows, dtype=int)
+            self._drink_cost[rows] = self._parts[rows] @ self._unit_cost
+            self._servings[rows] = self._count_servings(self._parts[rows])
+
+            found = {id for id, title, recipe in drinks}
+            for id in set(ids) - found:
+                self._remove_drink(id)
+            self._memo.clear()
+
+    '''
+    set_ingredient(name, stock, unit_cost)
+        changes the stock and/or unit cost of one ingredient, only the
+        drinks using it are recomputed
+    '''
+
+    def set_ingredient(self, name, stock=None, unit_cost=None):
+        with self._lock:
+            j = self._column(name)
+            if stock is not None:
+                self._stock[j] = stock
+            if unit_cost is not None:
+                self._unit_cost[j] = unit_cost
+            rows = np.flatnonzero(self._parts[:, j])
+            self._drink_cost[rows] = self._parts[rows] @ self._unit_cost
+            self._servings[rows] = self._count_servings(self._parts[rows])
+            self._memo.clear()
+
+    '''
+    ingredients()
+        (name, stock, unit_cost) of every known ingredient, by name
+    makeable()
+        (id, title, servings) of the drinks the current stock allows at
+        least one serving of, by id
+    drink_cost(id)
+        the ingredient cost of one serving of drink id
+    rollup(volumes)
+        the ingredient consumption of serving volumes, a {drink id: count}
+        dict, as (name, consumption, cost, shortfall) tuples of the
+        ingredients used, and the total cost
+        raises KeyError for an unknown drink id
+    '''
+
+    def ingredients(self):
+        return list(zip(self._names, self._stock.tolist(),
+                        self._unit_cost.tolist()))
+
+    def makeable(self):
+        with self._lock:
+            rows = np.flatnonzero(self._servings >= 1)
+            rows = rows[np.argsort(np.array(self._ids)[rows])]
+            servings = self._servings[rows].astype(int).tolist()
+            return [(self._ids[i], self._titles[i], count)
+                    for i, count in zip(rows.tolist(), servings)]
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    def drink_cost(self, id):
+        return float(self._drink_cost[self._rows[id]])
+
+    def rollup(self, volumes):
+        with self._lock:
+            counts = np.zeros(len(self._ids))
+            for id, count in volumes.items():
+                counts[self._rows[id]] += count
+            consumption = counts @ self._parts
+            cost = consumption * self._unit_cost
+            shortfall = np.maximum(consumption - self._stock, 0)
+            used = np.flatnonzero(consumption)
+            return ([(self._names[j], float(consumption[j]), float(cost[j]),
+                      float(shortfall[j])) for j in used],
+                    float(cost.sum()))
+
+    '''
+    memo(key, build)
+        returns build() and keeps it until the next change, for responses
+        derived from the inventory
+    '''
+
+    def memo(self, key, build):
+        value = self._memo.get(key)
+        if value is None:
+            with self._lock:
+                value = self._memo[key] = build()
+        return value
+
+    def _column(self, name):
+        j = self._columns.get(name)
+        if j is None:
+            j = self._columns[name] = len(self._names)
+            self._names.append(name)
+            self._parts = np.pad(self._parts, ((0, 0), (0, 1)))
+            self._stock = np.append(self._stock, 0.0)
+            self._unit_cost = np.append(self._unit_cost, 0.0)
+        return j
+
+    def _fill_row(self, i, recipe):
+        for ingredient in recipe:
+            self._parts[i, self._columns[ingredient['name']]] += \
+                ingredient['parts']
+
+    def _grow(self, count):
+        self._parts = np.vstack([self._parts,
+                                 np.zeros((count, len(self._names)))])
+        self._drink_cost = np.append(self._drink_cost, np.zeros(count))
+        self._servings = np.append(self._servings, np.zeros(count))
+
+    def _remove_drink(self, id):
+        # the last row takes the place of the removed one
+        i = self._rows.pop(id, None)
+        if i is None:
+            return
+        last = len(self._ids) - 1
+        if i != last:
+            moved = self._ids[last]
+            self._rows[moved] = i
+            self._ids[i] = moved
+            self._titles[i] = self._titles[last]
+            self._parts[i] = self._parts[last]
+            self._drink_cost[i] = self._drink_cost[last]
+            self._servings[i] = self._servings[last]
+        self._ids.pop()
+        self._titles.pop()
+        self._parts = self._parts[:last]
+        self._drink_cost = self._drink_cost[:last]
+        self._servings = self._servings[:last]
+
+    def _count_servings(self, parts):
+        # the scarcest ingredient of each row limits its servings
+        used = parts > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(used, self._stock / np.where(used, parts, 1),
+                              np.inf)
+        servings = np.floor(ratios.min(axis=1, initial=np.inf))
+        servings[~used.any(axis=1)] = 0
+        return servings
+
+
+def readable(recipe):
+    return isinstance(recipe, list) and all(
+        isinstance(ingredient, dict) and
+        isinstance(ingredient.get('name'), str) and
+        isinstance(ingredient.get('parts'), Number) and
+        not isinstance(ingredient['parts'], bool)
+        for ingredient in recipe)
+
+
+'''
+    INVENTORY_TTL: seconds before the inventory is reloaded from the
+        database, 0 only reloads the drinks written in this process
+'''
+inventory = Inventory(ttl=float(os.environ.get('INVENTORY_TTL', 5)) or None)
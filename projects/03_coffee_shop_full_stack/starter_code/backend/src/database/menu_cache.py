@@ -0,0 +1,52 @@
+import hashlib
+import os
+from collections import namedtuple
+
+from .cache import ReadThroughCache
+
+
+'''
+CachedMenu
+a serialized drinks response body and the etag derived from it
+'''
+
+CachedMenu = namedtuple('CachedMenu', ['body', 'etag'])
+
+
+'''
+MenuCache
+the serialized drinks menu, one CachedMenu per representation ('short'
+for /drinks, 'long' for /drinks-detail), kept in a ReadThroughCache
+
+    ttl: optional seconds a menu is served before it is rebuilt, a menu
+        edited through another worker process shows up here at most ttl
+        seconds later
+    clock: optional monotonic clock
+
+    Drink.insert/update/delete call invalidate() so the next request in
+    this process rebuilds the menu from the database.
+'''
+
+
+class MenuCache(ReadThroughCache):
+
+    '''
+    get(form, build)
+        returns the CachedMenu for form, calling build() to serialize
+        the menu to bytes when there is no valid entry
+    store(form, body, generation, built_at)
+        hashes body into its etag and keeps the CachedMenu, get() goes
+        through it too. asgi.py builds the body itself between peek()
+        and store()
+    '''
+
+    def store(self, form, body, generation, built_at=None):
+        menu = CachedMenu(body, hashlib.sha1(body).hexdigest())
+        return super().store(form, menu, generation, built_at)
+
+
+'''
+    MENU_CACHE_TTL: seconds a cached menu is served, 0 serves it until
+        the next write in this process
+'''
+menu_cache = MenuCache(ttl=float(os.environ.get('MENU_CACHE_TTL', 5)) or None)
@@ -0,0 +1,210 @@
+import json
+import sys
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Float,
+                        DateTime, ForeignKey, create_engine, text)
+from sqlalchemy.engine import Connection
+
+
+'''
+versioned schema migrations for the coffee shop database
+
+the applied version is kept in the schema_version table, every migration
+below runs once, in order, inside the upgrade transaction. migrations spell
+out their own DDL instead of using the models, so replaying them on an old
+database always produces the same schema.
+
+    python -m src.database.migrations
+        upgrades the database at DATABASE_URL (or the default sqlite file)
+'''
+
+
+def create_drink_table(conn):
+    # checkfirst keeps databases created by the old setup_db as they are
+    metadata = MetaData()
+    Table('drink', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('title', String(80), unique=True),
+          Column('recipe', String(180), nullable=False))
+    metadata.create_all(conn)
+
+
+def recipe_json(conn):
+    # recipes become native JSONB on postgresql, single ingredient
+    # objects are wrapped in a list everywhere
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            'ALTER TABLE drink ALTER COLUMN recipe TYPE JSONB '
+            'USING recipe::jsonb'))
+        conn.execute(text(
+            "UPDATE drink SET recipe = jsonb_build_array(recipe) "
+            "WHERE jsonb_typeof(recipe) = 'object'"))
+        return
+    rows = conn.execute(text('SELECT id, recipe FROM drink')).fetchall()
+    for id, blob in rows:
+        try:
+            recipe = json.loads(blob)
+        except ValueError as e:
+            raise ValueError(
+                'drink {} has an invalid recipe blob: {}'.format(id, e))
+        if isinstance(recipe, dict):
+            conn.execute(text('UPDATE drink SET recipe = :recipe '
+                              'WHERE id = :id'),
+                         {'recipe': json.dumps([recipe]), 'id': id})
+
+
+def drink_version(conn):
+    # existing drinks start at version 1, like new ones
+    conn.execute(text(
+        'ALTER TABLE drink ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+# the ingredient names of a drink row, space separated, for the search index
+INGREDIENT_NAMES = (
+    "(SELECT group_concat(json_extract(value, '$.name'), ' ') "
+    "FROM json_each({}.recipe))")
+
+
+def drink_search(conn):
+    # an sqlite FTS5 index over titles and ingredient names, kept in sync by
+    # triggers so every write path (ORM, bulk upserts, conditional writes)
+    # updates it. other databases search the drink table directly
+    if conn.dialect.name != 'sqlite':
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE drink_search USING fts5("
+        "title, ingredients, tokenize = 'unicode61 remove_diacritics 2')"))
+    index_row = ('INSERT INTO drink_search (rowid, title, ingredients) '
+                 'VALUES (new.id, new.title, {}); '.format(
+                     INGREDIENT_NAMES.format('new')))
+    conn.execute(text(
+        'CREATE TRIGGER drink_search_insert AFTER INSERT ON drink BEGIN '
+        + index_row + 'END'))
+    conn.execute(text(
+        'CREATE TRIGGER drink_search_update AFTER UPDATE OF title, recipe '
+        'ON drink BEGIN '
+        'DELETE FROM drink_search WHERE rowid = old.id; '
+        + index_row + 'END'))
+    conn.execute(text(
+        'CREATE TRIGGER drink_search_delete AFTER DELETE ON drink BEGIN '
+        'DELETE FROM drink_search WHERE rowid = old.id; END'))
+    conn.execute(text(
+        'INSERT INTO drink_search (rowid, title, ingredients) '
+        'SELECT id, title, {} FROM drink'.format(
+            INGREDIENT_NAMES.format('drink'))))
+
+
+def create_ingredient_table(conn):
+    metadata = MetaData()
+    Table('ingredient', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('name', String(80), unique=True, nullable=False),
+          Column('stock', Float, nullable=False, server_default='0'),
+          Column('unit_cost', Float, nullable=False, server_default='0'))
+    metadata.create_all(conn)
+
+
+def create_order_tables(conn):
+    # order ids are generated by the app, so they can be acknowledged
+    # before the order is written
+    metadata = MetaData()
+    Table('drink', metadata, Column('id', Integer, primary_key=True))
+    Table('orders', metadata,
+          Column('id', String(32), primary_key=True),
+          Column('created_at', DateTime, nullable=False))
+    Table('order_item', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('order_id', String(32), ForeignKey('orders.id'),
+                 nullable=False, index=True),
+          Column('drink_id', Integer,
+                 ForeignKey('drink.id', ondelete='SET NULL')),
+          Column('quantity', Integer, nullable=False))
+    metadata.create_all(conn, tables=[metadata.tables['orders'],
+                                      metadata.tables['order_item']])
+
+
+MIGRATIONS = [
+    (1, 'create drink table', create_drink_table),
+    (2, 'store recipes as json', recipe_json),
+    (3, 'add drink version', drink_version),
+    (4, 'index drinks for search', drink_search),
+    (5, 'create ingredient table', create_ingredient_table),
+    (6, 'create order tables', create_order_tables),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class SchemaOutOfDate(Exception):
+    pass
+
+
+def _version_table():
+    metadata = MetaData()
+    return Table('schema_version', metadata,
+                 Column('version', Integer, nullable=False))
+
+
+'''
+current_version(bind)
+    returns the applied schema version, 0 for an uninitialized database
+    bind is an engine or an open connection
+'''
+
+
+def current_version(bind):
+    if not isinstance(bind, Connection):
+        with bind.connect() as conn:
+            return current_version(conn)
+    version_table = _version_table()
+    if not bind.dialect.has_table(bind, version_table.name):
+        return 0
+    return bind.execute(version_table.select()).scalar() or 0
+
+
+'''
+upgrade(engine)
+    applies the pending migrations in one transaction, safe to run again
+    returns the list of versions applied
+'''
+
+
+def upgrade(engine):
+    version_table = _version_table()
+    applied = []
+    with engine.begin() as conn:
+        version_table.metadata.create_all(conn)
+        version = conn.execute(version_table.select()).scalar()
+        if version is None:
+            conn.execute(version_table.insert().values(version=0))
+            version = 0
+        for number, description, migrate in MIGRATIONS:
+            if number > version:
+                migrate(conn)
+                applied.append(number)
+        if applied:
+            conn.execute(version_table.update().values(version=applied[-1]))
+    return applied
+
+
+'''
+check_schema(bind)
+    the only database work done at app startup
+    raises SchemaOutOfDate if migrations are pending
+'''
+
+
+def check_schema(bind):
+    version = current_version(bind)
+    if version < SCHEMA_VERSION:
+        raise SchemaOutOfDate(
+            'database schema is at version {}, the app needs {}. '
+            'Run `python -m src.database.migrations` or `flask init-db` '
+            'first.'.format(version, SCHEMA_VERSION))
+    return version
+
+
+if __name__ == '__main__':
+    from .models import database_path
+    url = sys.argv[1] if len(sys.argv) > 1 else database_path
+    applied = upgrade(create_engine(url))
+    print('applied migrations: {}'.format(applied or 'none, up to date'))
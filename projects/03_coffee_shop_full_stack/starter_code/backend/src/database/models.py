@@ -1,27 +1,61 @@
 import os
-from sqlalchemy import Column, String, Integer
+import re
+import uuid
+from datetime import datetime
+from numbers import Number
+from sqlalchemy import (Column, String, Integer, Float, Text, DateTime,
+                        ForeignKey, MetaData, bindparam, cast, or_, text)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from .menu_cache import menu_cache
+from .inventory import inventory
+from .migrations import check_schema, upgrade
+from .profiles import get_profile, engine_options, apply_profile
+
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
-database_path = "sqlite:///{}".format(
-    os.path.join(project_dir, database_filename))
+database_path = os.environ.get('DATABASE_URL', "sqlite:///{}".format(
+    os.path.join(project_dir, database_filename)))
 
 db = SQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the engine is tuned by the DATABASE_PROFILE profile, see profiles.py
+    only checks the schema version, it never creates or drops tables
+    check=False skips that check, for the commands that migrate
+    !!NOTE run `python -m src.database.migrations` (or `flask init-db`)
+    to create or upgrade the database first
 '''
 
 
-def setup_db(app):
+def setup_db(app, check=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db_drop_and_create_all()
+    apply_profile(db.engine, get_profile())
+    if check:
+        check_schema(db.engine)
+
+
+'''
+db_init()
+    applies the pending schema migrations, safe to run on every deploy
+    returns the list of versions applied
+'''
+
+
+def db_init():
+    applied = upgrade(db.engine)
+    menu_cache.invalidate()
+    inventory.invalidate()
+    return applied
 
 
 '''
@@ -33,8 +67,155 @@ db_drop_and_create_all()
 
 
 def db_drop_and_create_all():
-    db.drop_all()
-    db.create_all()
+    db.session.remove()
+    metadata = MetaData()
+    metadata.reflect(bind=db.engine)
+    metadata.drop_all(bind=db.engine)
+    db_init()
+
+
+'''
+validate_recipe(recipe)
+    checks a recipe has the [{'color': string, 'name':string,
+    'parts':number}] shape, a single ingredient dict is wrapped in a list
+    returns the recipe list, raises ValueError describing the first problem
+'''
+
+
+def validate_recipe(recipe):
+    if isinstance(recipe, dict):
+        recipe = [recipe]
+    if not isinstance(recipe, list) or not recipe:
+        raise ValueError('recipe must be a non empty list of ingredients')
+    for ingredient in recipe:
+        if not isinstance(ingredient, dict):
+            raise ValueError('ingredient must be an object')
+        for key in ('color', 'name'):
+            if not isinstance(ingredient.get(key), str):
+                raise ValueError('ingredient {} must be a string'.format(key))
+        parts = ingredient.get('parts')
+        if not isinstance(parts, Number) or isinstance(parts, bool):
+            raise ValueError('ingredient parts must be a number')
+    return recipe
+
+
+'''
+coerce_recipe(value)
+    the recipe list for a Drink.recipe assignment
+    accepts a list, a single ingredient dict or a json string
+    raises ValueError unless it passes validate_recipe, no drink is
+    written with a recipe the menus and the inventory cannot read
+'''
+
+
+def coerce_recipe(value):
+    if isinstance(value, (str, bytes)):
+        value = json.loads(value)
+    return validate_recipe(value)
+
+
+'''
+validate_drinks(items)
+    validates the items of a bulk request, see POST /drinks/bulk
+    returns (results, rows): one result dict per item, invalid items
+    already carry their error, and a (result, row) pair for every valid
+    item with row ready for Drink.upsert_many
+bulk_summary(results, rows, written)
+    fills in the results from the Drink.upsert_many return value
+    returns the bulk response body
+'''
+
+
+def validate_drinks(items):
+    results = []
+    rows = []
+    seen = set()
+    for index, item in enumerate(items):
+        result = {'index': index}
+        results.append(result)
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('drink must be an object')
+            title = item.get('title')
+            result['title'] = title
+            if not isinstance(title, str) or not 0 < len(title) <= 80:
+                raise ValueError('title must be a string of 1 to 80 chars')
+            if title in seen:
+                raise ValueError('duplicate title in request')
+            recipe = validate_recipe(item.get('recipe'))
+        except ValueError as e:
+            result.update(status='invalid', error=str(e))
+            continue
+        seen.add(title)
+        rows.append((result, {'title': title, 'recipe': recipe}))
+    return results, rows
+
+
+def bulk_summary(results, rows, written):
+    for (result, row), (id, created) in zip(rows, written):
+        result.update(status='created' if created else 'updated', id=id)
+    created = sum(1 for r in results if r['status'] == 'created')
+    return {
+        "success": True,
+        "created": created,
+        "updated": len(rows) - created,
+        "failed": len(results) - len(rows),
+        "results": results
+    }
+
+
+'''
+RecipeJSON
+column type of Drink.recipe
+    a native JSONB column on postgresql, a json encoded text column elsewhere
+    text values are returned undecoded, Drink.recipe decodes them on first use
+'''
+
+
+class RecipeJSON(TypeDecorator):
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, separators=(',', ':'))
+
+    def process_result_value(self, value, dialect):
+        return value
+
+
+'''
+drinks_changed(ids)
+    called after every committed drink write, drops the cached menus and
+    marks the drinks for the inventory to reload
+'''
+
+
+def drinks_changed(ids):
+    menu_cache.invalidate()
+    inventory.mark_dirty(ids)
+
+
+# bm25 weights of the title and ingredients columns of drink_search
+SEARCH_WEIGHTS = (10.0, 1.0)
+
+
+'''
+VersionConflict Exception
+raised when a drink changed or was deleted since the version a client read
+'''
+
+
+class VersionConflict(Exception):
+    pass
 
 
 '''
@@ -48,10 +229,36 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
+    # the ingredients - stored as json, see RecipeJSON
     # the required datatype is [{'color': string, 'name':string,
     # 'parts':number}]
-    recipe = Column(String(180), nullable=False)
+    recipe_data = Column('recipe', RecipeJSON, nullable=False)
+    # bumped by every write, the ORM checks it on update() and delete()
+    # and clients send it back in If-Match, see update_by_id
+    version = Column(Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    '''
+    recipe
+        the list of ingredients, decoded from recipe_data on first access
+        and memoized until recipe_data changes
+        accepts a list, a single ingredient dict or a json string
+        !!NOTE assign a new list to change it, in place edits are not saved
+    '''
+
+    @property
+    def recipe(self):
+        raw = self.recipe_data
+        memo = self.__dict__.get('_recipe_memo')
+        if memo is None or memo[0] is not raw:
+            decoded = json.loads(raw) if isinstance(raw, str) else raw
+            memo = self._recipe_memo = (raw, decoded)
+        return memo[1]
+
+    @recipe.setter
+    def recipe(self, value):
+        self.recipe_data = coerce_recipe(value)
 
     '''
     short()
@@ -59,9 +266,8 @@ class Drink(db.Model):
     '''
 
     def short(self):
-        print(json.loads(self.recipe))
         short_recipe = [{'color': r['color'], 'parts': r['parts']}
-                        for r in json.loads(self.recipe)]
+                        for r in self.recipe]
         return {
             'id': self.id,
             'title': self.title,
@@ -77,7 +283,8 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe,
+            'version': self.version
         }
 
     '''
@@ -92,7 +299,10 @@ class Drink(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        id = self.id
         db.session.commit()
+        drinks_changed([id])
 
     '''
     delete()
@@ -104,8 +314,10 @@ class Drink(db.Model):
     '''
 
     def delete(self):
+        id = self.id
         db.session.delete(self)
         db.session.commit()
+        drinks_changed([id])
 
     '''
     update()
@@ -118,7 +330,375 @@ class Drink(db.Model):
     '''
 
     def update(self):
+        id = self.id
         db.session.commit()
+        drinks_changed([id])
+
+    '''
+    upsert_many(rows, batch_size, session)
+        inserts or updates drinks by their unique title in one transaction
+        rows is a list of {'title': string, 'recipe': list} dicts with
+        distinct titles, written with one executemany per batch
+        session defaults to db.session
+        returns a list of (id, created) tuples in the order of rows
+        EXAMPLE
+            Drink.upsert_many([{'title': 'Water', 'recipe': recipe}])
+    '''
+
+    @classmethod
+    def upsert_many(cls, rows, batch_size=500, session=None):
+        session = session or db.session
+        table = cls.__table__
+        results = []
+        try:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                titles = [row['title'] for row in batch]
+                existing = cls._ids_by_title(session, titles)
+                inserts = [row for row in batch
+                           if row['title'] not in existing]
+                updates = [{'b_title': row['title'],
+                            'b_recipe': row['recipe']}
+                           for row in batch if row['title'] in existing]
+                if inserts:
+                    session.execute(table.insert(), inserts)
+                if updates:
+                    session.execute(
+                        table.update()
+                        .where(table.c.title == bindparam('b_title'))
+                        .values(recipe=bindparam('b_recipe'),
+                                version=table.c.version + 1),
+                        updates)
+                ids = (cls._ids_by_title(session, titles) if inserts
+                       else existing)
+                results.extend((ids[title], title not in existing)
+                               for title in titles)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        drinks_changed([id for id, created in results])
+        return results
+
+    '''
+    update_by_id(id, title, recipe, version, session)
+        updates the drink with a single UPDATE ... WHERE id AND version
+        statement, without loading it first, and bumps its version
+        empty title and recipe are left as they are
+        version None updates whatever version is stored
+        returns False if there is no drink id, raises VersionConflict if
+        the drink is no longer at version
+        EXAMPLE
+            Drink.update_by_id(id, title='Black Coffee', version=3)
+    delete_by_id(id, version, session)
+        deletes the drink with a single DELETE ... WHERE id AND version
+        same return value and errors as update_by_id
+    '''
+
+    @classmethod
+    def update_by_id(cls, id, title=None, recipe=None, version=None,
+                     session=None):
+        table = cls.__table__
+        values = {'version': table.c.version + 1}
+        if title:
+            values['title'] = title
+        if recipe:
+            values['recipe'] = coerce_recipe(recipe)
+        return cls._write_by_id(table.update().values(values), id, version,
+                                session or db.session)
+
+    @classmethod
+    def delete_by_id(cls, id, version=None, session=None):
+        return cls._write_by_id(cls.__table__.delete(), id, version,
+                                session or db.session)
+
+    @classmethod
+    def _write_by_id(cls, statement, id, version, session):
+        table = cls.__table__
+        statement = statement.where(table.c.id == id)
+        if version is not None:
+            statement = statement.where(table.c.version == version)
+        try:
+            matched = session.execute(statement).rowcount
+            if not matched:
+                # only a failed write pays for telling the two cases apart
+                session.rollback()
+                if (version is not None and session.query(cls.id)
+                        .filter(cls.id == id).scalar() is not None):
+                    raise VersionConflict(
+                        'drink {} is no longer at version {}'.format(
+                            id, version))
+                return False
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        drinks_changed([id])
+        return True
+
+    '''
+    search(q, limit, offset, session)
+        the drinks whose title or ingredient names contain every word of q,
+        as a word prefix, best matches first
+        uses the drink_search FTS5 index on sqlite (title matches weigh
+        more, see SEARCH_WEIGHTS), a case insensitive scan elsewhere
+        raises ValueError if q has no words
+        EXAMPLE
+            Drink.search('lat milk', limit=20)
+    '''
+
+    @classmethod
+    def search(cls, q, limit=20, offset=0, session=None):
+        session = session or db.session
+        words = re.findall(r'\w+', q or '')
+        if not words:
+            raise ValueError('the search needs at least one word')
+        if session.connection().dialect.name == 'sqlite':
+            match = ' '.join('"{}"*'.format(word) for word in words)
+            statement = text(
+                'SELECT drink.* FROM drink_search '
+                'JOIN drink ON drink.id = drink_search.rowid '
+                'WHERE drink_search MATCH :match '
+                'ORDER BY bm25(drink_search, {}, {}), drink.id '
+                'LIMIT :limit OFFSET :offset'.format(*SEARCH_WEIGHTS))
+            return session.query(cls).from_statement(statement).params(
+                match=match, limit=limit, offset=offset).all()
+        query = session.query(cls)
+        for word in words:
+            pattern = '%{}%'.format(word)
+            query = query.filter(or_(cls.title.ilike(pattern),
+                                     cast(cls.recipe_data, Text).ilike(
+                                         pattern)))
+        return query.order_by(cls.id).limit(limit).offset(offset).all()
+
+    '''
+    existing_ids(ids, session)
+        the subset of ids that are drinks, read with one indexed
+        SELECT id ... WHERE id IN query
+        EXAMPLE
+            Drink.existing_ids({1, 2, 1000})
+    '''
+
+    @classmethod
+    def existing_ids(cls, ids, session=None):
+        session = session or db.session
+        return {id for id, in session.query(cls.id).filter(cls.id.in_(ids))}
+
+    @classmethod
+    def _ids_by_title(cls, session, titles):
+        rows = session.query(cls.id, cls.title).filter(
+            cls.title.in_(titles))
+        return {title: id for id, title in rows}
 
     def __repr__(self):
         return json.dumps(self.short())
+
+
+'''
+Ingredient
+the stock and unit cost of an ingredient, matched to recipes by name
+    stock and unit_cost are in recipe parts
+'''
+
+
+class Ingredient(db.Model):
+    id = Column(Integer, primary_key=True)
+    name = Column(String(80), unique=True, nullable=False)
+    stock = Column(Float, nullable=False, default=0)
+    unit_cost = Column(Float, nullable=False, default=0)
+
+    '''
+    save(name, stock, unit_cost, session)
+        creates or updates the ingredient name, None leaves a value as it
+        is, and updates a loaded inventory in place
+        returns the ingredient
+    '''
+
+    @classmethod
+    def save(cls, name, stock=None, unit_cost=None, session=None):
+        session = session or db.session
+        ingredient = session.query(cls).filter_by(name=name).one_or_none()
+        if ingredient is None:
+            ingredient = cls(name=name, stock=0, unit_cost=0)
+            session.add(ingredient)
+        if stock is not None:
+            ingredient.stock = stock
+        if unit_cost is not None:
+            ingredient.unit_cost = unit_cost
+        session.commit()
+        inventory.set_ingredient(name, stock=stock, unit_cost=unit_cost)
+        return ingredient
+
+    def format(self):
+        return {
+            'name': self.name,
+            'stock': self.stock,
+            'unit_cost': self.unit_cost
+        }
+
+
+'''
+validate_stock(body)
+    checks a PATCH /inventory/<name> body has the {"stock": number,
+    "unit_cost": number} shape, either may be missing or null
+    returns the {"stock", "unit_cost"} values for Ingredient.save, raises
+    ValueError describing the first problem
+validate_volumes(body)
+    checks a POST /inventory/rollup body has the {"volumes": {"<drink id>":
+    count}} shape, with counts of at least 0
+    returns the counts by integer drink id, raises ValueError describing
+    the first problem
+'''
+
+
+def is_amount(value):
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and value >= 0)
+
+
+def validate_stock(body):
+    if not isinstance(body, dict):
+        raise ValueError('body must be an object')
+    values = {key: body.get(key) for key in ('stock', 'unit_cost')}
+    for key, value in values.items():
+        if value is not None and not is_amount(value):
+            raise ValueError('{} must be a number >= 0'.format(key))
+    return values
+
+
+def validate_volumes(body):
+    volumes = body.get('volumes') if isinstance(body, dict) else None
+    if not isinstance(volumes, dict):
+        raise ValueError('volumes must be an object')
+    volumes = {int(id): count for id, count in volumes.items()}
+    for count in volumes.values():
+        if not is_amount(count):
+            raise ValueError('counts must be numbers >= 0')
+    return volumes
+
+
+'''
+validate_order(body, known_drinks)
+    checks a POST /orders body has the {"items": [{"drink_id": int,
+    "quantity": int}]} shape, with known drinks and positive quantities
+    returns a new order dict for OrderWriter.submit and Order.write_batch,
+    with a generated id, raises ValueError describing the first problem
+        known_drinks: callable taking a set of drink ids and returning
+            those that exist, see Drink.existing_ids
+'''
+
+
+def validate_order(body, known_drinks):
+    items = body.get('items') if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non empty list')
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('item must be an object')
+        drink_id, quantity = item.get('drink_id'), item.get('quantity', 1)
+        for value in (drink_id, quantity):
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError('drink_id and quantity must be integers')
+        if quantity < 1:
+            raise ValueError('quantity must be positive')
+    drink_ids = {item['drink_id'] for item in items}
+    unknown = drink_ids - set(known_drinks(drink_ids))
+    if unknown:
+        raise ValueError('unknown drink {}'.format(min(unknown)))
+    return {
+        'id': uuid.uuid4().hex,
+        'created_at': datetime.utcnow(),
+        'items': [{'drink_id': item['drink_id'],
+                   'quantity': item.get('quantity', 1)} for item in items]
+    }
+
+
+'''
+Order
+an order placed at the counter, written by the OrderWriter
+'''
+
+
+class Order(db.Model):
+    __tablename__ = 'orders'
+
+    id = Column(String(32), primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+    items = db.relationship('OrderItem', lazy='selectin')
+
+    '''
+    write_batch(orders, bind)
+        writes order dicts (see validate_order) in one transaction, with
+        one executemany per table
+        bind defaults to the app's engine
+    '''
+
+    @classmethod
+    def write_batch(cls, orders, bind=None):
+        bind = bind or db.engine
+        items = [dict(item, order_id=order['id'])
+                 for order in orders for item in order['items']]
+        with bind.begin() as conn:
+            conn.execute(cls.__table__.insert(), [
+                {'id': order['id'], 'created_at': order['created_at']}
+                for order in orders])
+            conn.execute(OrderItem.__table__.insert(), items)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat(),
+            'items': [{'drink_id': item.drink_id, 'quantity': item.quantity}
+                      for item in self.items]
+        }
+
+
+class OrderItem(db.Model):
+    __tablename__ = 'order_item'
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String(32), ForeignKey('orders.id'), nullable=False,
+                      index=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='SET NULL'))
+    quantity = Column(Integer, nullable=False)
+
+
+'''
+current_inventory(session)
+    the process inventory, loaded from the database when it is stale,
+    with the drinks written since reloaded
+'''
+
+
+def current_inventory(session=None):
+    session = session or db.session
+    columns = session.query(Drink.id, Drink.title, Drink.recipe_data)
+    if inventory.stale:
+        # the full load covers the drinks written so far
+        inventory.take_dirty()
+        inventory.load(
+            decoded_recipes(columns),
+            session.query(Ingredient.name, Ingredient.stock,
+                          Ingredient.unit_cost))
+        return inventory
+    dirty = inventory.take_dirty()
+    if dirty:
+        try:
+            drinks = decoded_recipes(columns.filter(Drink.id.in_(dirty)))
+        except Exception:
+            inventory.mark_dirty(dirty)
+            raise
+        inventory.apply(drinks, dirty)
+    return inventory
+
+
+def decoded_recipes(rows):
+    return [(id, title, decoded_recipe(raw)) for id, title, raw in rows]
+
+
+def decoded_recipe(raw):
+    # None for a blob that is not json, Inventory skips the row
+    try:
+        return json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError:
+        return None
@@ -0,0 +1,136 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+
+'''
+OrderQueueFull Exception
+raised by OrderWriter.submit when the queue is full, the client should
+retry later
+'''
+
+
+class OrderQueueFull(Exception):
+    pass
+
+
+'''
+OrderWriter
+writes submitted orders from a background thread, many per transaction
+
+    write_batch: callable writing a list of orders in one transaction,
+        see Order.write_batch
+    batch_size: most orders written by one transaction
+    max_latency: seconds the writer waits for a batch to fill up once it
+        holds an order, bounds how long an acknowledged order stays in
+        memory
+    queue_size: orders held before submit raises OrderQueueFull
+    logger: where failed writes are reported
+
+    a failed batch is retried one order at a time, so a single bad order
+    does not lose the others with it. orders still queued when the process
+    exits are written by an atexit flush; a killed process loses them.
+'''
+
+
+class OrderWriter:
+
+    def __init__(self, write_batch, batch_size=100, max_latency=0.01,
+                 queue_size=10000, logger=None):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.logger = logger or logging.getLogger(__name__)
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    '''
+    from_env(write_batch, logger)
+        an OrderWriter configured from the environment, the one both apps
+        use
+            ORDER_BATCH_SIZE: batch_size (default 100)
+            ORDER_BATCH_LATENCY_MS: max_latency in milliseconds
+                (default 10)
+            ORDER_QUEUE_SIZE: queue_size (default 10000)
+    '''
+
+    @classmethod
+    def from_env(cls, write_batch, logger=None):
+        return cls(
+            write_batch,
+            batch_size=int(os.environ.get('ORDER_BATCH_SIZE', 100)),
+            max_latency=float(
+                os.environ.get('ORDER_BATCH_LATENCY_MS', 10)) / 1000,
+            queue_size=int(os.environ.get('ORDER_QUEUE_SIZE', 10000)),
+            logger=logger)
+
+    '''
+    submit(order)
+        queues order without blocking, starts the writer thread if needed
+        raises OrderQueueFull when the queue is full
+    flush()
+        blocks until every order submitted so far is written
+    '''
+
+    def submit(self, order):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(order)
+        except queue.Full:
+            raise OrderQueueFull('{} orders are waiting to be written'.format(
+                self._queue.qsize()))
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='order-writer')
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            self.write_batch(batch)
+            self.written += len(batch)
+            self.batches += 1
+            return
+        except Exception:
+            if len(batch) == 1:
+                self.failed += 1
+                self.logger.exception('order %s was not written',
+                                      batch[0]['id'])
+                return
+        for order in batch:
+            self._write([order])
@@ -0,0 +1,91 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+'''
+engine profiles for the coffee shop database
+
+a profile is a set of sqlite pragmas applied to every new connection,
+selected with the DATABASE_PROFILE environment variable:
+    default: sqlite's own settings (rollback journal, synchronous=FULL)
+    wal: write-ahead log, readers no longer wait on writers
+        synchronous=NORMAL only syncs at checkpoints, a power loss can
+        lose the last transactions but never corrupts the database
+    durable: write-ahead log with synchronous=FULL
+
+pragmas are ignored on other dialects, the pool settings apply to all:
+    DATABASE_POOL_SIZE: connections kept open per worker process (default 5)
+    DATABASE_MAX_OVERFLOW: extra connections opened under load (default 10)
+'''
+
+PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY'
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000
+    }
+}
+
+DEFAULT_PROFILE = 'wal'
+
+
+def get_profile(name=None):
+    name = name or os.environ.get('DATABASE_PROFILE', DEFAULT_PROFILE)
+    if name not in PROFILES:
+        raise ValueError('unknown DATABASE_PROFILE {!r}, expected one of '
+                         '{}'.format(name, ', '.join(sorted(PROFILES))))
+    return PROFILES[name]
+
+
+'''
+engine_options(url)
+    the create_engine keyword arguments for url
+    file based sqlite gets a QueuePool (sqlalchemy would open a new
+    connection, and rerun the pragmas, for every checkout otherwise)
+'''
+
+
+def engine_options(url, pool_size=None, max_overflow=None):
+    url = make_url(url)
+    if pool_size is None:
+        pool_size = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    if max_overflow is None:
+        max_overflow = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    options = {'pool_size': pool_size, 'max_overflow': max_overflow}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {'check_same_thread': False}
+    return options
+
+
+'''
+apply_profile(engine, profile)
+    runs the profile's pragmas on every new sqlite connection of engine
+    must be called before the engine opens its first connection
+'''
+
+
+def apply_profile(engine, profile):
+    if engine.dialect.name != 'sqlite' or not profile:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in profile.items():
+            cursor.execute('PRAGMA {}={}'.format(pragma, value))
+        cursor.close()
@@ -0,0 +1,346 @@
+import json
+from contextlib import contextmanager
+
+from werkzeug.exceptions import HTTPException, abort
+from werkzeug.http import quote_etag
+
+from .auth.auth import AuthError
+from .database.models import (Drink, VersionConflict, validate_order,
+                              validate_stock, validate_volumes, bulk_summary)
+from .database.order_writer import OrderQueueFull
+from .responses import dumps
+
+'''
+the route logic of the coffee shop api, shared by api.py (Flask) and
+asgi.py (Quart)
+
+the apps read the request and reach the database, each its own way, and
+hand everything else to the functions below. they take plain values
+(request.args, parsed bodies, header sets, rows) instead of the
+framework's request, return (body, status, headers) tuples that both
+frameworks turn into responses (a dict body goes through the app's json
+provider), and fail with werkzeug's abort(), which both handle.
+'''
+
+DRINKS_PAGE_DEFAULT = 50
+DRINKS_PAGE_MAX = 500
+DRINKS_STREAM_BATCH = 500
+DRINKS_SEARCH_DEFAULT = 20
+DRINKS_BULK_MAX = 10000
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+'''
+int_arg(args, name, default, minimum, maximum)
+    the query string argument name as an int, default when it is absent
+    or empty, 400 when it is not an int from minimum to maximum
+page_args(args)
+    the (limit, cursor) of a page of drinks
+        ?limit=<n> page size, at most DRINKS_PAGE_MAX
+        ?cursor=<id> only drinks after this id (the previous next_cursor)
+search_args(args)
+    the (q, limit, offset) of GET /drinks/search
+if_match_version(if_match)
+    the version named by the If-Match header, None when the header is
+    absent or "*"
+    a header naming anything else than one version can never match, 412
+'''
+
+
+def int_arg(args, name, default=None, minimum=0, maximum=None):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400)
+    if value < minimum or (maximum is not None and value > maximum):
+        abort(400)
+    return value
+
+
+def page_args(args):
+    return (int_arg(args, 'limit', DRINKS_PAGE_DEFAULT, 1, DRINKS_PAGE_MAX),
+            int_arg(args, 'cursor'))
+
+
+def search_args(args):
+    return (args.get('q'),
+            int_arg(args, 'limit', DRINKS_SEARCH_DEFAULT, 1, DRINKS_PAGE_MAX),
+            int_arg(args, 'offset', 0))
+
+
+def if_match_version(if_match):
+    if not if_match or if_match.star_tag:
+        return None
+    versions = [tag for tag in if_match.as_set() if tag.isdigit()]
+    if len(versions) != 1:
+        abort(412)
+    return int(versions[0])
+
+
+'''
+menu_body(drinks, form)
+    the menu of drinks in form ('short' or 'long') as json bytes, what
+    menu_cache keeps. both apps build it here so that they serve the same
+    bytes under the same ETag
+menu_response(menu, if_none_match)
+    a CachedMenu with its ETag, an empty 304 when if_none_match (the
+    request's If-None-Match) names it, weakly since compression weakens it
+drink_line(drink, form)
+    one line of the ndjson stream of drinks
+page_response(drinks, form, limit)
+    a page of drinks read with limit + 1 rows, with the id to continue
+    from as next_cursor, null on the last page
+search_response(drinks, limit, offset)
+    the same for a page of search results and its next_offset
+drink_response(drink)
+    the {"success": True, "drinks": drink.long()} body of a write, with the
+    drink's version as its ETag
+delete_response(id)
+    the {"success": True, "delete": id} body of a DELETE
+'''
+
+
+def menu_body(drinks, form):
+    return dumps({"success": True,
+                  "drinks": [getattr(drink, form)() for drink in drinks]})
+
+
+def menu_response(menu, if_none_match):
+    etag = {'ETag': quote_etag(menu.etag)}
+    if if_none_match.contains_weak(menu.etag):
+        return b'', 304, etag
+    return menu.body, 200, dict(JSON_HEADERS, **etag)
+
+
+def drink_line(drink, form):
+    return dumps(getattr(drink, form)()) + b'\n'
+
+
+def page_response(drinks, form, limit):
+    next_cursor = None
+    if len(drinks) > limit:
+        drinks = drinks[:limit]
+        next_cursor = drinks[-1].id
+    return {
+        "success": True,
+        "drinks": [getattr(drink, form)() for drink in drinks],
+        "next_cursor": next_cursor
+    }, 200
+
+
+def search_response(drinks, limit, offset):
+    next_offset = None
+    if len(drinks) > limit:
+        drinks = drinks[:limit]
+        next_offset = offset + limit
+    return {
+        "success": True,
+        "drinks": [drink.short() for drink in drinks],
+        "next_offset": next_offset
+    }, 200
+
+
+def drink_response(drink):
+    return ({"success": True, "drinks": drink.long()}, 200,
+            {'ETag': quote_etag(str(drink.version))})
+
+
+def delete_response(id):
+    return {"success": True, "delete": id}, 200
+
+
+'''
+write_errors()
+    wraps a drink write: a VersionConflict is a 412, a recipe of the wrong
+    shape (ValueError) a 422 and any other failure a 400
+new_drink(body)
+    an unsaved Drink from a POST /drinks body
+drink_changes(body)
+    the (title, recipe) of a PATCH /drinks/<id> body, either may be null
+bulk_items(mimetype, text)
+    the items of a POST /drinks/bulk body, a json array, or one json
+    object per line with content type application/x-ndjson
+    400 when it does not parse, 413 past DRINKS_BULK_MAX items
+bulk_response(results, rows, written)
+    the summary of a bulk write, see bulk_summary
+'''
+
+
+@contextmanager
+def write_errors():
+    try:
+        yield
+    except HTTPException:
+        raise
+    except VersionConflict:
+        abort(412)
+    except ValueError:
+        abort(422)
+    except Exception:
+        abort(400)
+
+
+def new_drink(body):
+    drink = Drink()
+    with write_errors():
+        if body['title']:
+            drink.title = body['title']
+        if body['recipe']:
+            drink.recipe = body['recipe']
+    return drink
+
+
+def drink_changes(body):
+    try:
+        return body['title'], body['recipe']
+    except Exception:
+        abort(400)
+
+
+def bulk_items(mimetype, text):
+    is_json = mimetype == 'application/json' or (
+        mimetype.startswith('application/') and mimetype.endswith('+json'))
+    try:
+        if mimetype == 'application/x-ndjson':
+            items = [json.loads(line) for line in text.splitlines()
+                     if line.strip()]
+        elif is_json:
+            items = json.loads(text)
+        else:
+            items = None
+    except ValueError:
+        abort(400)
+    if not isinstance(items, list):
+        abort(400)
+    if len(items) > DRINKS_BULK_MAX:
+        abort(413)
+    return items
+
+
+def bulk_response(results, rows, written):
+    return bulk_summary(results, rows, written), 200
+
+
+'''
+stock_values(body), rollup_volumes(body)
+    the validated body of PATCH /inventory/<name> and of
+    POST /inventory/rollup, 400 when it is invalid
+makeable_response(inventory), inventory_response(inventory),
+ingredient_response(ingredient)
+    the inventory read endpoints
+rollup_response(inventory, volumes)
+    the consumption and cost of volumes, 422 for unknown drink ids
+'''
+
+
+def stock_values(body):
+    try:
+        return validate_stock(body)
+    except ValueError:
+        abort(400)
+
+
+def rollup_volumes(body):
+    try:
+        return validate_volumes(body)
+    except ValueError:
+        abort(400)
+
+
+def makeable_response(inventory):
+    def build():
+        return dumps({"success": True, "drinks": [
+            {"id": id, "title": title, "servings": servings}
+            for id, title, servings in inventory.makeable()]})
+
+    return inventory.memo('makeable', build), 200, JSON_HEADERS
+
+
+def inventory_response(inventory):
+    return {"success": True, "ingredients": [
+        {"name": name, "stock": stock, "unit_cost": unit_cost}
+        for name, stock, unit_cost in inventory.ingredients()
+    ]}, 200
+
+
+def ingredient_response(ingredient):
+    return {"success": True, "ingredient": ingredient.format()}, 200
+
+
+def rollup_response(inventory, volumes):
+    try:
+        ingredients, total_cost = inventory.rollup(volumes)
+    except KeyError:
+        abort(422)
+    return {
+        "success": True,
+        "ingredients": [
+            {"name": name, "consumption": consumption, "cost": cost,
+             "shortfall": shortfall}
+            for name, consumption, cost, shortfall in ingredients],
+        "total_cost": total_cost
+    }, 200
+
+
+'''
+place_order(body, known_drinks, order_writer)
+    validates a POST /orders body (see validate_order) and queues the
+    order on order_writer, 400 for an invalid body or unknown drink, 429
+    when the queue is full
+'''
+
+
+def place_order(body, known_drinks, order_writer):
+    try:
+        order = validate_order(body, known_drinks)
+        order_writer.submit(order)
+    except ValueError:
+        abort(400)
+    except OrderQueueFull:
+        abort(429)
+    return {"success": True, "order": order['id']}, 202
+
+
+'''
+register_error_handlers(app)
+    answers the aborted requests and AuthErrors of a Flask or Quart app
+    with {"success": False, "error": status, "message": message}
+'''
+
+ERROR_MESSAGES = {
+    400: "bad request",
+    404: "resource not found",
+    412: "precondition failed",
+    413: "payload too large",
+    422: "unprocessable",
+    429: "too many requests"
+}
+
+ERROR_HEADERS = {
+    429: {'Retry-After': '1'}
+}
+
+
+def error_response(error):
+    return {
+        "success": False,
+        "error": error.code,
+        "message": ERROR_MESSAGES[error.code]
+    }, error.code, ERROR_HEADERS.get(error.code, {})
+
+
+def auth_error_response(error):
+    return {
+        "success": False,
+        "error": error.status_code,
+        "message": error.error['description']
+    }, error.status_code
+
+
+def register_error_handlers(app):
+    for status in ERROR_MESSAGES:
+        app.register_error_handler(status, error_response)
+    app.register_error_handler(AuthError, auth_error_response)
@@ -0,0 +1,859 @@
+import filecmp
+import gzip
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from flask import Flask, request
+from sqlalchemy import create_engine, event, text
+
+from src.database.migrations import (upgrade, check_schema,  # noqa: E402
+                                     SchemaOutOfDate, create_drink_table)
+
+database_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(
+    os.path.join(database_dir, 'test.db'))
+upgrade(create_engine(os.environ['DATABASE_URL']))
+
+from src import api  # noqa: E402
+from src.api import app  # noqa: E402
+from src.auth import auth  # noqa: E402
+from src.auth.jwks import JWKSKeyStore  # noqa: E402
+from src.auth.token_cache import TokenCache  # noqa: E402
+from src.database.models import (db, Drink, Order, setup_db,  # noqa: E402
+                                 db_drop_and_create_all, VersionConflict)
+from src.database import cache  # noqa: E402
+from src.database.menu_cache import MenuCache, menu_cache  # noqa: E402
+from src.database.inventory import Inventory  # noqa: E402
+from src.database.order_writer import (OrderWriter,  # noqa: E402
+                                       OrderQueueFull)
+from src.database.profiles import (get_profile, engine_options,  # noqa: E402
+                                   apply_profile)
+from src.request_log import init_request_log  # noqa: E402
+from src import request_log, responses  # noqa: E402
+from src.responses import init_responses, dumps  # noqa: E402
+from test_auth import make_key, make_token  # noqa: E402
+
+# shared/ at the root of the repository, see shared/sync.py
+SHARED = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', '..', '..', 'shared')
+MANAGER = ['get:drinks-detail', 'post:drinks', 'patch:drinks',
+           'delete:drinks']
+
+
+def ingredient(name, parts):
+    return {'color': 'brown', 'name': name, 'parts': parts}
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop api test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, jwk = make_key('key-a')
+        cls.jwks = {'keys': [jwk]}
+
+    def setUp(self):
+        self.client = app.test_client
+        self.original_store = auth.jwks_store
+        self.original_cache = auth.token_cache
+        auth.jwks_store = JWKSKeyStore('stand-in', fetch=lambda: self.jwks)
+        auth.token_cache = TokenCache()
+        with app.app_context():
+            db_drop_and_create_all()
+
+    def tearDown(self):
+        auth.jwks_store = self.original_store
+        auth.token_cache = self.original_cache
+
+    def headers(self, permissions=MANAGER):
+        token = make_token(self.pem, 'key-a', permissions)
+        return {'Authorization': 'Bearer ' + token}
+
+    def add_drink(self, title, recipe=None):
+        recipe = recipe or [{'color': 'brown', 'name': 'coffee', 'parts': 1}]
+        with app.app_context():
+            drink = Drink(title=title, recipe=json.dumps(recipe))
+            drink.insert()
+            return drink.id
+
+    def test_get_drinks_short_form(self):
+        self.add_drink('espresso')
+        res = self.client().get('/drinks')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['drinks'][0]['recipe'],
+                         [{'color': 'brown', 'parts': 1}])
+
+    def test_get_drinks_if_none_match_is_304(self):
+        self.add_drink('espresso')
+        res = self.client().get('/drinks')
+        etag = res.headers['ETag']
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_menu_is_served_from_cache(self):
+        self.add_drink('espresso')
+        self.client().get('/drinks')
+        with app.app_context():
+            # bypasses Drink.insert, so the cache is not invalidated
+            db.session.add(Drink(title='latte', recipe=ingredient('milk', 1)))
+            db.session.commit()
+        data = json.loads(self.client().get('/drinks').data)
+        self.assertEqual(len(data['drinks']), 1)
+
+    def test_insert_invalidates_menu(self):
+        self.add_drink('espresso')
+        etag = self.client().get('/drinks').headers['ETag']
+        self.add_drink('latte')
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)['drinks']), 2)
+
+    def test_patch_invalidates_detail_menu(self):
+        id = self.add_drink('espresso')
+        self.client().get('/drinks-detail', headers=self.headers())
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  json={'title': 'ristretto', 'recipe': None},
+                                  headers=self.headers())
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/drinks-detail', headers=self.headers())
+        data = json.loads(res.data)
+        self.assertEqual(data['drinks'][0]['title'], 'ristretto')
+
+    def test_delete_invalidates_menu(self):
+        id = self.add_drink('espresso')
+        self.client().get('/drinks')
+        res = self.client().delete('/drinks/{}'.format(id),
+                                   headers=self.headers())
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(self.client().get('/drinks').data)
+        self.assertEqual(data['drinks'], [])
+
+    def test_search_ranks_title_matches_first(self):
+        self.add_drink('flat white', [{'color': 'white', 'name': 'milk',
+                                       'parts': 1}])
+        self.add_drink('milkshake', [{'color': 'pink', 'name': 'ice cream',
+                                      'parts': 1}])
+        self.add_drink('espresso')
+        res = self.client().get('/drinks/search?q=MILK')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([d['title'] for d in data['drinks']],
+                         ['milkshake', 'flat white'])
+
+    def test_search_follows_writes_and_pages(self):
+        ids = [self.add_drink('latte {}'.format(i)) for i in range(3)]
+        self.client().delete('/drinks/{}'.format(ids[0]),
+                             headers=self.headers())
+        self.client().patch('/drinks/{}'.format(ids[1]),
+                            json={'title': 'mocha', 'recipe': None},
+                            headers=self.headers())
+        data = json.loads(self.client().get('/drinks/search?q=lat').data)
+        self.assertEqual([d['id'] for d in data['drinks']], [ids[2]])
+        for i in range(3, 6):
+            self.add_drink('latte {}'.format(i))
+        data = json.loads(self.client().get(
+            '/drinks/search?q=latte&limit=3').data)
+        self.assertEqual(data['next_offset'], 3)
+        data = json.loads(self.client().get(
+            '/drinks/search?q=latte&limit=3&offset=3').data)
+        self.assertEqual(len(data['drinks']), 1)
+        self.assertIsNone(data['next_offset'])
+
+    def test_search_without_words_is_400(self):
+        res = self.client().get('/drinks/search?q="*')
+        self.assertEqual(res.status_code, 400)
+
+    def inventory_headers(self):
+        return self.headers(MANAGER + ['get:inventory', 'patch:inventory'])
+
+    def makeable_drinks(self):
+        res = self.client().get('/drinks/makeable', headers=self.headers())
+        return [(d['title'], d['servings']) for d in res.get_json()['drinks']]
+
+    def test_malformed_recipe_is_422(self):
+        id = self.add_drink('espresso')
+        res = self.client().post('/drinks', headers=self.headers(),
+                                 json={'title': 'broken', 'recipe': [1, 2]})
+        self.assertEqual(res.status_code, 422)
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  headers=self.headers(),
+                                  json={'title': None,
+                                        'recipe': [{'name': 'coffee'}]})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(self.makeable_drinks(), [])
+        self.assertEqual(self.client().get('/drinks').status_code, 200)
+
+    def test_makeable_follows_stock_and_writes(self):
+        id = self.add_drink('espresso', [ingredient('coffee', 2)])
+        self.assertEqual(self.makeable_drinks(), [])
+        res = self.client().patch('/inventory/coffee', json={'stock': 5},
+                                  headers=self.inventory_headers())
+        self.assertEqual(res.get_json()['ingredient']['stock'], 5)
+        self.assertEqual(self.makeable_drinks(), [('espresso', 2)])
+        self.client().patch('/drinks/{}'.format(id),
+                            json={'title': None,
+                                  'recipe': [ingredient('coffee', 1)]},
+                            headers=self.headers())
+        self.assertEqual(self.makeable_drinks(), [('espresso', 5)])
+        self.client().delete('/drinks/{}'.format(id), headers=self.headers())
+        self.assertEqual(self.makeable_drinks(), [])
+
+    def test_rollup_endpoint(self):
+        id = self.add_drink('espresso', [ingredient('coffee', 2)])
+        self.client().patch('/inventory/coffee',
+                            json={'stock': 3, 'unit_cost': 0.25},
+                            headers=self.inventory_headers())
+        res = self.client().post('/inventory/rollup',
+                                 json={'volumes': {str(id): 2}},
+                                 headers=self.inventory_headers())
+        data = res.get_json()
+        self.assertEqual(data['ingredients'], [{
+            'name': 'coffee', 'consumption': 4.0, 'cost': 1.0,
+            'shortfall': 1.0}])
+        res = self.client().post('/inventory/rollup',
+                                 json={'volumes': {'1000': 1}},
+                                 headers=self.inventory_headers())
+        self.assertEqual(res.status_code, 422)
+
+    def test_inventory_requires_permission(self):
+        res = self.client().get('/inventory', headers=self.headers())
+        self.assertEqual(res.status_code, 403)
+
+    def test_post_order_is_written_in_the_background(self):
+        id = self.add_drink('espresso')
+        res = self.client().post('/orders', headers=self.headers(
+            ['post:orders']), json={'items': [{'drink_id': id,
+                                               'quantity': 2}]})
+        self.assertEqual(res.status_code, 202)
+        order_id = res.get_json()['order']
+        api.order_writer.flush()
+        with app.app_context():
+            order = Order.query.filter_by(id=order_id).one()
+            self.assertEqual(order.format()['items'],
+                             [{'drink_id': id, 'quantity': 2}])
+
+    def test_post_order_for_unknown_drink_is_400(self):
+        res = self.client().post('/orders', headers=self.headers(
+            ['post:orders']), json={'items': [{'drink_id': 1000}]})
+        self.assertEqual(res.status_code, 400)
+
+    def test_post_order_does_not_load_the_inventory(self):
+        id = self.add_drink('espresso')
+        with mock.patch.object(Inventory, 'load') as load:
+            res = self.client().post('/orders', headers=self.headers(
+                ['post:orders']), json={'items': [{'drink_id': id}]})
+        self.assertEqual(res.status_code, 202)
+        load.assert_not_called()
+
+    def test_post_order_when_queue_is_full_is_429(self):
+        id = self.add_drink('espresso')
+        writer = OrderWriter(lambda batch: None, queue_size=0)
+        writer.submit = mock.Mock(side_effect=OrderQueueFull)
+        with mock.patch.object(api, 'order_writer', writer):
+            res = self.client().post('/orders', headers=self.headers(
+                ['post:orders']), json={'items': [{'drink_id': id}]})
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_patch_with_current_etag(self):
+        id = self.add_drink('espresso')
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  json={'title': 'ristretto', 'recipe': None},
+                                  headers=dict(self.headers(),
+                                               **{'If-Match': '"1"'}))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['ETag'], '"2"')
+        self.assertEqual(json.loads(res.data)['drinks']['version'], 2)
+
+    def test_patch_with_stale_etag_is_412(self):
+        id = self.add_drink('espresso')
+        self.client().patch('/drinks/{}'.format(id),
+                            json={'title': 'ristretto', 'recipe': None},
+                            headers=self.headers())
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  json={'title': 'doppio', 'recipe': None},
+                                  headers=dict(self.headers(),
+                                               **{'If-Match': '"1"'}))
+        self.assertEqual(res.status_code, 412)
+        data = json.loads(self.client().get('/drinks').data)
+        self.assertEqual(data['drinks'][0]['title'], 'ristretto')
+
+    def test_compressed_patch_etag_round_trips(self):
+        recipe = [ingredient('ingredient{}'.format(i), 1) for i in range(40)]
+        id = self.add_drink('espresso', recipe)
+        headers = dict(self.headers(), **{'Accept-Encoding': 'gzip'})
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  json={'title': 'ristretto', 'recipe': None},
+                                  headers=headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['ETag'], '"2"')
+        res = self.client().patch('/drinks/{}'.format(id),
+                                  json={'title': 'doppio', 'recipe': None},
+                                  headers=dict(headers, **{
+                                      'If-Match': res.headers['ETag']}))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(gzip.decompress(res.data))
+                         ['drinks']['title'], 'doppio')
+
+    def test_delete_with_stale_etag_is_412(self):
+        id = self.add_drink('espresso')
+        res = self.client().delete('/drinks/{}'.format(id),
+                                   headers=dict(self.headers(),
+                                                **{'If-Match': '"7"'}))
+        self.assertEqual(res.status_code, 412)
+        res = self.client().delete('/drinks/{}'.format(id),
+                                   headers=dict(self.headers(),
+                                                **{'If-Match': '"1"'}))
+        self.assertEqual(res.status_code, 200)
+
+    def test_patch_missing_drink_is_404(self):
+        res = self.client().patch('/drinks/1000',
+                                  json={'title': 'ristretto', 'recipe': None},
+                                  headers=dict(self.headers(),
+                                               **{'If-Match': '"1"'}))
+        self.assertEqual(res.status_code, 404)
+
+    def test_patch_of_drink_deleted_meanwhile_is_404(self):
+        id = self.add_drink('espresso')
+        update_by_id = Drink.update_by_id
+
+        def update_then_delete(*args, **kwargs):
+            updated = update_by_id(*args, **kwargs)
+            Drink.delete_by_id(id)
+            return updated
+
+        with mock.patch.object(Drink, 'update_by_id', update_then_delete):
+            res = self.client().patch('/drinks/{}'.format(id),
+                                      json={'title': 'ristretto',
+                                            'recipe': None},
+                                      headers=self.headers())
+        self.assertEqual(res.status_code, 404)
+
+    def test_drinks_pagination_with_cursor(self):
+        for i in range(5):
+            self.add_drink('drink{}'.format(i))
+        res = self.client().get('/drinks?limit=2')
+        data = json.loads(res.data)
+        self.assertEqual([d['title'] for d in data['drinks']],
+                         ['drink0', 'drink1'])
+        titles = []
+        cursor = data['next_cursor']
+        while cursor is not None:
+            res = self.client().get('/drinks?limit=2&cursor={}'.format(cursor))
+            data = json.loads(res.data)
+            titles += [d['title'] for d in data['drinks']]
+            cursor = data['next_cursor']
+        self.assertEqual(titles, ['drink2', 'drink3', 'drink4'])
+
+    def test_drinks_pagination_rejects_bad_limit(self):
+        for limit in ('0', 'ten', '100000'):
+            res = self.client().get('/drinks?limit=' + limit)
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(json.loads(res.data)['success'])
+
+    def test_drinks_detail_ndjson_stream(self):
+        for i in range(3):
+            self.add_drink('drink{}'.format(i))
+        res = self.client().get('/drinks-detail?format=ndjson',
+                                headers=self.headers())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        drinks = [json.loads(line) for line in res.data.splitlines()]
+        self.assertEqual([d['title'] for d in drinks],
+                         ['drink0', 'drink1', 'drink2'])
+        self.assertIn('name', drinks[0]['recipe'][0])
+
+    def test_bulk_upsert(self):
+        self.add_drink('espresso')
+        recipe = [{'color': 'white', 'name': 'milk', 'parts': 1}]
+        res = self.client().post('/drinks/bulk', headers=self.headers(), json=[
+            {'title': 'espresso', 'recipe': recipe},
+            {'title': 'latte', 'recipe': recipe},
+            {'title': 'latte', 'recipe': recipe},
+            {'title': 'mystery', 'recipe': [{'color': 'red'}]}])
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['created'], data['updated'], data['failed']),
+                         (1, 1, 2))
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['updated', 'created', 'invalid', 'invalid'])
+        drinks = json.loads(self.client().get(
+            '/drinks-detail', headers=self.headers()).data)['drinks']
+        self.assertEqual({d['title']: d['recipe'] for d in drinks},
+                         {'espresso': recipe, 'latte': recipe})
+
+    def test_bulk_ndjson(self):
+        lines = '\n'.join(json.dumps({
+            'title': 'drink{}'.format(i),
+            'recipe': {'color': 'brown', 'name': 'coffee', 'parts': i}
+        }) for i in range(3))
+        res = self.client().post(
+            '/drinks/bulk', data=lines, headers=self.headers(),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(data['created'], 3)
+        ids = [r['id'] for r in data['results']]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_bulk_requires_post_permission(self):
+        res = self.client().post('/drinks/bulk', json=[],
+                                 headers=self.headers(['patch:drinks']))
+        self.assertEqual(res.status_code, 403)
+
+    def test_bulk_rejects_non_array(self):
+        res = self.client().post('/drinks/bulk', json={'title': 'x'},
+                                 headers=self.headers())
+        self.assertEqual(res.status_code, 400)
+
+    def test_drinks_detail_requires_permission(self):
+        res = self.client().get('/drinks-detail',
+                                headers=self.headers(['post:drinks']))
+        self.assertEqual(res.status_code, 403)
+
+
+class DrinkModelTestCase(unittest.TestCase):
+    """recipe storage on the Drink model"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db_drop_and_create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_recipe_is_decoded_once(self):
+        drink = Drink(title='espresso', recipe=[
+            {'color': 'brown', 'name': 'coffee', 'parts': 1}])
+        drink.insert()
+        db.session.expire(drink)
+        first = drink.recipe
+        self.assertIs(drink.recipe, first)
+        self.assertEqual(first[0]['name'], 'coffee')
+
+    def test_recipe_memo_follows_assignment(self):
+        drink = Drink(title='espresso', recipe=[
+            {'color': 'brown', 'name': 'coffee', 'parts': 1}])
+        drink.recipe
+        drink.recipe = {'color': 'white', 'name': 'milk', 'parts': 2}
+        self.assertEqual(drink.recipe,
+                         [{'color': 'white', 'name': 'milk', 'parts': 2}])
+
+    def test_long_recipe_is_stored(self):
+        recipe = [{'color': 'color{}'.format(i), 'name': 'ingredient'
+                   '{}'.format(i), 'parts': i} for i in range(50)]
+        Drink(title='kitchen sink', recipe=recipe).insert()
+        db.session.remove()
+        self.assertEqual(Drink.query.one().recipe, recipe)
+
+    def test_setup_db_keeps_records(self):
+        Drink(title='espresso', recipe=[
+            {'color': 'brown', 'name': 'coffee', 'parts': 1}]).insert()
+        setup_db(Flask(__name__))
+        db.session.remove()
+        self.assertEqual(Drink.query.count(), 1)
+
+    def test_update_by_id_is_a_single_statement(self):
+        drink = Drink(title='espresso', recipe=[
+            {'color': 'brown', 'name': 'coffee', 'parts': 1}])
+        drink.insert()
+        id = drink.id
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.assertTrue(Drink.update_by_id(id, title='ristretto',
+                                               version=1))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('UPDATE'))
+        with self.assertRaises(VersionConflict):
+            Drink.update_by_id(id, title='doppio', version=1)
+        self.assertEqual(Drink.query.one().version, 2)
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """versioned schema migrations"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'migrations.db')
+        self.engine = create_engine('sqlite:///' + self.path)
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def legacy_database(self, *recipes):
+        # a database created by the old setup_db, without schema_version
+        with self.engine.begin() as conn:
+            create_drink_table(conn)
+            for i, recipe in enumerate(recipes):
+                conn.execute(text('INSERT INTO drink (title, recipe) '
+                                  'VALUES (:t, :r)'),
+                             {'t': 'drink{}'.format(i), 'r': recipe})
+
+    def test_upgrade_is_idempotent(self):
+        self.assertEqual(upgrade(self.engine), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(upgrade(self.engine), [])
+        self.assertEqual(check_schema(self.engine), 6)
+
+    def test_check_schema_rejects_uninitialized_database(self):
+        with self.assertRaises(SchemaOutOfDate):
+            check_schema(self.engine)
+
+    def test_init_db_command_migrates_empty_database(self):
+        with mock.patch.object(type(db), 'engine',
+                               new_callable=mock.PropertyMock,
+                               return_value=self.engine):
+            result = app.test_cli_runner().invoke(args=['init-db'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('applied migrations: [1, 2, 3, 4, 5, 6]', result.output)
+        self.assertEqual(check_schema(self.engine), 6)
+
+    def test_flask_init_db_imports_app_before_migrating(self):
+        env = dict(os.environ, FLASK_APP='src.api',
+                   DATABASE_URL='sqlite:///' + self.path)
+        result = subprocess.run(
+            [sys.executable, '-m', 'flask', 'init-db'], env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(check_schema(self.engine), 6)
+
+    def test_legacy_recipe_blobs_are_normalized(self):
+        self.legacy_database(
+            '{"color": "blue", "name": "water", "parts": 1}',
+            '[{"color": "brown", "name": "coffee", "parts": 1}]')
+        upgrade(self.engine)
+        with self.engine.connect() as conn:
+            recipes = [json.loads(r) for r, in conn.execute(
+                text('SELECT recipe FROM drink ORDER BY id'))]
+        self.assertEqual(recipes[0],
+                         [{'color': 'blue', 'name': 'water', 'parts': 1}])
+        self.assertEqual(len(recipes[1]), 1)
+
+    def test_invalid_blob_aborts_upgrade(self):
+        self.legacy_database('[{"color": "blue"')
+        with self.assertRaises(ValueError):
+            upgrade(self.engine)
+        with self.assertRaises(SchemaOutOfDate):
+            check_schema(self.engine)
+
+
+class ProfilesTestCase(unittest.TestCase):
+    """sqlite engine profiles"""
+
+    def make_engine(self, profile):
+        url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'profile.db')
+        engine = create_engine(url, **engine_options(url, pool_size=2))
+        apply_profile(engine, get_profile(profile))
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def pragma(self, engine, name):
+        with engine.connect() as conn:
+            return conn.execute(text('PRAGMA ' + name)).scalar()
+
+    def test_wal_profile(self):
+        engine = self.make_engine('wal')
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(engine, 'synchronous'), 1)
+        self.assertEqual(self.pragma(engine, 'busy_timeout'), 5000)
+        self.assertEqual(engine.pool.size(), 2)
+
+    def test_default_profile_keeps_sqlite_settings(self):
+        engine = self.make_engine('default')
+        self.assertEqual(self.pragma(engine, 'journal_mode'), 'delete')
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            get_profile('turbo')
+
+    def test_memory_database_has_no_pool_options(self):
+        self.assertEqual(engine_options('sqlite://'), {})
+
+    def test_app_uses_wal_profile(self):
+        with app.app_context():
+            self.assertEqual(
+                db.session.execute(text('PRAGMA journal_mode')).scalar(),
+                'wal')
+
+
+class MenuCacheTestCase(unittest.TestCase):
+    """the serialized menu, over the shared ReadThroughCache"""
+
+    def test_menu_is_built_once_with_its_etag(self):
+        menus = MenuCache()
+        builds = []
+
+        def build():
+            builds.append(1)
+            return b'[]'
+        menu = menus.get('short', build)
+        self.assertEqual(menus.get('short', build), menu)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(menu.etag, hashlib.sha1(b'[]').hexdigest())
+
+    def test_menu_built_across_a_write_is_not_kept(self):
+        menus = MenuCache()
+        generation = menus.generation
+        menus.invalidate()
+        self.assertEqual(menus.store('long', b'[]', generation).body, b'[]')
+        self.assertIsNone(menus.peek('long'))
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'cache.py'), cache.__file__,
+            shallow=False), 'run `python shared/sync.py`')
+
+
+class InventoryTestCase(unittest.TestCase):
+    """the vectorized inventory and its endpoints"""
+
+    def setUp(self):
+        self.inventory = Inventory()
+        self.inventory.load(
+            [(1, 'latte', [ingredient('coffee', 1), ingredient('milk', 3)]),
+             (2, 'espresso', [ingredient('coffee', 1)]),
+             (3, 'cocoa', [ingredient('cocoa', 2), ingredient('milk', 2)])],
+            [('coffee', 10, 0.5), ('milk', 6, 0.1)])
+
+    def test_costs_and_servings(self):
+        self.assertAlmostEqual(self.inventory.drink_cost(1), 0.8)
+        self.assertEqual(self.inventory.makeable(),
+                         [(1, 'latte', 2), (2, 'espresso', 10)])
+
+    def test_stock_change_recomputes_users(self):
+        self.inventory.set_ingredient('cocoa', stock=4)
+        self.assertEqual(self.inventory.makeable()[-1], (3, 'cocoa', 2))
+        self.inventory.set_ingredient('milk', stock=0)
+        self.assertEqual(self.inventory.makeable(), [(2, 'espresso', 10)])
+
+    def test_apply_updates_and_removes_rows(self):
+        self.inventory.apply(
+            [(2, 'doppio', [ingredient('coffee', 2)]),
+             (4, 'flat white', [ingredient('coffee', 1),
+                                ingredient('oat milk', 1)])],
+            {1, 2, 4})
+        self.inventory.set_ingredient('oat milk', stock=1)
+        self.assertEqual(self.inventory.makeable(),
+                         [(2, 'doppio', 5), (4, 'flat white', 1)])
+        with self.assertRaises(KeyError):
+            self.inventory.drink_cost(1)
+
+    def test_unreadable_recipes_are_left_out(self):
+        self.inventory.load([(1, 'broken', [1, 2]), (2, 'bad', None),
+                             (3, 'espresso', [ingredient('coffee', 1)])],
+                            [('coffee', 2, 0.5)])
+        self.assertEqual(self.inventory.makeable(), [(3, 'espresso', 2)])
+        self.inventory.apply([(3, 'espresso', [{'name': 'coffee'}])], {3})
+        self.assertNotIn(3, self.inventory)
+
+    def test_rollup(self):
+        ingredients, total = self.inventory.rollup({1: 3, 2: 2})
+        self.assertEqual(ingredients, [('coffee', 5.0, 2.5, 0.0),
+                                       ('milk', 9.0, 0.9, 3.0)])
+        self.assertAlmostEqual(total, 3.4)
+
+
+class OrderWriterTestCase(unittest.TestCase):
+    """group commits of the background order writer"""
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.writing = threading.Event()
+
+    def write_batch(self, batch):
+        self.writing.set()
+        self.release.wait()
+        if any(order['id'] == 'bad' for order in batch):
+            raise ValueError('bad order')
+        self.batches.append([order['id'] for order in batch])
+
+    def test_orders_are_grouped(self):
+        self.release.clear()
+        writer = OrderWriter(self.write_batch, batch_size=3,
+                             max_latency=0.05)
+        writer.submit({'id': 0})
+        for id in range(1, 5):
+            writer.submit({'id': id})
+        self.release.set()
+        writer.flush()
+        self.assertEqual(sum(self.batches, []), [0, 1, 2, 3, 4])
+        self.assertLess(len(self.batches), 5)
+
+    def test_full_queue_raises(self):
+        self.release.clear()
+        writer = OrderWriter(self.write_batch, batch_size=1, queue_size=1)
+        writer.submit({'id': 0})
+        self.writing.wait(5)
+        writer.submit({'id': 1})
+        try:
+            with self.assertRaises(OrderQueueFull):
+                writer.submit({'id': 2})
+        finally:
+            self.release.set()
+        writer.flush()
+
+    def test_failed_batch_is_retried_per_order(self):
+        self.release.clear()
+        writer = OrderWriter(self.write_batch, batch_size=10,
+                             max_latency=0.05,
+                             logger=logging.getLogger('order-writer-test'))
+        writer.logger.disabled = True
+        for id in (1, 'bad', 2):
+            writer.submit({'id': id})
+        self.release.set()
+        writer.flush()
+        self.assertEqual(sorted(sum(self.batches, [])), [1, 2])
+        self.assertEqual(writer.failed, 1)
+
+
+class ResponsesTestCase(unittest.TestCase):
+    """json provider and compression of the shared response layer"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['RESPONSE_COMPRESS_MIN_SIZE'] = 200
+        init_responses(self.app)
+
+        @self.app.route('/items/<int:count>')
+        def items(count):
+            response = jsonify_items(count)
+            response.set_etag('v{}'.format(count))
+            return response.make_conditional(request)
+
+        def jsonify_items(count):
+            return self.app.json.response(
+                {'items': [{'id': i, 'name': 'item'} for i in range(count)],
+                 'big': 2 ** 70, 'at': datetime(2020, 1, 2)})
+
+        self.client = self.app.test_client()
+
+    def test_large_body_is_gzipped(self):
+        res = self.client.get('/items/50',
+                              headers={'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        data = json.loads(gzip.decompress(res.data))
+        self.assertEqual(len(data['items']), 50)
+        self.assertEqual(data['big'], 2 ** 70)
+
+    def test_weak_etag_still_matches(self):
+        res = self.client.get('/items/50', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers['ETag'], 'W/"v50"')
+        res = self.client.get('/items/50', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    def test_small_or_unaccepted_body_is_plain(self):
+        res = self.client.get('/items/0', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+        res = self.client.get('/items/50')
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(json.loads(res.data)['at'],
+                         'Thu, 02 Jan 2020 00:00:00 GMT')
+
+    def test_dumps(self):
+        self.assertEqual(json.loads(dumps({'a': [1, 'b']})), {'a': [1, 'b']})
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'responses.py'), responses.__file__,
+            shallow=False), 'run `python shared/sync.py`')
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class RequestLogTestCase(unittest.TestCase):
+    """sampled, queue backed request logging"""
+
+    def make_app(self, sample_rate):
+        app = Flask(__name__)
+        app.config['REQUEST_LOG_SAMPLE_RATE'] = sample_rate
+        self.handler = ListHandler()
+        self.listener = init_request_log(app, handlers=[self.handler])
+
+        @app.route('/ok')
+        def ok():
+            return 'ok'
+
+        @app.route('/fail')
+        def fail():
+            return 'fail', 500
+
+        @app.route('/stream')
+        def stream():
+            def generate():
+                for i in range(5):
+                    self.streamed += 1
+                    yield '{}\n'.format(i)
+            return app.response_class(generate())
+        self.streamed = 0
+        return app.test_client()
+
+    def requests_logged(self):
+        self.listener.stop()
+        return [r.fields for r in self.handler.records
+                if r.getMessage() == 'request']
+
+    def test_request_fields(self):
+        self.make_app(1.0).get('/ok')
+        fields, = self.requests_logged()
+        self.assertEqual((fields['method'], fields['path'], fields['status']),
+                         ('GET', '/ok', 200))
+        self.assertGreaterEqual(fields['duration_ms'], 0)
+        self.assertEqual(fields['bytes'], 2)
+
+    def test_streamed_body_is_not_buffered(self):
+        res = self.make_app(1.0).get('/stream', buffered=False)
+        # the test client reads the first chunk to start the response
+        self.assertLessEqual(self.streamed, 1)
+        self.assertEqual(res.get_data(), b'0\n1\n2\n3\n4\n')
+        fields, = self.requests_logged()
+        self.assertIsNone(fields['bytes'])
+
+    def test_sampling_keeps_errors(self):
+        client = self.make_app(0.0)
+        client.get('/ok')
+        client.get('/fail')
+        self.assertEqual([f['status'] for f in self.requests_logged()],
+                         [500])
+
+    @unittest.skipUnless(os.path.isdir(SHARED), 'outside the repository')
+    def test_matches_shared_copy(self):
+        self.assertTrue(filecmp.cmp(
+            os.path.join(SHARED, 'request_log.py'), request_log.__file__,
+            shallow=False), 'run `python shared/sync.py`')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import MetaData, create_engine
+
+from src.database.migrations import upgrade
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(
+        os.path.join(tempfile.mkdtemp(), 'test.db'))
+    upgrade(create_engine(os.environ['DATABASE_URL']))
+
+from src import api  # noqa: E402
+from src import asgi  # noqa: E402
+from src.asgi import app, async_database_url  # noqa: E402
+from src.auth import auth  # noqa: E402
+from src.auth.jwks import JWKSKeyStore  # noqa: E402
+from src.auth.token_cache import TokenCache  # noqa: E402
+from src.database import models  # noqa: E402
+from src.database.inventory import inventory  # noqa: E402
+from src.database.menu_cache import menu_cache  # noqa: E402
+from test_auth import make_key, make_token  # noqa: E402
+
+MANAGER = ['get:drinks-detail', 'post:drinks', 'patch:drinks',
+           'delete:drinks']
+ESPRESSO = [{'color': 'brown', 'name': 'coffee', 'parts': 1}]
+
+
+def reset_database():
+    engine = create_engine(models.database_path)
+    metadata = MetaData()
+    metadata.reflect(engine)
+    metadata.drop_all(engine)
+    upgrade(engine)
+    engine.dispose()
+    menu_cache.invalidate()
+    inventory.invalidate()
+
+
+class AsgiTestCase(unittest.IsolatedAsyncioTestCase):
+    """the ASGI variant of the coffee shop api"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, jwk = make_key('key-a')
+        cls.jwks = {'keys': [jwk]}
+
+    async def asyncSetUp(self):
+        reset_database()
+        self.original_store = auth.jwks_store
+        self.original_cache = auth.token_cache
+        self.fetches = 0
+
+        def fetch():
+            self.fetches += 1
+            return self.jwks
+
+        auth.jwks_store = JWKSKeyStore('stand-in', fetch=fetch)
+        auth.token_cache = TokenCache()
+        self.serving = app.test_app()
+        await self.serving.__aenter__()
+        self.client = app.test_client()
+
+    async def asyncTearDown(self):
+        await self.serving.__aexit__(None, None, None)
+        auth.jwks_store = self.original_store
+        auth.token_cache = self.original_cache
+
+    def headers(self, permissions=MANAGER):
+        token = make_token(self.pem, 'key-a', permissions)
+        return {'Authorization': 'Bearer ' + token}
+
+    async def post_drink(self, title, recipe=ESPRESSO):
+        res = await self.client.post('/drinks', headers=self.headers(),
+                                     json={'title': title, 'recipe': recipe})
+        return (await res.get_json())['drinks']['id']
+
+    def test_async_database_url(self):
+        self.assertEqual(
+            async_database_url('sqlite:///drinks.db').drivername,
+            'sqlite+aiosqlite')
+        self.assertEqual(
+            async_database_url('postgresql://localhost/coffee').drivername,
+            'postgresql+asyncpg')
+
+    async def test_get_drinks_and_304(self):
+        await self.post_drink('espresso')
+        res = await self.client.get('/drinks')
+        data = await res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['drinks'][0]['recipe'],
+                         [{'color': 'brown', 'parts': 1}])
+        res = await self.client.get(
+            '/drinks', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    async def test_drinks_detail_pages_and_stream(self):
+        for title in ('a', 'b', 'c'):
+            await self.post_drink(title)
+        res = await self.client.get('/drinks-detail?limit=2',
+                                    headers=self.headers())
+        data = await res.get_json()
+        self.assertEqual([d['title'] for d in data['drinks']], ['a', 'b'])
+        res = await self.client.get(
+            '/drinks-detail?cursor={}'.format(data['next_cursor']),
+            headers=self.headers())
+        self.assertEqual([d['title'] for d in (await res.get_json())
+                          ['drinks']], ['c'])
+        res = await self.client.get('/drinks?format=ndjson')
+        lines = (await res.get_data(as_text=True)).splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines],
+                         ['a', 'b', 'c'])
+
+    async def test_drinks_detail_requires_permission(self):
+        res = await self.client.get('/drinks-detail',
+                                    headers=self.headers(['post:drinks']))
+        self.assertEqual(res.status_code, 403)
+        res = await self.client.get('/drinks-detail')
+        self.assertEqual(res.status_code, 401)
+
+    async def test_signing_key_is_fetched_once(self):
+        await self.client.get('/drinks-detail', headers=self.headers())
+        await self.client.get('/drinks-detail', headers=self.headers())
+        self.assertEqual(self.fetches, 1)
+
+    async def test_patch_and_delete_drink(self):
+        id = await self.post_drink('espresso')
+        await self.client.get('/drinks')
+        res = await self.client.patch('/drinks/{}'.format(id),
+                                      headers=self.headers(),
+                                      json={'title': 'ristretto',
+                                            'recipe': None})
+        self.assertEqual((await res.get_json())['drinks']['title'],
+                         'ristretto')
+        res = await self.client.get('/drinks')
+        self.assertEqual((await res.get_json())['drinks'][0]['title'],
+                         'ristretto')
+        res = await self.client.delete('/drinks/{}'.format(id),
+                                       headers=self.headers())
+        self.assertEqual((await res.get_json())['delete'], id)
+        res = await self.client.delete('/drinks/{}'.format(id),
+                                       headers=self.headers())
+        self.assertEqual(res.status_code, 404)
+
+    async def test_patch_with_stale_etag_is_412(self):
+        id = await self.post_drink('espresso')
+        headers = dict(self.headers(), **{'If-Match': '"1"'})
+        res = await self.client.patch('/drinks/{}'.format(id),
+                                      headers=headers,
+                                      json={'title': 'ristretto',
+                                            'recipe': None})
+        self.assertEqual(res.headers['ETag'], '"2"')
+        res = await self.client.patch('/drinks/{}'.format(id),
+                                      headers=headers,
+                                      json={'title': 'doppio',
+                                            'recipe': None})
+        self.assertEqual(res.status_code, 412)
+
+    async def test_patch_of_drink_deleted_meanwhile_is_404(self):
+        id = await self.post_drink('espresso')
+        update_by_id = models.Drink.update_by_id
+
+        def update_then_delete(id, session, **kwargs):
+            updated = update_by_id(id, session=session, **kwargs)
+            models.Drink.delete_by_id(id, session=session)
+            return updated
+
+        with mock.patch.object(models.Drink, 'update_by_id',
+                               update_then_delete):
+            res = await self.client.patch('/drinks/{}'.format(id),
+                                          headers=self.headers(),
+                                          json={'title': 'ristretto',
+                                                'recipe': None})
+        self.assertEqual(res.status_code, 404)
+
+    async def test_malformed_recipe_is_422(self):
+        res = await self.client.post('/drinks', headers=self.headers(),
+                                     json={'title': 'broken',
+                                           'recipe': [1, 2]})
+        self.assertEqual(res.status_code, 422)
+        id = await self.post_drink('espresso')
+        res = await self.client.patch('/drinks/{}'.format(id),
+                                      headers=self.headers(),
+                                      json={'title': None, 'recipe': [1]})
+        self.assertEqual(res.status_code, 422)
+
+    async def test_bulk_upsert(self):
+        await self.post_drink('espresso')
+        res = await self.client.post('/drinks/bulk', headers=self.headers(),
+                                     json=[{'title': 'espresso',
+                                            'recipe': ESPRESSO},
+                                           {'title': 'latte',
+                                            'recipe': ESPRESSO},
+                                           {'title': 'broken'}])
+        data = await res.get_json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['created'], data['updated'], data['failed']),
+                         (1, 1, 1))
+
+    async def test_inventory_and_makeable_drinks(self):
+        headers = self.headers(['get:drinks-detail', 'post:drinks',
+                                'get:inventory', 'patch:inventory'])
+        res = await self.client.post('/drinks', headers=headers, json={
+            'title': 'espresso',
+            'recipe': [{'color': 'brown', 'name': 'coffee', 'parts': 2}]})
+        id = (await res.get_json())['drinks']['id']
+        res = await self.client.patch('/inventory/coffee', headers=headers,
+                                      json={'stock': 5, 'unit_cost': 0.5})
+        self.assertEqual((await res.get_json())['ingredient']['stock'], 5)
+        res = await self.client.get('/drinks/makeable', headers=headers)
+        self.assertEqual((await res.get_json())['drinks'],
+                         [{'id': id, 'title': 'espresso', 'servings': 2}])
+        res = await self.client.get('/inventory', headers=headers)
+        self.assertEqual((await res.get_json())['ingredients'],
+                         [{'name': 'coffee', 'stock': 5, 'unit_cost': 0.5}])
+        res = await self.client.post('/inventory/rollup', headers=headers,
+                                     json={'volumes': {str(id): 3}})
+        self.assertEqual((await res.get_json())['total_cost'], 3.0)
+        res = await self.client.post('/inventory/rollup', headers=headers,
+                                     json={'volumes': {'1000': 1}})
+        self.assertEqual(res.status_code, 422)
+
+    async def test_post_order_is_written_in_the_background(self):
+        id = await self.post_drink('espresso')
+        res = await self.client.post('/orders',
+                                     headers=self.headers(['post:orders']),
+                                     json={'items': [{'drink_id': id}]})
+        self.assertEqual(res.status_code, 202)
+        order_id = (await res.get_json())['order']
+        asgi.order_writer.flush()
+        engine = create_engine(models.database_path)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(
+                models.Order.__table__.select().with_only_columns(
+                    [models.Order.id])).scalars().all(), [order_id])
+        engine.dispose()
+        res = await self.client.post('/orders',
+                                     headers=self.headers(['post:orders']),
+                                     json={'items': [{'drink_id': 1000}]})
+        self.assertEqual(res.status_code, 400)
+
+    async def test_menu_bytes_match_the_wsgi_app(self):
+        await self.post_drink('espresso')
+        res = await self.client.get('/drinks')
+        self.assertEqual(res.mimetype, 'application/json')
+        body = await res.get_data()
+        menu_cache.invalidate()
+        wsgi = api.app.test_client().get('/drinks')
+        self.assertEqual(wsgi.data, body)
+        self.assertEqual(wsgi.headers['ETag'], res.headers['ETag'])
+
+    def test_routes_match_the_wsgi_app(self):
+        def routes(app):
+            return {(rule.rule, method) for rule in app.url_map.iter_rules()
+                    if rule.endpoint != 'static'
+                    for method in rule.methods - {'HEAD', 'OPTIONS'}}
+        self.assertEqual(routes(app), routes(api.app))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,352 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+from flask import Flask
+from jose import jwt
+
+from src.auth import auth
+from src.auth.auth import (AuthError, verify_decode_jwt, requires_auth,
+                           check_permissions)
+from src.auth.jwks import JWKSKeyStore, JWKSError
+from src.auth.token_cache import TokenCache
+
+
+def b64_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def make_key(kid):
+    key = RSA.generate(2048)
+    jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': b64_uint(key.n),
+        'e': b64_uint(key.e)
+    }
+    return key.export_key('PEM').decode('ascii'), jwk
+
+
+def make_token(private_pem, kid, permissions=(), expires_in=3600):
+    claims = {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|tester',
+        'exp': int(time.time()) + expires_in,
+        'permissions': list(permissions)
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256',
+                      headers={'kid': kid})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """Key store behaviour against a local JWKS file"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem_a, cls.jwk_a = make_key('key-a')
+        cls.pem_b, cls.jwk_b = make_key('key-b')
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.write_jwks(self.jwk_a)
+        self.clock = FakeClock()
+        self.fetches = 0
+        self.store = JWKSKeyStore(
+            'file://' + self.path, ttl=60, stale_grace=120,
+            min_refetch_interval=10, clock=self.clock)
+        fetch = self.store._fetch_jwks
+
+        def counting_fetch():
+            self.fetches += 1
+            return fetch()
+        self.store._fetch_jwks = counting_fetch
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write_jwks(self, *keys):
+        with open(self.path, 'w') as f:
+            json.dump({'keys': list(keys)}, f)
+
+    def test_keys_are_fetched_once_while_fresh(self):
+        for _ in range(5):
+            self.assertEqual(self.store.get_key('key-a')['n'],
+                             self.jwk_a['n'])
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_triggers_one_refetch(self):
+        self.store.get_key('key-a')
+        self.write_jwks(self.jwk_a, self.jwk_b)
+        self.clock.now += 11
+        self.assertEqual(self.store.get_key('key-b')['n'], self.jwk_b['n'])
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_key('key-a')
+        self.assertIsNone(self.store.get_key('forged'))
+        self.assertIsNone(self.store.get_key('forged'))
+        self.assertEqual(self.fetches, 1)
+
+    def test_stale_keys_served_within_grace(self):
+        self.store.get_key('key-a')
+        os.remove(self.path)
+        self.clock.now += 100
+        self.store.refresh()
+        self.assertIsNotNone(self.store.get_key('key-a'))
+
+    def test_stale_keys_dropped_after_grace(self):
+        self.store.get_key('key-a')
+        os.remove(self.path)
+        self.clock.now += 200
+        with self.assertRaises(JWKSError):
+            self.store.get_key('key-a')
+
+    def test_expired_ttl_refreshes_in_background(self):
+        self.store.get_key('key-a')
+        self.write_jwks(self.jwk_b)
+        self.clock.now += 61
+        self.assertIsNotNone(self.store.get_key('key-a'))
+        for _ in range(100):
+            if self.store.get_key('key-b') is not None:
+                break
+            time.sleep(0.01)
+        self.assertIsNotNone(self.store._keys.get('key-b'))
+
+    def test_slow_refresh_does_not_block_stale_lookups(self):
+        self.store.get_key('key-a')
+        started, release = threading.Event(), threading.Event()
+
+        def slow_failing_fetch():
+            self.fetches += 1
+            started.set()
+            release.wait(5)
+            raise OSError('unreachable')
+        self.store._fetch_jwks = slow_failing_fetch
+        self.clock.now += 61
+        self.assertIsNotNone(self.store.get_key('key-a'))
+        self.assertTrue(started.wait(5))
+        begin = time.monotonic()
+        for _ in range(10):
+            self.assertIsNotNone(self.store.get_key('key-a'))
+            self.assertIsNotNone(self.store.peek('key-a'))
+        self.assertLess(time.monotonic() - begin, 0.5)
+        release.set()
+        self.assertEqual(self.fetches, 2)
+
+    def test_failed_refresh_backs_off(self):
+        self.store.get_key('key-a')
+        os.remove(self.path)
+        self.clock.now += 61
+        self.store.refresh()
+        self.store.get_key('key-a')
+        self.assertEqual(self.fetches, 2)
+        self.clock.now += 11
+        self.store.get_key('key-a')
+        for _ in range(100):
+            if not self.store._refreshing.locked():
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.fetches, 3)
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+    """verify_decode_jwt against a local JWKS file"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, jwk = make_key('key-a')
+        fd, cls.path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'keys': [jwk]}, f)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.original_store = auth.jwks_store
+        auth.jwks_store = JWKSKeyStore('file://' + self.path)
+
+    def tearDown(self):
+        auth.jwks_store = self.original_store
+
+    def test_valid_token_is_decoded(self):
+        token = make_token(self.pem, 'key-a', ['get:drinks-detail'])
+        payload = verify_decode_jwt(token)
+        self.assertEqual(payload['permissions'], ['get:drinks-detail'])
+
+    def test_expired_token_is_rejected(self):
+        token = make_token(self.pem, 'key-a', expires_in=-10)
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(token)
+        self.assertEqual(ctx.exception.status_code, 401)
+
+    def test_unknown_kid_is_rejected(self):
+        token = make_token(self.pem, 'key-z')
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(token)
+        self.assertEqual(ctx.exception.status_code, 400)
+
+    def test_unreachable_jwks_is_503(self):
+        auth.jwks_store = JWKSKeyStore('file:///nonexistent/jwks.json')
+        token = make_token(self.pem, 'key-a')
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(token)
+        self.assertEqual(ctx.exception.status_code, 503)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """Verified-token cache expiry, eviction and counters"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(maxsize=2, clock=self.clock)
+
+    def test_hit_and_miss_are_counted(self):
+        self.assertIsNone(self.cache.get('t1'))
+        self.cache.put('t1', {'exp': 2000})
+        self.assertEqual(self.cache.get('t1').payload, {'exp': 2000})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_entry_expires_at_exp(self):
+        self.cache.put('t1', {'exp': 1010})
+        self.clock.now = 1010
+        self.assertIsNone(self.cache.get('t1'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put('t1', {'exp': 2000})
+        self.cache.put('t2', {'exp': 2000})
+        self.cache.get('t1')
+        self.cache.put('t3', {'exp': 2000})
+        self.assertIsNone(self.cache.get('t2'))
+        self.assertIsNotNone(self.cache.get('t1'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_payload_without_exp_is_not_cached(self):
+        self.cache.put('t1', {'sub': 'x'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_permissions_are_compiled_once(self):
+        self.cache.put('t1', {'exp': 2000, 'permissions': ['a', 'b']})
+        self.assertEqual(self.cache.get('t1').permissions,
+                         frozenset(['a', 'b']))
+
+
+class CheckPermissionsTestCase(unittest.TestCase):
+    """single, any-of and all-of permission requirements"""
+
+    payload = {'permissions': ['get:drinks-detail', 'post:drinks']}
+
+    def assertForbidden(self, *args, **kwargs):
+        with self.assertRaises(AuthError) as ctx:
+            check_permissions(*args, **kwargs)
+        self.assertEqual(ctx.exception.status_code, 403)
+
+    def test_single_permission(self):
+        self.assertTrue(check_permissions('post:drinks', self.payload))
+        self.assertForbidden('delete:drinks', self.payload)
+
+    def test_empty_permission_is_still_required(self):
+        self.assertForbidden('', self.payload)
+
+    def test_any_of(self):
+        self.assertTrue(check_permissions(
+            '', self.payload, any_of={'delete:drinks', 'post:drinks'}))
+        self.assertForbidden(
+            '', self.payload, any_of={'delete:drinks', 'patch:drinks'})
+
+    def test_all_of(self):
+        self.assertTrue(check_permissions(
+            '', self.payload, all_of={'get:drinks-detail', 'post:drinks'}))
+        self.assertForbidden(
+            '', self.payload, all_of={'post:drinks', 'patch:drinks'})
+
+    def test_missing_claim_is_400(self):
+        with self.assertRaises(AuthError) as ctx:
+            check_permissions('post:drinks', {})
+        self.assertEqual(ctx.exception.status_code, 400)
+
+
+class RequiresAuthTestCase(unittest.TestCase):
+    """requires_auth only verifies a token once"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pem, jwk = make_key('key-a')
+        cls.jwks = {'keys': [jwk]}
+
+    def setUp(self):
+        self.fetches = 0
+
+        def fetch():
+            self.fetches += 1
+            return self.jwks
+        self.original_store = auth.jwks_store
+        self.original_cache = auth.token_cache
+        auth.jwks_store = JWKSKeyStore('stand-in', fetch=fetch)
+        auth.token_cache = TokenCache()
+        self.app = Flask(__name__)
+        self.app.testing = True
+
+        @self.app.route('/protected')
+        @requires_auth('get:drinks-detail')
+        def protected(payload):
+            return payload['sub']
+
+        @self.app.route('/manage')
+        @requires_auth(any_of=['patch:drinks', 'delete:drinks'])
+        def manage(payload):
+            return payload['sub']
+
+    def tearDown(self):
+        auth.jwks_store = self.original_store
+        auth.token_cache = self.original_cache
+
+    def get(self, token):
+        return self.app.test_client().get(
+            '/protected', headers={'Authorization': 'Bearer ' + token})
+
+    def test_second_request_is_served_from_cache(self):
+        token = make_token(self.pem, 'key-a', ['get:drinks-detail'])
+        self.assertEqual(self.get(token).status_code, 200)
+        self.assertEqual(self.get(token).status_code, 200)
+        stats = auth.token_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(self.fetches, 1)
+
+    def test_cached_token_still_checks_permission(self):
+        token = make_token(self.pem, 'key-a', ['post:drinks'])
+        with self.assertRaises(AuthError):
+            self.app.test_client().get(
+                '/protected', headers={'Authorization': 'Bearer ' + token})
+        self.assertEqual(len(auth.token_cache), 1)
+
+    def test_any_of_decorator(self):
+        token = make_token(self.pem, 'key-a', ['delete:drinks'])
+        res = self.app.test_client().get(
+            '/manage', headers={'Authorization': 'Bearer ' + token})
+        self.assertEqual(res.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# vendored copy, the source of truth is shared/request_log.py at the root
+# of the repository: edit it there and run `python shared/sync.py`
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from flask import g, request
+from flask.logging import default_handler
+
+
+'''
+JSONFormatter
+formats a log record as one json object per line
+    extra fields are passed with extra={'fields': {...}}
+'''
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+'''
+DroppingQueueHandler
+a QueueHandler that never blocks the request thread
+    when the queue is full the record is dropped and counted
+'''
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+'''
+init_request_log(app, handlers)
+    sets up structured, sampled request logging for a Flask app
+    records are put on a bounded in-memory queue and written by a
+    QueueListener thread, so requests never wait on log I/O
+        handlers: where the listener writes records, defaults to stderr
+    every request gets method, path, status, duration_ms and bytes fields,
+    bytes is null for streamed responses
+    configuration, app.config first, then the environment:
+        REQUEST_LOG_SAMPLE_RATE: share of requests logged, 0.0 to 1.0
+            (default 1.0), errors and slow requests are always logged
+        REQUEST_LOG_SLOW_MS: duration from which a request is always logged
+            (default 1000)
+        REQUEST_LOG_QUEUE_SIZE: records buffered before dropping
+            (default 10000)
+    app.logger is routed through the same queue
+    returns the started QueueListener
+'''
+
+
+def init_request_log(app, handlers=None):
+    def setting(name, default, cast):
+        return cast(app.config.get(name, os.environ.get(name, default)))
+
+    sample_rate = setting('REQUEST_LOG_SAMPLE_RATE', 1.0, float)
+    slow_ms = setting('REQUEST_LOG_SLOW_MS', 1000, float)
+    queue_size = setting('REQUEST_LOG_QUEUE_SIZE', 10000, int)
+
+    if not handlers:
+        handlers = [logging.StreamHandler()]
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(JSONFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    listener = logging.handlers.QueueListener(
+        queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    @atexit.register
+    def flush_request_log():
+        # the listener may already have been stopped by its owner
+        if listener._thread is not None:
+            listener.stop()
+
+    logger = logging.getLogger('{}.requests'.format(app.import_name))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(queue_handler)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+    app.extensions['request_log'] = queue_handler
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        duration_ms = (time.perf_counter() - started) * 1000
+        if (response.status_code < 500 and duration_ms < slow_ms and
+                random.random() >= sample_rate):
+            return response
+        logger.info('request', extra={'fields': {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 3),
+            # reading the length of a streamed body would buffer it
+            'bytes': (None if response.is_streamed
+                      else response.calculate_content_length()),
+            'sample_rate': sample_rate
+        }})
+        return response
+
+    return listener
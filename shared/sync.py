@@ -0,0 +1,67 @@
+import filecmp
+import os
+import shutil
+import sys
+
+
+'''
+copies the shared modules into the apps that vendor them
+
+    python shared/sync.py
+        updates every copy from shared/
+    python shared/sync.py --check
+        lists the copies that differ from shared/, exits 1 if there are any
+
+the projects are deployed on their own, so each keeps a copy of the
+modules it uses; only the file in shared/ is ever edited
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COPIES = {
+    'cache.py': [
+        'projects/02_trivia_api/starter/backend/cache.py',
+        'projects/03_coffee_shop_full_stack/starter_code/backend/src/'
+        'database/cache.py',
+    ],
+    'responses.py': [
+        'FlaskRecap/responses.py',
+        'projects/02_trivia_api/starter/backend/flaskr/responses.py',
+        'projects/03_coffee_shop_full_stack/starter_code/backend/src/'
+        'responses.py',
+    ],
+    'request_log.py': [
+        'projects/01_fyyur/starter_code/request_log.py',
+        'projects/03_coffee_shop_full_stack/starter_code/backend/src/'
+        'request_log.py',
+    ],
+}
+
+
+def stale_copies():
+    stale = []
+    for name, copies in COPIES.items():
+        source = os.path.join(ROOT, 'shared', name)
+        for copy in copies:
+            path = os.path.join(ROOT, copy)
+            if (not os.path.exists(path) or
+                    not filecmp.cmp(source, path, shallow=False)):
+                stale.append((source, path))
+    return stale
+
+
+def main(argv):
+    stale = stale_copies()
+    if '--check' in argv:
+        for source, path in stale:
+            print('{} differs from {}'.format(os.path.relpath(path, ROOT),
+                                             os.path.relpath(source, ROOT)))
+        return 1 if stale else 0
+    for source, path in stale:
+        shutil.copyfile(source, path)
+        print('updated {}'.format(os.path.relpath(path, ROOT)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))